@@ -0,0 +1,170 @@
+# Generator of synthetic designs for benchmarking the compiler.
+from __future__ import annotations
+from dataclasses import dataclass, asdict, fields, replace
+from typing import *
+import argparse
+import os
+import random
+
+
+# The shape of a synthetic design. Modules are arranged in `depth` levels of
+# hierarchy, where each module instantiates `fanout` modules of the next level
+# down and the last level only instantiates the primitive modules. Every module
+# has one clock and one input per clock domain, and consists of `stmts`
+# statements, whose right-hand sides nest `nesting` calls deep. The modules
+# are spread evenly across `files` files, the first of which imports all
+# others. A nonzero `size` overrides `modules` with the number of modules for
+# which each file holds about `size` bytes.
+@dataclass
+class DesignParams:
+    modules: int = 200
+    stmts: int = 20
+    fanout: int = 2
+    depth: int = 4
+    nesting: int = 1
+    domains: int = 1
+    files: int = 1
+    size: int = 0
+    seed: int = 0
+
+
+# Primitive modules that all generated modules build upon.
+PRIMITIVES = """\
+mod add<U>(a: u32 @U, b: u32 @U) -> (z: u32 @U) {}
+mod reg<CD>(clock: Clock<CD>, d: u32 @CD) -> (q: u32 @CD) {}
+"""
+
+
+# Generate a design. Returns the contents of each file, keyed by file name,
+# with `name` being the name of the first file. The design is free of errors.
+def generate_design(params: DesignParams,
+                    name: str = "design") -> Dict[str, str]:
+    if params.size > 0:
+        params = scale_to_size(params)
+    rng = random.Random(params.seed)
+    levels = max(1, min(params.depth, params.modules))
+    level_of = [
+        i * levels // max(params.modules, 1) for i in range(params.modules)
+    ]
+    by_level: List[List[int]] = [[] for _ in range(levels)]
+    for index, level in enumerate(level_of):
+        by_level[level].append(index)
+
+    modules = []
+    for index in range(params.modules):
+        level = level_of[index]
+        callees = by_level[level + 1] if level + 1 < levels else []
+        chosen = [rng.choice(callees)
+                  for _ in range(params.fanout)] if callees else []
+        modules.append(generate_module(params, index, chosen))
+
+    # Spread the modules across files.
+    num_files = max(1, min(params.files, max(params.modules, 1)))
+    file_names = [name] + [f"{name}_{i}" for i in range(1, num_files)]
+    contents: Dict[str, List[str]] = {n: [] for n in file_names}
+    contents[name].extend(f"use {n};\n" for n in file_names[1:])
+    contents[name].append(PRIMITIVES)
+    for index, module in enumerate(modules):
+        contents[file_names[index * num_files // len(modules)]].append(module)
+    return {n + ".doty": "".join(text) for n, text in contents.items()}
+
+
+# Choose the number of modules for the size target of a design. The size of a
+# module depends on the other parameters, so the number is refined a few times
+# by generating the design and scaling it by how far off its size is.
+def scale_to_size(params: DesignParams) -> DesignParams:
+    target = params.size * max(params.files, 1)
+    modules = max(params.modules, 1)
+    for _ in range(4):
+        design = generate_design(replace(params, modules=modules, size=0))
+        total = sum(len(text) for text in design.values())
+        if abs(total - target) <= target // 100:
+            break
+        modules = max(1, round(modules * target / total))
+    return replace(params, modules=modules, size=0)
+
+
+def generate_module(params: DesignParams, index: int,
+                    callees: List[int]) -> str:
+    domains = range(max(params.domains, 1))
+    type_vars = ", ".join(f"C{d}" for d in domains)
+    ports = [f"clock{d}: Clock<C{d}>" for d in domains]
+    ports += [f"x{d}: u32 @C{d}" for d in domains]
+    lines = [
+        f"mod m{index}<{type_vars}>({', '.join(ports)}) -> (y: u32 @C0) {{\n"
+    ]
+
+    # Each domain computes a chain of values starting at its input. Every
+    # statement extends the chain of one domain, either by instantiating the
+    # next callee, by registering the value, or by adding the input to it.
+    last = [f"x{d}" for d in domains]
+    clocks = ", ".join(f"clock{d}" for d in domains)
+    pending = list(callees)
+    for stmt in range(params.stmts):
+        d = stmt % len(domains)
+        if pending and d == 0:
+            inputs = ", ".join(last[e] if e == 0 else f"x{e}" for e in domains)
+            expr = f"m{pending.pop()}({clocks}, {inputs})"
+        elif stmt % 7 == 6:
+            expr = f"reg(clock{d}, {last[d]})"
+        else:
+            expr = last[d]
+            for _ in range(max(params.nesting, 1)):
+                expr = f"add({expr}, x{d})"
+        lines.append(f"    let s{stmt} = {expr};\n")
+        last[d] = f"s{stmt}"
+    lines.append("}\n")
+    return "".join(lines)
+
+
+# Write a design to a directory. Returns the path of the first file.
+def write_design(params: DesignParams,
+                 directory: str,
+                 name: str = "design") -> str:
+    os.makedirs(directory, exist_ok=True)
+    for file_name, text in generate_design(params, name).items():
+        with open(os.path.join(directory, file_name), "w") as f:
+            f.write(text)
+    return os.path.join(directory, name + ".doty")
+
+
+# Add a command line option for each design parameter.
+def add_param_arguments(parser: argparse.ArgumentParser):
+    defaults = DesignParams()
+    for f in fields(DesignParams):
+        parser.add_argument(f"--{f.name}",
+                            metavar="N",
+                            type=int,
+                            default=getattr(defaults, f.name))
+
+
+def params_from_args(args: argparse.Namespace) -> DesignParams:
+    return DesignParams(
+        **{f.name: getattr(args, f.name)
+           for f in fields(DesignParams)})
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic design for benchmarking")
+    parser.add_argument("-o",
+                        "--output",
+                        metavar="DIR",
+                        default=".",
+                        help="Directory to write the design to")
+    parser.add_argument("--name",
+                        default="design",
+                        help="Name of the first file of the design")
+    add_param_arguments(parser)
+    args = parser.parse_args()
+    print(write_design(params_from_args(args), args.output, args.name))
+
+
+if __name__ == "__main__":
+    main()
+
+__all__ = [
+    "DesignParams",
+    "generate_design",
+    "write_design",
+]
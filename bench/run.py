@@ -0,0 +1,190 @@
+# Benchmarks of the compiler passes on synthetic designs. Each benchmark
+# generates a design, runs every pass on it a number of times, and records the
+# fastest and median time of each pass. Results are written as JSON and can be
+# compared against the results of an earlier run:
+#
+#     python -m bench.run -o before.json
+#     python -m bench.run --baseline before.json
+from __future__ import annotations
+from bench.generate import (DesignParams, add_param_arguments,
+                            params_from_args, write_design)
+from dataclasses import asdict
+from typing import *
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+# Benchmarks run by default, each stressing a different aspect of the design.
+PRESETS: Dict[str, DesignParams] = {
+    "small": DesignParams(modules=50, stmts=10),
+    "wide": DesignParams(modules=500, stmts=20, fanout=4, depth=2),
+    "deep": DesignParams(modules=500, stmts=20, fanout=1, depth=50),
+    "long": DesignParams(modules=10, stmts=1000),
+    "nested": DesignParams(modules=200, stmts=20, nesting=20),
+    "domains": DesignParams(modules=200, stmts=40, domains=8),
+    "files": DesignParams(modules=500, stmts=20, files=50),
+    "size": DesignParams(stmts=20, files=4, size=256 * 1024),
+}
+
+# The passes being timed, in the order they run.
+PASSES = ["tokenize", "parse", "resolve_names", "type_check", "dump_ast"]
+
+
+# Run all passes on a design once. Returns the time spent in each pass, in
+# seconds, and the size of the design.
+def run_once(path: str) -> Tuple[Dict[str, float], Dict[str, int]]:
+    from src import ast
+    from src.diagnostics import diagnostics
+    from src.driver import imports, open_source_file
+    from src.lexer import tokenize
+    from src.names import resolve_names
+    from src.parser import parse
+    from src.typeck import type_check
+
+    times = {name: 0.0 for name in PASSES}
+    sizes = {"files": 0, "bytes": 0, "tokens": 0}
+    roots = []
+    paths = [path]
+    while paths:
+        file = open_source_file(paths.pop(0))
+        assert file is not None
+        start = time.perf_counter()
+        tokens = tokenize(file)
+        times["tokenize"] += time.perf_counter() - start
+        start = time.perf_counter()
+        root = parse(tokens)
+        times["parse"] += time.perf_counter() - start
+        roots.append(root)
+        paths += [path for path, _ in imports(root)]
+        sizes["files"] += 1
+        sizes["bytes"] += len(file.contents)
+        sizes["tokens"] += len(tokens)
+    root = ast.Root(loc=roots[0].loc,
+                    items=[item for r in roots for item in r.items])
+
+    start = time.perf_counter()
+    resolve_names(root)
+    times["resolve_names"] = time.perf_counter() - start
+    start = time.perf_counter()
+    type_check(root)
+    times["type_check"] = time.perf_counter() - start
+    start = time.perf_counter()
+    ast.dump_ast(root)
+    times["dump_ast"] = time.perf_counter() - start
+
+    if diagnostics.num_errors > 0:
+        diagnostics.flush()
+        sys.exit(f"error: benchmark design {path} has errors")
+    return times, sizes
+
+
+# Run a benchmark `repeat` times and summarize the time of each pass.
+def run_benchmark(params: DesignParams, repeat: int) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as directory:
+        path = write_design(params, directory)
+        samples: Dict[str, List[float]] = {name: [] for name in PASSES}
+        for _ in range(repeat):
+            times, sizes = run_once(path)
+            for name, t in times.items():
+                samples[name].append(t)
+    return {
+        "params": asdict(params),
+        "sizes": sizes,
+        "timings": {
+            name: {
+                "min": min(ts),
+                "median": statistics.median(ts)
+            }
+            for name, ts in samples.items()
+        },
+    }
+
+
+# Print the timings of each benchmark, and their change relative to a
+# baseline if one is given.
+def print_results(results: Dict[str, Any],
+                  baseline: Optional[Dict[str, Any]] = None):
+    for bench, result in results["benchmarks"].items():
+        sizes = result["sizes"]
+        print(f"{bench}: {sizes['files']} files, {sizes['bytes']} bytes, "
+              f"{sizes['tokens']} tokens")
+        base = (baseline or {}).get("benchmarks", {}).get(bench)
+        for name, timing in result["timings"].items():
+            line = f"  {name:<14} {timing['min'] * 1000:>10.2f} ms"
+            if base and name in base["timings"]:
+                before = base["timings"][name]["min"]
+                if before > 0:
+                    line += (f"  (was {before * 1000:.2f} ms, "
+                             f"{timing['min'] / before:.2f}x)")
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the compiler passes on synthetic designs")
+    parser.add_argument(
+        "benchmarks",
+        metavar="BENCH",
+        nargs="*",
+        help=f"Presets to run (default: all of {', '.join(PRESETS)})")
+    parser.add_argument(
+        "--custom",
+        action="store_true",
+        help="Run a single benchmark with the given parameters")
+    parser.add_argument("-r",
+                        "--repeat",
+                        metavar="N",
+                        type=int,
+                        default=3,
+                        help="Number of times to run each benchmark")
+    parser.add_argument("-o",
+                        "--output",
+                        metavar="PATH",
+                        help="Write the results to PATH as JSON")
+    parser.add_argument(
+        "--baseline",
+        metavar="PATH",
+        help="Compare against results written by an earlier run")
+    add_param_arguments(parser)
+    args = parser.parse_args()
+
+    if args.custom:
+        benchmarks = {"custom": params_from_args(args)}
+    else:
+        for name in args.benchmarks:
+            if name not in PRESETS:
+                parser.error(f"unknown benchmark `{name}`")
+        benchmarks = {
+            name: PRESETS[name]
+            for name in args.benchmarks or PRESETS
+        }
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results: Dict[str, Any] = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "benchmarks": {},
+    }
+    for name, params in benchmarks.items():
+        print(f"running {name}...", file=sys.stderr)
+        results["benchmarks"][name] = run_benchmark(params, args.repeat)
+
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,25 @@
+import atexit
 import lit.formats
+import shutil
+import tempfile
 
 root_dir = os.path.dirname(__file__)
 
 config.name = "Domain Types"
 config.test_format = lit.formats.ShTest()
-config.suffixes = [".doty", ".mlir"]
+config.suffixes = [".doty", ".mlir", ".py"]
 config.test_exec_root = os.path.join(root_dir, "build")
 config.substitutions += [
     ("doty", os.path.join(root_dir, "doty")),
+    ("%python", sys.executable),
 ]
 python_path = root_dir
 if env := os.environ.get("PYTHONPATH"):
     python_path += ":" + env
 config.environment["PYTHONPATH"] = python_path
+
+# Keep the incremental compilation cache of the tests out of the user's cache
+# directory.
+cache_dir = tempfile.mkdtemp(prefix="doty-lit-cache-")
+atexit.register(shutil.rmtree, cache_dir, ignore_errors=True)
+config.environment["DOTY_CACHE_DIR"] = cache_dir
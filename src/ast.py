@@ -1,6 +1,7 @@
 from __future__ import annotations
-from dataclasses import dataclass
-from typing import List, Generator, Optional, Dict
+from dataclasses import dataclass, fields
+from typing import (Any, List, Generator, Iterator, Optional, Dict, ClassVar,
+                    Tuple, get_type_hints, get_origin, get_args)
 from enum import Enum, auto
 from src.lexer import Token
 from src.source import Loc
@@ -11,7 +12,7 @@ class WalkOrder(Enum):
     PostOrder = auto()
 
 
-@dataclass
+@dataclass(slots=True)
 class Binding:
     node: Optional[AstNode] = None
 
@@ -20,32 +21,49 @@ class Binding:
         return self.node
 
 
-@dataclass
+@dataclass(slots=True)
 class AstNode:
     loc: Loc
 
+    # The names of all fields of the node, in declaration order.
+    field_names: ClassVar[Tuple[str, ...]] = ()
+    # The fields that hold child nodes, in declaration order, and whether each
+    # field holds a list of nodes or a single, possibly absent node.
+    child_fields: ClassVar[Tuple[Tuple[str, bool], ...]] = ()
+
+    # Iterate over this node and all its descendants. Uses an explicit stack
+    # instead of recursion, such that arbitrarily deep trees can be walked.
     def walk(self, order: WalkOrder) -> Generator[AstNode, None, None]:
         if order == WalkOrder.PreOrder:
-            yield self
-        for child in self.children():
-            yield from child.walk(order)
-        if order == WalkOrder.PostOrder:
-            yield self
+            stack: List[AstNode] = [self]
+            while stack:
+                node = stack.pop()
+                yield node
+                stack.extend(reversed(list(node.children())))
+            return
+
+        # In post-order, each node is pushed twice: first to expand its
+        # children, then to be yielded once they have all been visited.
+        post_stack: List[Tuple[AstNode, bool]] = [(self, False)]
+        while post_stack:
+            node, expanded = post_stack.pop()
+            if expanded:
+                yield node
+                continue
+            post_stack.append((node, True))
+            post_stack.extend(
+                (child, False) for child in reversed(list(node.children())))
 
     def children(self) -> Generator[AstNode, None, None]:
-
-        def walk_inner(value) -> Generator[AstNode, None, None]:
-            if isinstance(value, AstNode):
+        for name, is_list in self.child_fields:
+            value = getattr(self, name)
+            if is_list:
+                yield from value
+            elif value is not None:
                 yield value
-            elif isinstance(value, list):
-                for v in value:
-                    yield from walk_inner(v)
 
-        for value in self.__dict__.values():
-            yield from walk_inner(value)
 
-
-@dataclass
+@dataclass(slots=True)
 class Root(AstNode):
     items: List[Item]
 
@@ -55,12 +73,12 @@ class Root(AstNode):
 #===------------------------------------------------------------------------===#
 
 
-@dataclass
+@dataclass(slots=True)
 class Item(AstNode):
     pass
 
 
-@dataclass
+@dataclass(slots=True)
 class ModItem(Item):
     full_loc: Loc
     name: Token
@@ -70,21 +88,29 @@ class ModItem(Item):
     stmts: List[Stmt]
 
 
-@dataclass
+# An import of another source file, `use name;`, which adds `name.doty` next to
+# the importing file to the compilation.
+@dataclass(slots=True)
+class UseItem(Item):
+    full_loc: Loc
+    name: Token
+
+
+@dataclass(slots=True)
 class ModArg(AstNode):
     full_loc: Loc
     name: Token
     ty: Type
 
 
-@dataclass
+@dataclass(slots=True)
 class ModResult(AstNode):
     full_loc: Loc
     name: Token
     ty: Type
 
 
-@dataclass
+@dataclass(slots=True)
 class ModTypeVar(AstNode):
     name: Token
 
@@ -94,12 +120,12 @@ class ModTypeVar(AstNode):
 #===------------------------------------------------------------------------===#
 
 
-@dataclass
+@dataclass(slots=True)
 class Stmt(AstNode):
     pass
 
 
-@dataclass
+@dataclass(slots=True)
 class LetStmt(Stmt):
     full_loc: Loc
     name: Token
@@ -107,18 +133,18 @@ class LetStmt(Stmt):
     init: Optional[Expr]
 
 
-@dataclass
+@dataclass(slots=True)
 class TypeVarStmt(Stmt):
     full_loc: Loc
     name: Token
 
 
-@dataclass
+@dataclass(slots=True)
 class ExprStmt(Stmt):
     expr: Expr
 
 
-@dataclass
+@dataclass(slots=True)
 class AssignStmt(Stmt):
     full_loc: Loc
     lhs: Expr
@@ -130,22 +156,22 @@ class AssignStmt(Stmt):
 #===------------------------------------------------------------------------===#
 
 
-@dataclass
+@dataclass(slots=True)
 class Type(AstNode):
     domain: Optional[DomainIdent]
 
 
-@dataclass
+@dataclass(slots=True)
 class U32Type(Type):
     pass
 
 
-@dataclass
+@dataclass(slots=True)
 class ClockType(Type):
     clock_domain: DomainIdent
 
 
-@dataclass
+@dataclass(slots=True)
 class DomainIdent(AstNode):
     binding: Binding
     name: Token
@@ -156,29 +182,90 @@ class DomainIdent(AstNode):
 #===------------------------------------------------------------------------===#
 
 
-@dataclass
+@dataclass(slots=True)
 class Expr(AstNode):
     pass
 
 
-@dataclass
+@dataclass(slots=True)
 class IdentExpr(Expr):
     name: Token
     binding: Binding
 
 
-@dataclass
+@dataclass(slots=True)
 class CallExpr(Expr):
     ident: IdentExpr
     args: List[Expr]
 
 
+# A binary operator applied to two operands, such as `a + b` or `a == b`. The
+# operator is identified by the kind of its token.
+@dataclass(slots=True)
+class BinaryExpr(Expr):
+    op: Token
+    lhs: Expr
+    rhs: Expr
+
+
+# An access to a named field of a value, `base.name`, such as one of the
+# results of a module with multiple results.
+@dataclass(slots=True)
+class FieldExpr(Expr):
+    base: Expr
+    name: Token
+
+
+#===------------------------------------------------------------------------===#
+# Field Tables
+#===------------------------------------------------------------------------===#
+
+
+# Determine whether a field type annotation refers to child nodes. Returns
+# None if it does not, otherwise whether the field holds a list of nodes.
+def classify_field(hint: Any) -> Optional[bool]:
+    if isinstance(hint, type):
+        return False if issubclass(hint, AstNode) else None
+    if get_origin(hint) is list:
+        if classify_field(get_args(hint)[0]) is False:
+            return True
+        return None
+    if any(classify_field(arg) is False for arg in get_args(hint)):
+        return False
+    return None
+
+
+# Populate the field tables of all node classes once at import time, such
+# that traversals never need to inspect fields or type annotations.
+def init_field_tables() -> None:
+    for cls in list(globals().values()):
+        if not isinstance(cls, type) or not issubclass(cls, AstNode):
+            continue
+        hints = get_type_hints(cls)
+        cls.field_names = tuple(f.name for f in fields(cls))
+        child_fields: List[Tuple[str, bool]] = []
+        for name in cls.field_names:
+            is_list = classify_field(hints[name])
+            if is_list is not None:
+                child_fields.append((name, is_list))
+        cls.child_fields = tuple(child_fields)
+
+
+init_field_tables()
+
 #===------------------------------------------------------------------------===#
 # Dumping
 #===------------------------------------------------------------------------===#
 
 
+# Render a subtree as an indented tree, one node per line.
 def dump_ast(node: AstNode) -> str:
+    return "\n".join(dump_ast_lines(node))
+
+
+# Produce the lines of `dump_ast` one at a time, such that large trees can be
+# written out without building the entire dump in memory.
+def dump_ast_lines(node: AstNode) -> Iterator[str]:
     ids: Dict[int, int] = {}
 
     def get_id(node: AstNode) -> int:
@@ -186,22 +273,10 @@ def dump_ast(node: AstNode) -> str:
             ids[id(node)] = len(ids)
         return ids[id(node)]
 
-    def dump_field(name: str, value) -> List[str]:
-        if isinstance(value, AstNode):
-            return [dump_inner(value, name)]
-        elif isinstance(value, list):
-            fields = []
-            for i, v in enumerate(value):
-                fields += dump_field(f"{name}[{i}]", v)
-            return fields
-        return []
-
-    def dump_inner(node: AstNode, field_prefix: str) -> str:
-        line = ""
-        if field_prefix:
-            line += f"{field_prefix}: "
-        line += f"{node.__class__.__name__} @{get_id(node)}"
-        for name, value in node.__dict__.items():
+    def dump_header(node: AstNode) -> str:
+        line = f"{node.__class__.__name__} @{get_id(node)}"
+        for name in node.field_names:
+            value = getattr(node, name)
             if isinstance(value, str):
                 line += f" {name}=\"{value}\""
             elif isinstance(value, int):
@@ -209,15 +284,35 @@ def dump_ast(node: AstNode) -> str:
             elif isinstance(value, Token):
                 line += f" \"{value.spelling()}\""
             elif isinstance(value, Binding):
-                line += f" {name}={value.node.__class__.__name__}(@{get_id(value.get())})"
-        fields = []
-        for name, value in node.__dict__.items():
-            fields += dump_field(name, value)
-        for i, field in enumerate(fields):
+                # Bindings are only set once names have been resolved.
+                target = value.node
+                if target is None:
+                    line += f" {name}=None"
+                else:
+                    line += f" {name}={target.__class__.__name__}(@{get_id(target)})"
+        return line
+
+    # Each stack entry is a node to be dumped, together with the field it is
+    # stored in, the prefix for its own line, and the prefix for the lines of
+    # its children.
+    stack: List[Tuple[AstNode, str, str, str]] = [(node, "", "", "")]
+    while stack:
+        node, field_name, prefix_first, prefix_rest = stack.pop()
+        line = prefix_first
+        if field_name:
+            line += f"{field_name}: "
+        yield line + dump_header(node)
+
+        fields: List[Tuple[str, AstNode]] = []
+        for name, is_list in node.child_fields:
+            value = getattr(node, name)
+            if is_list:
+                fields += ((f"{name}[{i}]", v) for i, v in enumerate(value))
+            elif value is not None:
+                fields.append((name, value))
+        for i, (name, child) in reversed(list(enumerate(fields))):
             is_last = (i + 1 == len(fields))
             sep_first = "`-" if is_last else "|-"
             sep_rest = "  " if is_last else "| "
-            line += "\n" + sep_first + field.replace("\n", "\n" + sep_rest)
-        return line
-
-    return dump_inner(node, "")
+            stack.append(
+                (child, name, prefix_rest + sep_first, prefix_rest + sep_rest))
@@ -0,0 +1,265 @@
+from __future__ import annotations
+from src import ast
+from src.diagnostics import *
+from src.incremental import ParsedFile
+from src.serialize import AstReader, SerializeError, serialize_ast
+from src.source import *
+from typing import *
+import hashlib
+import json
+import os
+import struct
+
+
+# The version of the cache entries: a hash of the compiler's source files, such
+# that entries written by a different compiler, whose results might differ in
+# any pass, are never used. Computed on first use.
+def cache_version() -> str:
+    global _cache_version
+    if _cache_version is None:
+        directory = os.path.dirname(os.path.abspath(__file__))
+        h = hashlib.sha256()
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(".py"):
+                with open(os.path.join(directory, name), "rb") as f:
+                    h.update(name.encode())
+                    h.update(hashlib.sha256(f.read()).digest())
+        _cache_version = h.hexdigest()[:32]
+    return _cache_version
+
+
+_cache_version: Optional[str] = None
+
+
+# An on-disk cache of compilation results, holding two kinds of entries:
+#
+# - The parsed syntax tree of each source file, serialized along with its
+#   tokens and contents, and named after the hash of the file's path. An
+#   unchanged file is loaded instead of being lexed and parsed again. For a
+#   changed file, the text between the first and the last changed byte is
+#   relexed and reparsed incrementally, such that an edit within one module
+#   only parses that module again. Only files without syntax errors are stored.
+# - The type checking results of each module, a small JSON file named after the
+#   hash of the module's source text and the source text of the modules it
+#   calls, such that editing a module invalidates the entries of the module
+#   itself and of its callers.
+#
+# Names are resolved again on every compilation, since bindings cross module
+# and file boundaries; this takes a small fraction of the time of parsing. The
+# entry's modification time records when it was last used; once the cache
+# takes up more than `max_size` bytes of disk space the least recently used
+# entries are evicted.
+class ModuleCache:
+    path: str
+    max_size: int
+    # The disk space taken by the entries written since the last eviction.
+    written: int
+
+    def __init__(self, path: str, max_size: int):
+        self.path = path
+        self.max_size = max_size
+        self.written = 0
+
+    # The file recording the disk space taken by the cache as of the last
+    # eviction.
+    def size_path(self) -> str:
+        return os.path.join(self.path, "size")
+
+    def entry_path(self, key: str, suffix: str = ".json") -> str:
+        return os.path.join(self.path, key[:2], key[2:] + suffix)
+
+    def get(self, key: str) -> Optional[List[PortableDiagnostic]]:
+        try:
+            entry = json.loads(self.read_entry(self.entry_path(key)))
+        except (OSError, ValueError):
+            return None
+        if entry.get("version") != cache_version():
+            return None
+        return [tuple(diag) for diag in entry["diagnostics"]]  # type: ignore
+
+    def put(self, key: str, diags: List[PortableDiagnostic]):
+        self.write_entry(
+            self.entry_path(key),
+            json.dumps({
+                "version": cache_version(),
+                "diagnostics": diags
+            }).encode())
+
+    # Load the syntax tree of a source file, or return None if the cache holds
+    # no usable entry for it. If the file has changed since the entry was
+    # written, the tree is updated to the file's current contents.
+    def get_parsed(self, file: SourceFile) -> Optional[ast.Root]:
+        try:
+            reader = AstReader(
+                self.read_entry(self.entry_path(file_key(file), ".ast")))
+            root = reader.root()
+            tokens = reader.tokens(0)
+        except (OSError, ValueError, IndexError, SerializeError, struct.error):
+            return None
+        cached = tokens.file
+        if cached.path != file.path:
+            return None
+        old, new = cached.contents, file.contents
+        start = common_prefix(old, new)
+        if start == len(old) == len(new):
+            return root
+        end = common_suffix(old, new, min(len(old), len(new)) - start)
+        parsed = ParsedFile(cached, tokens, root)
+        parsed.edit(start, len(old) - end - start, new[start:len(new) - end])
+        if parsed.diags:
+            return None
+        self.put_parsed(parsed.root)
+        return parsed.root
+
+    # Store the syntax tree of a source file without syntax errors.
+    def put_parsed(self, root: ast.Root):
+        if root.items:
+            self.write_entry(self.entry_path(file_key(root.loc.file), ".ast"),
+                             serialize_ast(root))
+
+    def read_entry(self, path: str) -> bytes:
+        with open(path, "rb") as f:
+            data = f.read()
+        os.utime(path)
+        return data
+
+    def write_entry(self, path: str, data: bytes):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self.written += disk_usage(os.stat(path))
+        except OSError:
+            pass
+
+    # Remove the least recently used entries until the cache fits its size
+    # limit. Scanning the cache is only necessary once the size recorded by the
+    # last eviction plus the entries written since exceed the limit. The
+    # recorded size is an estimate, since other processes may use the cache
+    # concurrently, but it is corrected by every scan.
+    def evict(self):
+        written, self.written = self.written, 0
+        try:
+            with open(self.size_path(), "r") as f:
+                estimate = int(f.read()) + written
+        except (OSError, ValueError):
+            estimate = None
+        if estimate is not None and estimate <= self.max_size:
+            if written > 0:
+                self.record_size(estimate)
+            return
+
+        entries: List[Tuple[float, int, str]] = []
+        total = 0
+        for dir_path, _, file_names in os.walk(self.path):
+            for file_name in file_names:
+                path = os.path.join(dir_path, file_name)
+                if path == self.size_path():
+                    continue
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                size = disk_usage(stat)
+                entries.append((stat.st_mtime, size, path))
+                total += size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+        self.record_size(total)
+
+    def record_size(self, size: int):
+        path = self.size_path()
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                f.write(str(size))
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
+
+
+# The disk space taken by a file. An entry is much smaller than a block of the
+# file system, so its size alone would vastly underestimate the space taken.
+def disk_usage(stat: os.stat_result) -> int:
+    blocks = getattr(stat, "st_blocks", None)
+    return stat.st_size if blocks is None else blocks * 512
+
+
+# The cache key of a source file's syntax tree, derived from the file's real
+# path. The contents are not part of the key, such that an edited file finds the
+# entry of its previous version.
+def file_key(file: SourceFile) -> str:
+    h = hashlib.sha256(cache_version().encode())
+    h.update(os.path.realpath(file.path).encode())
+    return h.hexdigest()
+
+
+# The length of the longest common prefix of two byte strings. Compares halves
+# of the remaining range rather than single bytes, which is much faster for
+# long strings.
+def common_prefix(a: SourceBuffer, b: SourceBuffer) -> int:
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[lo:mid] == b[lo:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+# The length of the longest common suffix of two byte strings, up to `limit`.
+def common_suffix(a: SourceBuffer, b: SourceBuffer, limit: int) -> int:
+    lo, hi = 0, limit
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[len(a) - mid:len(a) - lo] == b[len(b) - mid:len(b) - lo]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+# Compute the cache key of each module from its source text and the source text
+# of the modules it calls. Requires resolved names.
+def module_cache_keys(modules: List[ast.ModItem],
+                      graph: List[List[int]]) -> List[str]:
+    text_hashes = []
+    for mod in modules:
+        loc = mod.full_loc
+        text = loc.file.contents[loc.offset:loc.offset + loc.length]
+        text_hashes.append(hashlib.sha256(text).hexdigest())
+
+    keys = []
+    for text_hash, callees in zip(text_hashes, graph):
+        h = hashlib.sha256(cache_version().encode())
+        h.update(text_hash.encode())
+        for callee_hash in sorted(text_hashes[i] for i in callees):
+            h.update(callee_hash.encode())
+        keys.append(h.hexdigest())
+    return keys
+
+
+# The default cache directory.
+def default_cache_dir() -> str:
+    if path := os.environ.get("DOTY_CACHE_DIR"):
+        return path
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "doty")
+
+
+__all__ = [
+    "ModuleCache",
+    "module_cache_keys",
+    "default_cache_dir",
+]
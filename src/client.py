@@ -0,0 +1,94 @@
+# The client side of the compile server. This module is imported before
+# anything else on every invocation, so it only depends on the standard library
+# modules needed to talk to the server.
+import base64
+import json
+import os
+import socket
+import struct
+import sys
+from io import BufferedIOBase
+from typing import List, Optional, Tuple
+
+# The kinds of frames the server sends back to the client.
+FRAME_STDOUT = 1
+FRAME_STDERR = 2
+FRAME_EXIT = 3
+
+# Each frame is its kind and payload length, followed by the payload.
+FRAME_HEADER = struct.Struct("!BI")
+
+
+# The socket used if `DOTY_SERVER` does not name one.
+def default_socket_path() -> str:
+    base = os.environ.get("XDG_RUNTIME_DIR") or "/tmp"
+    return os.path.join(base, f"doty-{os.getuid()}.sock")
+
+
+def write_frame(f: BufferedIOBase, kind: int, payload: bytes):
+    f.write(FRAME_HEADER.pack(kind, len(payload)))
+    f.write(payload)
+
+
+def read_frame(f: BufferedIOBase) -> Optional[Tuple[int, bytes]]:
+    header = f.read(FRAME_HEADER.size)
+    if len(header) < FRAME_HEADER.size:
+        return None
+    kind, length = FRAME_HEADER.unpack(header)
+    return kind, f.read(length)
+
+
+# Forward a command line to the compile server and stream its output to stdout
+# and stderr. Every argument that names an existing file is sent along with its
+# contents, such that the server compiles exactly what the client sees. Returns
+# the exit code, or None if no server is listening on the socket.
+def run_client(path: str, argv: List[str]) -> Optional[int]:
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path)
+    except OSError:
+        return None
+
+    files = {}
+    for arg in argv:
+        if os.path.isfile(arg):
+            with open(arg, "rb") as f:
+                files[os.path.realpath(arg)] = base64.b64encode(
+                    f.read()).decode()
+    request = {
+        "argv": argv,
+        "cwd": os.getcwd(),
+        "env": {
+            k: v
+            for k, v in os.environ.items() if k.startswith("DOTY_")
+        },
+        "color": sys.stderr.isatty(),
+        "files": files,
+    }
+
+    with sock, sock.makefile("rwb") as f:
+        write_frame(f, 0, json.dumps(request).encode())
+        f.flush()
+        while frame := read_frame(f):
+            kind, payload = frame
+            if kind == FRAME_STDOUT:
+                sys.stdout.buffer.write(payload)
+                sys.stdout.buffer.flush()
+            elif kind == FRAME_STDERR:
+                sys.stderr.buffer.write(payload)
+                sys.stderr.buffer.flush()
+            elif kind == FRAME_EXIT:
+                return struct.unpack("!i", payload)[0]
+    sys.stderr.write("error: compile server closed the connection\n")
+    return 1
+
+
+__all__ = [
+    "FRAME_STDOUT",
+    "FRAME_STDERR",
+    "FRAME_EXIT",
+    "default_socket_path",
+    "write_frame",
+    "read_frame",
+    "run_client",
+]
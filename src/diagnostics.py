@@ -1,46 +1,197 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from io import StringIO
 from src.source import *
-from sys import exit, stderr
-from termcolor import colored
+import sys
 from typing import *
 
 
-def emit_error(loc: Optional[Loc], msg: str) -> NoReturn:
-    emit_diagnostic("error", "red", loc, msg)
-    exit(1)
+# A single diagnostic message.
+@dataclass
+class Diagnostic:
+    severity: str
+    loc: Optional[Loc]
+    msg: str
 
 
-def emit_warning(loc: Optional[Loc], msg: str):
-    emit_diagnostic("warning", "yellow", loc, msg)
+# A diagnostic with its location given as an offset relative to some base
+# offset, as `(severity, offset, length, msg)`. Such diagnostics can be sent to
+# other processes or stored on disk, and later be attached to a source file
+# again, possibly at a different base offset.
+PortableDiagnostic = Tuple[str, Optional[int], int, str]
 
 
-def emit_info(loc: Optional[Loc], msg: str):
-    emit_diagnostic("info", "cyan", loc, msg)
+def export_diagnostics(diags: List[Diagnostic],
+                       base: int) -> List[PortableDiagnostic]:
+    return [(d.severity, d.loc.offset - base if d.loc else None,
+             d.loc.length if d.loc else 0, d.msg) for d in diags]
 
 
-def emit_diagnostic(severity: str, color: str, loc: Optional[Loc], msg: str):
-    text = colored(severity + ":", color, attrs=["bold"])
-    text += " "
-    text += colored(msg, attrs=["bold"])
-    print(text, file=stderr)
+def import_diagnostics(diags: List[PortableDiagnostic], file: SourceFile,
+                       base: int) -> List[Diagnostic]:
+    return [
+        Diagnostic(
+            severity,
+            Loc(file, base + offset, length) if offset is not None else None,
+            msg) for severity, offset, length, msg in diags
+    ]
+
+
+# Collects the diagnostics emitted during compilation and writes them to stderr
+# in one go when flushed. Compilation is aborted once `error_limit` errors have
+# been reported; a limit of 0 allows an unbounded number of errors. `color`
+# forces colored output on or off; by default it depends on the terminal.
+class DiagnosticEngine:
+    error_limit: int
+    color: Optional[bool]
+    num_errors: int
+    num_warnings: int
+    buffer: StringIO
+    captures: List[List[Diagnostic]]
+
+    def __init__(self, error_limit: int = 20):
+        self.error_limit = error_limit
+        self.color = None
+        self.reset()
+
+    # Forget all diagnostics reported so far, e.g. before the compile server
+    # starts the next compilation.
+    def reset(self):
+        self.num_errors = 0
+        self.num_warnings = 0
+        self.buffer = StringIO()
+        self.captures = []
+
+    # Start capturing diagnostics instead of emitting them. Captures nest; the
+    # diagnostics are returned by the matching `end_capture`.
+    def capture(self):
+        self.captures.append([])
+
+    def end_capture(self) -> List[Diagnostic]:
+        return self.captures.pop()
+
+    # Emit previously captured diagnostics.
+    def replay(self, diags: List[Diagnostic]):
+        for diag in diags:
+            getattr(self, diag.severity)(diag.loc, diag.msg)
+
+    def error(self, loc: Optional[Loc], msg: str):
+        if self.captures:
+            self.captures[-1].append(Diagnostic("error", loc, msg))
+            return
+        self.emit("error", "red", loc, msg)
+        self.num_errors += 1
+        if self.error_limit > 0 and self.num_errors >= self.error_limit:
+            self.emit("error", "red", None,
+                      "too many errors emitted, stopping now")
+            self.abort()
+
+    def warning(self, loc: Optional[Loc], msg: str):
+        if self.captures:
+            self.captures[-1].append(Diagnostic("warning", loc, msg))
+            return
+        self.emit("warning", "yellow", loc, msg)
+        self.num_warnings += 1
+
+    def info(self, loc: Optional[Loc], msg: str):
+        if self.captures:
+            self.captures[-1].append(Diagnostic("info", loc, msg))
+            return
+        self.emit("info", "cyan", loc, msg)
+
+    def emit(self, severity: str, color: str, loc: Optional[Loc], msg: str):
+        out = self.buffer
+        text = self.colored(severity + ":", color, attrs=["bold"])
+        text += " "
+        text += self.colored(msg, None, attrs=["bold"])
+        print(text, file=out)
+
+        if loc:
+            print(f"{loc}:", file=out)
+
+            end = loc.offset + loc.length
+            line_start, _ = loc.file.line_range(loc.offset)
+            _, line_end = loc.file.line_range(end)
+            src_before = loc.file.text(line_start, loc.offset)
+            src_within = loc.file.text(loc.offset, end)
+            src_after = loc.file.text(end, line_end)
+
+            text = "  | " + src_before
+            text += self.colored(src_within, color, attrs=["bold"])
+            text += src_after
+            print(text, file=out)
 
-    if loc:
-        print(f"{loc}:", file=stderr)
+            text = "  | " + " " * len(src_before)
+            text += self.colored("^" * max(len(src_within), 1),
+                                 color,
+                                 attrs=["bold"])
+            print(text, file=out)
 
-        src_before = loc.file.contents[:loc.offset].split("\n")[-1]
-        src_within = loc.file.contents[loc.offset:loc.offset + loc.length]
-        src_after = loc.file.contents[loc.offset + loc.length:].split("\n")[0]
+    # Color support is only loaded once the first diagnostic is printed.
+    def colored(self, text: str, color: Optional[str],
+                attrs: List[str]) -> str:
+        from termcolor import colored
+        return colored(text,
+                       color,
+                       attrs=attrs,
+                       no_color=self.color is False,
+                       force_color=self.color is True)
 
-        text = "  | " + src_before
-        text += colored(src_within, color, attrs=["bold"])
-        text += src_after
-        print(text, file=stderr)
+    # Write all buffered diagnostics to stderr.
+    def flush(self):
+        text = self.buffer.getvalue()
+        if text:
+            sys.stderr.write(text)
+            sys.stderr.flush()
+        self.buffer = StringIO()
 
-        text = "  | " + " " * len(src_before)
-        text += colored("^" * max(len(src_within), 1), color, attrs=["bold"])
-        print(text, file=stderr)
+    # Flush all diagnostics and exit, indicating failure if any errors were
+    # reported.
+    def finish(self) -> NoReturn:
+        self.flush()
+        sys.exit(1 if self.num_errors > 0 else 0)
+
+    # Flush all diagnostics and exit with failure.
+    def abort(self) -> NoReturn:
+        self.flush()
+        sys.exit(1)
+
+
+# The diagnostic engine used throughout the compiler.
+diagnostics = DiagnosticEngine()
+
+
+# Report an error and continue compilation.
+def report_error(loc: Optional[Loc], msg: str):
+    diagnostics.error(loc, msg)
+
+
+# Report an error and abort compilation immediately.
+def emit_error(loc: Optional[Loc], msg: str) -> NoReturn:
+    diagnostics.error(loc, msg)
+    diagnostics.abort()
+
+
+def emit_warning(loc: Optional[Loc], msg: str):
+    diagnostics.warning(loc, msg)
+
+
+def emit_info(loc: Optional[Loc], msg: str):
+    diagnostics.info(loc, msg)
+
+
+def emit_diagnostic(severity: str, color: str, loc: Optional[Loc], msg: str):
+    diagnostics.emit(severity, color, loc, msg)
 
 
 __all__ = [
+    "Diagnostic",
+    "PortableDiagnostic",
+    "export_diagnostics",
+    "import_diagnostics",
+    "DiagnosticEngine",
+    "diagnostics",
+    "report_error",
     "emit_error",
     "emit_warning",
     "emit_info",
@@ -0,0 +1,326 @@
+from __future__ import annotations
+from src.diagnostics import *
+from src.source import *
+from src.stats import PassStats, statistics
+from typing import *
+import mmap
+import os
+
+# The parser and later passes are imported on first use, such that opening
+# files does not load the whole compiler.
+if TYPE_CHECKING:
+    from src import ast
+    from src.cache import ModuleCache
+
+# The file extension of source files, used to locate imported files.
+SOURCE_EXTENSION = ".doty"
+
+# Contents of source files that take precedence over the files on disk, keyed
+# by real path. The compile server uses this for the files sent by the client.
+source_overlay: Dict[str, bytes] = {}
+
+
+# Open a source file, reporting an error if it cannot be read. If `use_mmap` is
+# set, the file is memory-mapped instead of read into memory. The error points
+# at `loc` if given, e.g. the `use` item that imports the file.
+def open_source_file(path: str,
+                     use_mmap: bool = False,
+                     loc: Optional[Loc] = None) -> Optional[SourceFile]:
+    if (contents := source_overlay.get(os.path.realpath(path))) is not None:
+        return SourceFile(path, contents)
+    try:
+        with open(path, "rb") as f:
+            # Empty files cannot be mapped, so read them normally.
+            if use_mmap and os.fstat(f.fileno()).st_size > 0:
+                return SourceFile(
+                    path, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            return SourceFile(path, f.read())
+    except Exception as e:
+        report_error(loc, f"unable to open file `{path}`: {e}")
+        return None
+
+
+# Lex and parse a single source file.
+def parse_file(path: str,
+               use_mmap: bool = False,
+               loc: Optional[Loc] = None) -> Optional[ast.Root]:
+    file = open_source_file(path, use_mmap, loc)
+    if file is None:
+        return None
+    return parse_source_file(file)
+
+
+def parse_source_file(file: SourceFile) -> ast.Root:
+    from src.lexer import tokenize
+    from src.parser import parse
+    with statistics.timed("lex"):
+        tokens = tokenize(file)
+    return parse(tokens)
+
+
+# The paths of the files imported by a parsed file, each with the location of
+# the `use` item that imports it.
+def imports(root: ast.Root) -> List[Tuple[str, Loc]]:
+    from src import ast
+    base = os.path.dirname(root.loc.file.path)
+    return [(os.path.join(base,
+                          item.name.spelling() + SOURCE_EXTENSION), item.loc)
+            for item in root.items if isinstance(item, ast.UseItem)]
+
+
+# Lex and parse a set of source files and the files they import, and combine
+# their items into a single root. Files are processed in waves: the given files
+# first, then the files they import that have not been seen yet, and so on.
+# With `jobs > 1` the files of a wave are parsed concurrently on a pool of
+# worker processes. Files and diagnostics are kept in a deterministic order
+# regardless of scheduling. Diagnostics are only captured and replayed for files
+# parsed by workers; otherwise they are reported directly, such that the error
+# limit can stop the parser. Files that have already been parsed can be passed
+# as `parsed`; they come first, and only the files they import are parsed.
+# If a cache is given, files are loaded from it where possible, and the files
+# that parsed without diagnostics are stored in it. Returns None if no file
+# could be read.
+def parse_files(paths: List[str],
+                jobs: int = 1,
+                use_mmap: bool = False,
+                parsed: Sequence[ast.Root] = (),
+                cache: Optional[ModuleCache] = None) -> Optional[ast.Root]:
+    roots: List[ast.Root] = list(parsed)
+    seen: Set[str] = {
+        os.path.realpath(known.loc.file.path)
+        for known in parsed
+    }
+
+    # Each file to parse is given by its path and the location of the `use`
+    # item that imports it, if any.
+    def enqueue(files: Iterable[Tuple[str, Optional[Loc]]],
+                wave: List[Tuple[str, Optional[Loc]]]):
+        for path, loc in files:
+            key = os.path.realpath(path)
+            if key not in seen:
+                seen.add(key)
+                wave.append((path, loc))
+
+    wave: List[Tuple[str, Optional[Loc]]] = []
+    for known in parsed:
+        enqueue(imports(known), wave)
+    enqueue(((path, None) for path in paths), wave)
+    while wave:
+        results: List[Optional[ast.Root]] = [None] * len(wave)
+        misses: List[int] = []
+        for index, (path, loc) in enumerate(wave):
+            if parse_cache is not None:
+                results[index] = parse_cache.get(path)
+            if results[index] is None and cache is not None:
+                file = open_source_file(path, use_mmap, loc)
+                if file is None:
+                    continue
+                results[index] = root = cache.get_parsed(file)
+                if parse_cache is not None and root is not None:
+                    parse_cache.put(path, root)
+            if results[index] is None:
+                misses.append(index)
+
+        outcomes = None
+        if jobs > 1 and len(misses) > 1:
+            outcomes = parse_files_parallel([wave[i] for i in misses], jobs,
+                                            use_mmap)
+        if outcomes is not None:
+            for index, (root, diags) in zip(misses, outcomes):
+                diagnostics.replay(diags)
+                results[index] = root
+                if root is not None and not diags:
+                    if parse_cache is not None:
+                        parse_cache.put(wave[index][0], root)
+                    if cache is not None:
+                        cache.put_parsed(root)
+        else:
+            for index in misses:
+                path, loc = wave[index]
+                num_diags = diagnostics.num_errors + diagnostics.num_warnings
+                results[index] = root = parse_file(path, use_mmap, loc)
+                if (root is not None
+                        and diagnostics.num_errors + diagnostics.num_warnings
+                        == num_diags):
+                    if parse_cache is not None:
+                        parse_cache.put(path, root)
+                    if cache is not None:
+                        cache.put_parsed(root)
+
+        wave = []
+        for root in results:
+            if root is not None:
+                roots.append(root)
+                enqueue(imports(root), wave)
+
+    if cache is not None:
+        cache.evict()
+    if not roots:
+        return None
+    from src import ast
+    return ast.Root(loc=roots[0].loc,
+                    items=[item for root in roots for item in root.items])
+
+
+# Parse files on a process pool, in the order in which they are given. Returns
+# the AST of each file and the diagnostics emitted while parsing it, or None if
+# worker processes are unavailable.
+def parse_files_parallel(
+    files: List[Tuple[str, Optional[Loc]]], jobs: int, use_mmap: bool
+) -> Optional[List[Tuple[Optional[ast.Root], List[Diagnostic]]]]:
+    import multiprocessing
+    try:
+        mp = multiprocessing.get_context("fork")
+    except ValueError:
+        return None
+
+    from src.serialize import deserialize_ast
+    with mp.Pool(min(jobs, len(files))) as pool:
+        results = pool.starmap(
+            parse_file_serialized,
+            [(path, use_mmap,
+              (loc.file.path, loc.offset, loc.length) if loc else None)
+             for path, loc in files])
+    outcomes: List[Tuple[Optional[ast.Root], List[Diagnostic]]] = []
+    for (_, loc), (data, diags, passes) in zip(files, results):
+        statistics.merge_passes(passes)
+        root = deserialize_ast(data) if data is not None else None
+        sources = {}
+        if loc is not None:
+            sources[loc.file.path] = loc.file
+        if root is not None:
+            sources[root.loc.file.path] = root.loc.file
+        outcomes.append((root, [
+            Diagnostic(
+                severity,
+                Loc(sources[diag_loc[0]], diag_loc[1], diag_loc[2])
+                if diag_loc else None, msg)
+            for severity, diag_loc, msg in diags
+        ]))
+    return outcomes
+
+
+# A diagnostic sent back by a worker process, with its location given as
+# `(path, offset, length)`, such that the contents of the file are not sent
+# along with it.
+WorkerDiagnostic = Tuple[str, Optional[Tuple[str, int, int]], str]
+
+
+# Parse a file in a worker process. The AST is sent back in its serialized
+# form, which is much cheaper to transfer than a pickled AST.
+# The diagnostics emitted while parsing are captured and sent back, such that
+# they can be replayed in a deterministic order, along with the time spent in
+# the passes run by the worker. The location of the `use` item that imports the
+# file is given as `(path, offset, length)` as well; the worker has no source
+# file for it, so an error opening the file is located there once sent back.
+def parse_file_serialized(
+    path: str, use_mmap: bool, import_loc: Optional[Tuple[str, int, int]]
+) -> Tuple[Optional[bytes], List[WorkerDiagnostic], List[PassStats]]:
+    from src.serialize import serialize_ast
+    statistics.passes = []
+    diagnostics.capture()
+    try:
+        file = open_source_file(path, use_mmap)
+        root = parse_source_file(file) if file is not None else None
+    finally:
+        diags = diagnostics.end_capture()
+    data = serialize_ast(root) if root is not None else None
+    worker_diags: List[WorkerDiagnostic] = [
+        (diag.severity, (diag.loc.file.path, diag.loc.offset,
+                         diag.loc.length) if diag.loc else None, diag.msg)
+        for diag in diags
+    ]
+    if file is None:
+        worker_diags = [(severity, import_loc, msg)
+                        for severity, _, msg in worker_diags]
+    return data, worker_diags, statistics.passes
+
+
+# Parsed files kept in memory between compilations. An entry is reused as long
+# as the file's contents are unchanged, which is checked by modification time
+# and size first, and by content hash if those differ. Only files that parsed
+# without diagnostics are kept, such that a hit never has to replay any.
+class ParseCache:
+    entries: Dict[str, Tuple[int, int, bytes, ast.Root]]
+
+    def __init__(self):
+        self.entries = {}
+
+    def get(self, path: str) -> Optional[ast.Root]:
+        key = os.path.realpath(path)
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        mtime, size, digest, root = entry
+        # Locations print the path the file was opened with.
+        if root.loc.file.path != path:
+            return None
+        contents = source_overlay.get(key)
+        if contents is None:
+            try:
+                stat = os.stat(key)
+                if (stat.st_mtime_ns, stat.st_size) == (mtime, size):
+                    return root
+                with open(key, "rb") as f:
+                    contents = f.read()
+            except OSError:
+                return None
+            mtime, size = stat.st_mtime_ns, stat.st_size
+        if content_hash(contents) != digest:
+            return None
+        self.entries[key] = (mtime, size, digest, root)
+        return root
+
+    def put(self, path: str, root: ast.Root):
+        key = os.path.realpath(path)
+        digest = content_hash(root.loc.file.contents)
+        mtime, size = -1, -1
+        if key not in source_overlay:
+            try:
+                stat = os.stat(key)
+                mtime, size = stat.st_mtime_ns, stat.st_size
+            except OSError:
+                return
+        self.entries[key] = (mtime, size, digest, root)
+
+
+# The hash by which the parse cache recognizes unchanged files.
+def content_hash(contents: SourceBuffer) -> bytes:
+    import hashlib
+    return hashlib.sha256(contents).digest()
+
+
+# The parse cache used by `parse_files`, if any. Set by the compile server.
+parse_cache: Optional[ParseCache] = None
+
+
+# Compile a set of source files and the files they import. Diagnostics are
+# reported to the global diagnostic engine. Returns the combined AST, or None
+# if any errors were reported.
+def compile_files(paths: List[str],
+                  jobs: int = 1,
+                  use_mmap: bool = False,
+                  cache: Optional[ModuleCache] = None) -> Optional[ast.Root]:
+    from src.names import resolve_names
+    from src.typeck import type_check
+    num_errors = diagnostics.num_errors
+    root = parse_files(paths, jobs=jobs, use_mmap=use_mmap, cache=cache)
+    if root is None or diagnostics.num_errors > num_errors:
+        return None
+    resolve_names(root)
+    if diagnostics.num_errors > num_errors:
+        return None
+    type_check(root, jobs=jobs, cache=cache)
+    if diagnostics.num_errors > num_errors:
+        return None
+    return root
+
+
+__all__ = [
+    "source_overlay",
+    "open_source_file",
+    "ParseCache",
+    "parse_file",
+    "parse_files",
+    "compile_files",
+]
@@ -0,0 +1,160 @@
+from __future__ import annotations
+from src.lexer import Token, TokenBuffer
+from src.source import *
+from typing import *
+import json
+
+# The syntax tree is imported on first use, such that dumping tokens does not
+# load it.
+if TYPE_CHECKING:
+    from src import ast
+
+# The number of lines collected before they are written out together. Writing
+# each line separately is dominated by the overhead of the individual writes,
+# especially when the stream is forwarded to a compile server client.
+CHUNK_LINES = 4096
+
+# Encode JSON records without any insignificant whitespace.
+encode_json = json.JSONEncoder(ensure_ascii=False,
+                               separators=(",", ":")).encode
+
+
+# Write lines to a stream in chunks. Only one chunk is held in memory at a
+# time, such that arbitrarily large dumps can be produced incrementally.
+def write_lines(lines: Iterable[str], out: TextIO):
+    chunk: List[str] = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= CHUNK_LINES:
+            chunk.append("")
+            out.write("\n".join(chunk))
+            chunk.clear()
+    if chunk:
+        chunk.append("")
+        out.write("\n".join(chunk))
+
+
+#===------------------------------------------------------------------------===#
+# Tokens
+#===------------------------------------------------------------------------===#
+
+
+# Write the tokens of a buffer to a stream in the given format. `text` is meant
+# to be read by humans; `ndjson` emits one JSON object per line for each token,
+# meant to be consumed by other tools.
+def dump_tokens(tokens: TokenBuffer, out: TextIO, format: str = "text"):
+    if format == "ndjson":
+        write_lines(map(encode_json, token_records(tokens)), out)
+    else:
+        write_lines(token_lines(tokens), out)
+
+
+def token_lines(tokens: TokenBuffer) -> Iterator[str]:
+    for index in range(len(tokens)):
+        yield f"- {tokens.kind(index).name}: `{tokens.spelling(index)}`"
+
+
+# One record per token, with its kind, spelling, and location.
+def token_records(tokens: TokenBuffer) -> Iterator[Dict[str, Any]]:
+    file = tokens.file
+    for index in range(len(tokens)):
+        offset = tokens.offsets[index]
+        line, column = file.line_and_column(offset)
+        yield {
+            "index": index,
+            "kind": tokens.kind(index).name,
+            "spelling": tokens.spelling(index),
+            "file": file.path,
+            "offset": offset,
+            "length": tokens.lengths[index],
+            "line": line,
+            "column": column,
+        }
+
+
+#===------------------------------------------------------------------------===#
+# Syntax Trees
+#===------------------------------------------------------------------------===#
+
+
+# Write a subtree to a stream in the given format.
+def dump_tree(root: ast.AstNode, out: TextIO, format: str = "text"):
+    from src import ast
+    if format == "ndjson":
+        write_lines(map(encode_json, node_records(root)), out)
+    else:
+        write_lines(ast.dump_ast_lines(root), out)
+
+
+# One record per node, in pre-order. Nodes are numbered in the order in which
+# they are first encountered, and refer to their parent and the nodes they are
+# bound to by number. Each record lists the field of the parent that holds the
+# node, and the index within that field if it is a list. The record of a
+# binding's target may come after the record of the binding.
+def node_records(root: ast.AstNode) -> Iterator[Dict[str, Any]]:
+    from src import ast
+    ids: Dict[int, int] = {}
+
+    def get_id(node: ast.AstNode) -> int:
+        return ids.setdefault(id(node), len(ids))
+
+    # Each stack entry is a node, the ID of its parent, the field it is stored
+    # in, and its index within that field.
+    stack: List[Tuple[ast.AstNode, Optional[int], Optional[str],
+                      Optional[int]]] = [(root, None, None, None)]
+    while stack:
+        node, parent, field, index = stack.pop()
+        node_id = get_id(node)
+        record: Dict[str, Any] = {
+            "id": node_id,
+            "parent": parent,
+            "field": field,
+        }
+        if index is not None:
+            record["index"] = index
+        record["kind"] = node.__class__.__name__
+        record.update(loc_record(node.loc))
+
+        for name in node.field_names:
+            value = getattr(node, name)
+            if isinstance(value, (str, int)):
+                record[name] = value
+            elif isinstance(value, Token):
+                record[name] = value.spelling()
+            elif isinstance(value, ast.Binding):
+                record[name] = None if value.node is None else {
+                    "kind": value.node.__class__.__name__,
+                    "id": get_id(value.node),
+                }
+            elif isinstance(value, Loc) and name != "loc":
+                record[name] = {"offset": value.offset, "length": value.length}
+        yield record
+
+        children: List[Tuple[ast.AstNode, Optional[int], Optional[str],
+                             Optional[int]]] = []
+        for name, is_list in node.child_fields:
+            value = getattr(node, name)
+            if is_list:
+                children += ((child, node_id, name, i)
+                             for i, child in enumerate(value))
+            elif value is not None:
+                children.append((value, node_id, name, None))
+        stack.extend(reversed(children))
+
+
+def loc_record(loc: Loc) -> Dict[str, Any]:
+    line, column = loc.file.line_and_column(loc.offset)
+    return {
+        "file": loc.file.path,
+        "offset": loc.offset,
+        "length": loc.length,
+        "line": line,
+        "column": column,
+    }
+
+
+__all__ = [
+    "dump_tokens",
+    "dump_tree",
+    "write_lines",
+]
@@ -0,0 +1,268 @@
+from __future__ import annotations
+from array import array
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from src import ast
+from src.diagnostics import *
+from src.lexer import Token, TokenBuffer, TokenKind, lex_tokens, tokenize
+from src.parser import Parser, parse, parse_items
+from src.source import *
+from typing import *
+
+# Incremental lexing and parsing of a source file. A `ParsedFile` holds the
+# tokens, syntax tree, and syntax errors of a file, and updates all of them
+# after an edit of the text:
+#
+# 1. The tokens around the edit are lexed again, until the lexer reaches the
+#    start of a token that existed before the edit. Since lexing only depends
+#    on the text that follows, all later tokens are unchanged and merely move
+#    by the length difference of the edit.
+# 2. The items that contain the relexed tokens are parsed again, until the
+#    parser reaches the start of an item that existed before the edit. Again,
+#    parsing from there on would produce the same items as before.
+# 3. The locations and token indices of all later items and syntax errors are
+#    shifted to account for the edit.
+#
+# Bindings in the updated tree may refer to nodes that have been replaced, so
+# names have to be resolved again after an edit.
+
+
+# The range of tokens lexed and the range of items parsed by an edit, as
+# indices after the edit.
+@dataclass
+class ParseUpdate:
+    tokens: range
+    items: range
+
+
+class ParsedFile:
+    file: SourceFile
+    tokens: TokenBuffer
+    root: ast.Root
+    # The errors reported by the lexer and by the parser, each in source order.
+    lex_diags: List[Diagnostic]
+    parse_diags: List[Diagnostic]
+
+    # Lex and parse a file, or take the tokens and syntax tree of an earlier
+    # parse of it, e.g. from the compile cache, which must be free of errors.
+    def __init__(self,
+                 file: SourceFile,
+                 tokens: Optional[TokenBuffer] = None,
+                 root: Optional[ast.Root] = None):
+        self.file = file
+        if tokens is not None and root is not None:
+            self.tokens = tokens
+            self.root = root
+            self.lex_diags = []
+            self.parse_diags = []
+            return
+        diagnostics.capture()
+        try:
+            self.tokens = tokenize(file)
+        finally:
+            self.lex_diags = diagnostics.end_capture()
+        diagnostics.capture()
+        try:
+            self.root = parse(self.tokens)
+        finally:
+            self.parse_diags = diagnostics.end_capture()
+
+    # All syntax errors in the file, in the order a full parse reports them.
+    @property
+    def diags(self) -> List[Diagnostic]:
+        return self.lex_diags + self.parse_diags
+
+    # Replace `length` bytes at `offset` with `text`, and update the tokens,
+    # syntax tree, and syntax errors accordingly.
+    def edit(self, offset: int, length: int, text: bytes) -> ParseUpdate:
+        file = self.file
+        tokens = self.tokens
+        if offset < 0 or length < 0 or offset + length > len(file.contents):
+            raise ValueError(
+                f"edit [{offset};{length}] outside of {file.path}")
+        delta = len(text) - length
+        edit_end = offset + len(text)
+
+        # Find the first token that ends at or after the edit. Relexing starts
+        # at the end of the token before it.
+        first = bisect_right(tokens.offsets, offset)
+        while first > 0 and tokens.offsets[first - 1] + tokens.lengths[
+                first - 1] >= offset:
+            first -= 1
+        relex_start = 0
+        if first > 0:
+            relex_start = tokens.offsets[first - 1] + tokens.lengths[first - 1]
+
+        # Lex the changed text until a token starts where an old token did. The
+        # old tokens from there on are kept.
+        file.edit(offset, length, text)
+        lexed = TokenBuffer(file)
+        diagnostics.capture()
+        try:
+            for index in lex_tokens(lexed, relex_start):
+                start = lexed.offsets[index]
+                if start < edit_end:
+                    continue
+                resync = bisect_left(tokens.offsets, start - delta, lo=first)
+                if tokens.offsets[resync] == start - delta:
+                    truncate_tokens(lexed, index)
+                    break
+        finally:
+            lex_diags = diagnostics.end_capture()
+        resync_offset = tokens.offsets[resync]
+        self.lex_diags = splice_diags(self.lex_diags, relex_start,
+                                      resync_offset, lex_diags, delta)
+
+        # Replace the old tokens with the new ones, and move the tokens after
+        # them.
+        shift = len(lexed) - (resync - first)
+        if delta != 0:
+            tail = tokens.offsets[resync:]
+            tokens.offsets[resync:] = array(tail.typecode,
+                                            [o + delta for o in tail])
+        tokens.kinds[first:resync] = lexed.kinds
+        tokens.offsets[first:resync] = lexed.offsets
+        tokens.lengths[first:resync] = lexed.lengths
+        tokens.symbols[first:resync] = lexed.symbols
+
+        # Parse again from the end of the last item before the changed tokens,
+        # until the parser reaches the start of an item after them that existed
+        # before the edit. The items have not been moved yet, so their
+        # locations are still those before the edit.
+        items = self.root.items
+        first_item = bisect_right(items, relex_start, key=item_end)
+        parse_start = 0
+        parse_start_offset = 0
+        if first_item > 0:
+            parse_start_offset = item_end(items[first_item - 1])
+            parse_start = bisect_left(tokens.offsets, parse_start_offset)
+        resync_item = len(items)
+
+        def stop(pos: int) -> bool:
+            nonlocal resync_item
+            index = parse_start + pos
+            if index - shift < resync:
+                return False
+            old_offset = tokens.offsets[index] - delta
+            found = bisect_left(items,
+                                old_offset,
+                                lo=first_item,
+                                key=item_start)
+            if found < len(items) and item_start(items[found]) == old_offset:
+                resync_item = found
+                return True
+            return False
+
+        p = Parser(tokens=(Token(tokens, index)
+                           for index in range(parse_start, len(tokens))))
+        diagnostics.capture()
+        try:
+            parsed = parse_items(p, stop)
+        finally:
+            parse_diags = diagnostics.end_capture()
+        # An item that fails to parse reports the error at the token where
+        # it stops, which may be the first token of the next item.
+        parse_end = len(file.contents) - delta + 1
+        if resync_item < len(items):
+            parse_end = item_start(items[resync_item]) + 1
+        self.parse_diags = splice_diags(self.parse_diags, parse_start_offset,
+                                        parse_end, parse_diags, delta)
+
+        # Move the items after the parsed ones.
+        kept = items[resync_item:]
+        if delta != 0 or shift != 0:
+            shift_nodes(kept, delta, shift)
+        self.root.items = items[:first_item] + parsed + kept
+        last = max(len(tokens) - 2, 0)
+        self.root.loc = tokens.loc(0) | tokens.loc(last)
+        return ParseUpdate(tokens=range(first, first + len(lexed)),
+                           items=range(first_item, first_item + len(parsed)))
+
+
+# Drop the tokens from `index` onwards.
+def truncate_tokens(tokens: TokenBuffer, index: int):
+    del tokens.kinds[index:]
+    del tokens.offsets[index:]
+    del tokens.lengths[index:]
+    del tokens.symbols[index:]
+
+
+# Replace the diagnostics located in `[start, end)` before an edit with new
+# ones, and move the diagnostics after them by `delta`.
+def splice_diags(diags: List[Diagnostic], start: int, end: int,
+                 new_diags: List[Diagnostic], delta: int) -> List[Diagnostic]:
+    before = [d for d in diags if d.loc is None or d.loc.offset < start]
+    after = [
+        Diagnostic(d.severity,
+                   Loc(d.loc.file, d.loc.offset + delta, d.loc.length), d.msg)
+        for d in diags if d.loc is not None and d.loc.offset >= end
+    ]
+    return before + new_diags + after
+
+
+#===------------------------------------------------------------------------===#
+# Items
+#===------------------------------------------------------------------------===#
+
+
+# The location of an item including its keyword and body.
+def item_loc(item: ast.Item) -> Loc:
+    if isinstance(item, (ast.ModItem, ast.UseItem)):
+        return item.full_loc
+    return item.loc
+
+
+def item_start(item: ast.Item) -> int:
+    return item_loc(item).offset
+
+
+def item_end(item: ast.Item) -> int:
+    loc = item_loc(item)
+    return loc.offset + loc.length
+
+
+# The fields of each node class that hold locations and tokens, and the fields
+# that hold child nodes.
+SHIFT_FIELDS: Dict[type, Tuple[Tuple[str, ...], Tuple[str, ...],
+                               Tuple[Tuple[str, bool], ...]]] = {}
+for cls in vars(ast).values():
+    if isinstance(cls, type) and issubclass(cls, ast.AstNode):
+        hints = get_type_hints(cls, vars(ast))
+        SHIFT_FIELDS[cls] = (
+            tuple(name for name in cls.field_names if hints[name] is Loc),
+            tuple(name for name in cls.field_names if hints[name] is Token),
+            cls.child_fields,
+        )
+
+
+# Move the locations in a list of subtrees by `delta` bytes and their tokens
+# by `shift` positions in their buffer. This touches every node after an edit,
+# so locations and tokens are updated in place rather than replaced. Nodes may
+# share a location, e.g. an expression statement and its expression, which
+# must only be moved once.
+def shift_nodes(nodes: List[ast.Item], delta: int, shift: int):
+    stack: List[ast.AstNode] = list(nodes)
+    seen: Set[int] = set()
+    while stack:
+        node = stack.pop()
+        locs, tokens, children = SHIFT_FIELDS[node.__class__]
+        for name in locs:
+            loc = getattr(node, name)
+            if id(loc) not in seen:
+                seen.add(id(loc))
+                loc.offset += delta
+        if shift != 0:
+            for name in tokens:
+                getattr(node, name).index += shift
+        for name, is_list in children:
+            value = getattr(node, name)
+            if is_list:
+                stack.extend(value)
+            elif value is not None:
+                stack.append(value)
+
+
+__all__ = [
+    "ParsedFile",
+    "ParseUpdate",
+]
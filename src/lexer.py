@@ -1,22 +1,18 @@
 from __future__ import annotations
-from copy import copy
-from dataclasses import dataclass
+from array import array
+from collections import deque
 from enum import Enum, auto
+import re
 from src.diagnostics import *
 from src.source import *
+from src.symbols import symbols
 from typing import *
 
 
-def tokenize(file: SourceFile) -> List[Token]:
-    lexer = Lexer(loc=Loc(file, 0, 0),
-                  text=file.contents,
-                  total_length=len(file.contents),
-                  tokens=[])
-    while len(lexer.text) > 0:
-        tokenize_next(lexer)
-    lexer.reset_loc()
-    lexer.emit(TokenKind.EOF)
-    return lexer.tokens
+def tokenize(file: SourceFile) -> TokenBuffer:
+    tokens = TokenBuffer(file)
+    deque(lex_tokens(tokens), maxlen=0)
+    return tokens
 
 
 class TokenKind(Enum):
@@ -46,21 +42,143 @@ class TokenKind(Enum):
 
     ASSIGN = auto()
 
+    PLUS = auto()
+    MINUS = auto()
+    STAR = auto()
+    AMP = auto()
+    PIPE = auto()
+    CARET = auto()
+
     KW_DOMAIN = auto()
     KW_LET = auto()
     KW_MOD = auto()
     KW_TYPEVAR = auto()
+    KW_USE = auto()
 
     EOF = auto()
 
 
-@dataclass
+# Lookup table from the value of a token kind to the kind itself.
+TOKEN_KINDS: Dict[int, TokenKind] = {kind.value: kind for kind in TokenKind}
+
+
+# The tokens of a source file, stored as parallel columns of token kinds,
+# offsets, lengths, and interned symbols. This avoids allocating separate
+# objects for each token; `Token` views are only created for tokens that are
+# looked at. The symbol of tokens other than identifiers is 0.
+class TokenBuffer:
+    file: SourceFile
+    kinds: array
+    offsets: array
+    lengths: array
+    symbols: array
+
+    def __init__(self, file: SourceFile):
+        self.file = file
+        self.kinds = array("B")
+        self.offsets = array("Q")
+        self.lengths = array("I")
+        self.symbols = array("I")
+
+    # Symbol IDs are only meaningful within one process, so pickle the names
+    # of the symbols along with the buffer and intern them again on the other
+    # side.
+    def __reduce__(self):
+        names = {s: symbols.name(s) for s in dict.fromkeys(self.symbols)}
+        return (restore_token_buffer, (self.file, self.kinds, self.offsets,
+                                       self.lengths, self.symbols, names))
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    def __getitem__(self, index: int) -> Token:
+        if index < 0:
+            index += len(self.kinds)
+        if index < 0 or index >= len(self.kinds):
+            raise IndexError("token index out of range")
+        return Token(self, index)
+
+    def __iter__(self) -> Iterator[Token]:
+        for index in range(len(self.kinds)):
+            yield Token(self, index)
+
+    def append(self,
+               kind: TokenKind,
+               offset: int,
+               length: int,
+               symbol: int = 0):
+        self.kinds.append(kind.value)
+        self.offsets.append(offset)
+        self.lengths.append(length)
+        self.symbols.append(symbol)
+
+    def kind(self, index: int) -> TokenKind:
+        return TOKEN_KINDS[self.kinds[index]]
+
+    def loc(self, index: int) -> Loc:
+        return Loc(self.file, self.offsets[index], self.lengths[index])
+
+    def spelling(self, index: int) -> str:
+        offset = self.offsets[index]
+        return self.file.text(offset, offset + self.lengths[index])
+
+
+def restore_token_buffer(file: SourceFile, kinds: array, offsets: array,
+                         lengths: array, old_symbols: array,
+                         names: Dict[int, str]) -> TokenBuffer:
+    tokens = TokenBuffer(file)
+    tokens.kinds = kinds
+    tokens.offsets = offsets
+    tokens.lengths = lengths
+    remap = {
+        s: symbols.intern(name.encode()) if s else 0
+        for s, name in names.items()
+    }
+    tokens.symbols = array("I", map(remap.__getitem__, old_symbols))
+    return tokens
+
+
+# A view of a single token in a `TokenBuffer`.
 class Token:
-    loc: Loc
-    kind: TokenKind
+    __slots__ = ("buffer", "index")
+
+    buffer: TokenBuffer
+    index: int
+
+    def __init__(self, buffer: TokenBuffer, index: int):
+        self.buffer = buffer
+        self.index = index
+
+    def __repr__(self) -> str:
+        return f"Token({self.kind.name}, {self.loc!r})"
+
+    def __eq__(self, other: object) -> bool:
+        return (isinstance(other, Token) and self.buffer is other.buffer
+                and self.index == other.index)
+
+    def __hash__(self) -> int:
+        return hash((id(self.buffer), self.index))
+
+    # Pickle as a plain tuple, which is considerably smaller and faster than
+    # the default encoding of slotted objects.
+    def __reduce__(self):
+        return (Token, (self.buffer, self.index))
+
+    @property
+    def kind(self) -> TokenKind:
+        return self.buffer.kind(self.index)
+
+    @property
+    def loc(self) -> Loc:
+        return self.buffer.loc(self.index)
+
+    # The interned identifier, or 0 if the token is not an identifier.
+    @property
+    def symbol(self) -> int:
+        return self.buffer.symbols[self.index]
 
     def spelling(self) -> str:
-        return self.loc.spelling()
+        return self.buffer.spelling(self.index)
 
 
 SYMBOLS1: Dict[str, TokenKind] = {
@@ -78,6 +196,12 @@ SYMBOLS1: Dict[str, TokenKind] = {
     "<": TokenKind.LT,
     ">": TokenKind.GT,
     "=": TokenKind.ASSIGN,
+    "+": TokenKind.PLUS,
+    "-": TokenKind.MINUS,
+    "*": TokenKind.STAR,
+    "&": TokenKind.AMP,
+    "|": TokenKind.PIPE,
+    "^": TokenKind.CARET,
 }
 
 SYMBOLS2: Dict[str, TokenKind] = {
@@ -93,105 +217,113 @@ KEYWORDS: Dict[str, TokenKind] = {
     "let": TokenKind.KW_LET,
     "mod": TokenKind.KW_MOD,
     "typevar": TokenKind.KW_TYPEVAR,
+    "use": TokenKind.KW_USE,
 }
 
+# All symbols, keyed by their spelling.
+SYMBOLS: Dict[str, TokenKind] = {**SYMBOLS1, **SYMBOLS2}
 
-@dataclass
-class Lexer:
-    loc: Loc
-    text: str
-    total_length: int
-    tokens: List[Token]
-
-    def reset_loc(self):
-        self.loc.offset = self.total_length - len(self.text)
-        self.loc.length = 0
-
-    def get_loc(self) -> Loc:
-        loc = copy(self.loc)
-        loc.length = self.total_length - len(self.text) - loc.offset
-        return loc
-
-    def consume(self, num: int = 1):
-        self.text = self.text[num:]
-
-    def consume_while(self, predicate: Callable[[str], bool]) -> bool:
-        if len(self.text) == 0 or not predicate(self.text[0]):
-            return False
-        self.consume()
-        while len(self.text) > 0 and predicate(self.text[0]):
-            self.consume()
-        return True
-
-    def emit(self, kind: TokenKind):
-        self.tokens.append(Token(loc=self.get_loc(), kind=kind))
-
-
-def is_whitespace(c: str) -> bool:
-    return c in " \t\n\r"
-
-
-def is_digit(c: str) -> bool:
-    return c >= "0" and c <= "9"
-
-
-def is_ident_start(c: str) -> bool:
-    return (c >= "a" and c <= "z") or (c >= "A" and c <= "Z") or c == "_"
-
-
-def is_ident(c: str) -> bool:
-    return is_ident_start(c) or is_digit(c)
-
-
-def tokenize_next(lex: Lexer):
-    # Skip whitespace.
-    if lex.consume_while(is_whitespace):
-        return
-
-    # Skip single-line comments.
-    if lex.text[:2] == "//":
-        lex.consume_while(lambda x: x != "\n")
-        return
-
-    # Skip multi-line comments.
-    if lex.text[:2] == "/*":
-        lex.reset_loc()
-        lex.consume(2)
-        while len(lex.text) > 0 and lex.text[:2] != "*/":
-            lex.consume()
-        if lex.text[:2] != "*/":
-            emit_error(lex.get_loc(), "unclosed comment; missing `*/`")
-        lex.consume(2)
-        return
-
-    lex.reset_loc()
-
-    # Parse symbols.
-    if kind := SYMBOLS2.get(lex.text[:2]):
-        lex.consume(2)
-        lex.emit(kind)
-        return
-
-    if kind := SYMBOLS1.get(lex.text[:1]):
-        lex.consume(1)
-        lex.emit(kind)
-        return
-
-    # Parse number literals.
-
-    # Parse identifiers.
-    if is_ident_start(lex.text[0]):
-        lex.consume_while(is_ident)
-        kind = KEYWORDS.get(lex.get_loc().spelling()) or TokenKind.IDENT
-        lex.emit(kind)
-        return
+# The lexer operates on the raw bytes of the source file, so keywords and
+# symbols are looked up by their encoded spelling without decoding the text.
+# The tables map directly to token kind values, which is what `TokenBuffer`
+# stores.
+KEYWORDS_BYTES: Dict[bytes, int] = {
+    k.encode(): v.value
+    for k, v in KEYWORDS.items()
+}
+SYMBOLS_BYTES: Dict[bytes, int] = {
+    k.encode(): v.value
+    for k, v in SYMBOLS.items()
+}
 
-    # If we get here, this character is not supported.
-    emit_error(lex.get_loc(), f"unknown character `{lex.text[0]}`")
+# The lexer is driven by a single compiled regex with one alternative per
+# token class. Each token costs one match; the name of the matching group
+# determines what to do with it. Longer symbols are tried before shorter ones
+# such that `<=` is not lexed as `<` followed by `=`.
+TOKEN_REGEX = re.compile(
+    b"|".join([
+        rb"(?P<whitespace>[ \t\n\r]+)",
+        rb"(?P<line_comment>//[^\n]*)",
+        rb"(?P<block_comment>/\*.*?\*/)",
+        rb"(?P<unclosed_comment>/\*)",
+        rb"(?P<number>0x[0-9a-fA-F_]+|0b[01_]+|[0-9][0-9_]*)",
+        rb"(?P<ident>[a-zA-Z_][a-zA-Z0-9_]*)",
+        b"(?P<symbol>" + b"|".join(
+            re.escape(s)
+            for s in sorted(SYMBOLS_BYTES, key=len, reverse=True)) + b")",
+    ]),
+    re.DOTALL,
+)
+
+
+# Lazily produce the tokens in a source file, ending with an EOF token.
+def iter_tokens(file: SourceFile) -> Iterator[Token]:
+    tokens = TokenBuffer(file)
+    for index in lex_tokens(tokens):
+        yield Token(tokens, index)
+
+
+# Lex the tokens of the buffer's source file into the buffer, starting at the
+# given offset. Yields the index of each token as it is added, ending with an
+# EOF token.
+def lex_tokens(tokens: TokenBuffer, offset: int = 0) -> Iterator[int]:
+    file = tokens.file
+    text = file.contents
+    match = TOKEN_REGEX.match
+    add_kind = tokens.kinds.append
+    add_offset = tokens.offsets.append
+    add_length = tokens.lengths.append
+    add_symbol = tokens.symbols.append
+    get_symbol = symbols.ids.get
+    intern = symbols.intern
+    ident = TokenKind.IDENT.value
+    lit_num = TokenKind.LIT_NUM.value
+    while offset < len(text):
+        m = match(text, offset)
+        if m is None:
+            # Report the character and skip over all of its UTF-8 bytes.
+            char = file.text(offset, offset + 4)[:1]
+            report_error(Loc(file, offset, 0), f"unknown character `{char}`")
+            offset += 1
+            while offset < len(text) and 0x80 <= text[offset] < 0xC0:
+                offset += 1
+            continue
+        group = m.lastgroup
+        end = m.end()
+
+        kind: Optional[int] = None
+        symbol = 0
+        if group == "ident":
+            spelling = m.group()
+            kind = KEYWORDS_BYTES.get(spelling, ident)
+            if kind == ident:
+                symbol = get_symbol(spelling) or intern(spelling)
+        elif group == "symbol":
+            kind = SYMBOLS_BYTES[m.group()]
+        elif group == "number":
+            kind = lit_num
+        elif group == "unclosed_comment":
+            report_error(Loc(file, offset,
+                             len(text) - offset),
+                         "unclosed comment; missing `*/`")
+            end = len(text)
+
+        if kind is not None:
+            add_kind(kind)
+            add_offset(offset)
+            add_length(end - offset)
+            add_symbol(symbol)
+            yield len(tokens) - 1
+        offset = end
+
+    tokens.append(TokenKind.EOF, offset, 0)
+    yield len(tokens) - 1
 
 
 __all__ = [
     "TokenKind",
     "Token",
+    "TokenBuffer",
     "tokenize",
+    "iter_tokens",
 ]
@@ -0,0 +1,512 @@
+from __future__ import annotations
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from src import ast, driver
+from src.cache import module_cache_keys
+from src.diagnostics import *
+from src.incremental import ParsedFile
+from src.lexer import Token
+from src.names import resolve_names
+from src.schedule import *
+from src.source import *
+from src.typeck import (Context, RootContext, Signature, final_types,
+                        typeck_module)
+from typing import *
+from urllib.parse import quote, unquote, urlparse
+import io
+import json
+import os
+import sys
+import time
+import traceback
+
+# A language server for editors, speaking the Language Server Protocol over
+# stdin and stdout. Open documents are kept in memory, parsed incrementally, and
+# analyzed after every change. The results of type checking are kept per module,
+# keyed like the entries of the module cache by the module's text and the text
+# of the modules it calls, such that an edit only re-checks the modules it
+# affects. All other modules keep their diagnostics and hover types, moved to
+# their new offsets.
+
+# The JSON-RPC error codes used in responses.
+METHOD_NOT_FOUND = -32601
+INTERNAL_ERROR = -32603
+
+# The LSP severities of diagnostics.
+SEVERITIES = {"error": 1, "warning": 2, "info": 3}
+
+#===------------------------------------------------------------------------===#
+# Protocol
+#===------------------------------------------------------------------------===#
+
+
+# Read a message, which is a JSON object preceded by headers giving its length.
+# Returns None at the end of the input.
+def read_message(f: io.BufferedIOBase) -> Optional[Dict[str, Any]]:
+    length = None
+    while True:
+        line = f.readline()
+        if not line:
+            return None
+        line = line.strip()
+        if not line:
+            break
+        name, _, value = line.partition(b":")
+        if name.strip().lower() == b"content-length":
+            length = int(value)
+    if length is None:
+        return None
+    return json.loads(f.read(length))
+
+
+def write_message(f: io.BufferedIOBase, msg: Dict[str, Any]):
+    body = json.dumps(msg, separators=(",", ":")).encode()
+    f.write(b"Content-Length: %d\r\n\r\n" % len(body))
+    f.write(body)
+    f.flush()
+
+
+def uri_to_path(uri: str) -> str:
+    parsed = urlparse(uri)
+    if parsed.scheme == "file":
+        return unquote(parsed.path)
+    return uri
+
+
+def path_to_uri(path: str) -> str:
+    return "file://" + quote(os.path.abspath(path))
+
+
+# Convert between byte offsets into a file and LSP positions, which count
+# lines from 0 and characters in UTF-16 code units.
+def offset_to_position(file: SourceFile, offset: int) -> Dict[str, int]:
+    line = file.line_index(offset)
+    prefix = file.text(file.line_starts()[line], offset)
+    return {"line": line, "character": len(prefix.encode("utf-16-le")) // 2}
+
+
+def position_to_offset(file: SourceFile, position: Dict[str, int]) -> int:
+    starts = file.line_starts()
+    line = position["line"]
+    if line >= len(starts):
+        return len(file.contents)
+    start, end = file.line_range(starts[line])
+    units = position["character"]
+    offset = start
+    for char in file.text(start, end):
+        if units <= 0:
+            break
+        units -= len(char.encode("utf-16-le")) // 2
+        offset += len(char.encode())
+    return min(offset, end)
+
+
+def loc_to_range(loc: Loc) -> Dict[str, Any]:
+    return {
+        "start": offset_to_position(loc.file, loc.offset),
+        "end": offset_to_position(loc.file, loc.offset + loc.length),
+    }
+
+
+#===------------------------------------------------------------------------===#
+# Documents
+#===------------------------------------------------------------------------===#
+
+
+# The type checking results of a module, with offsets relative to the start of
+# the module: its diagnostics, and the types of its ports and let bindings
+# keyed by the offset of their name.
+@dataclass
+class ModuleResult:
+    diags: List[PortableDiagnostic]
+    types: Dict[int, str]
+
+
+# The outcome of analyzing a document: its syntax tree with resolved names,
+# the modules declared in the document itself, and the type checking results of
+# each of those modules that could be checked, keyed by module cache key.
+@dataclass
+class Analysis:
+    file: SourceFile
+    modules: List[ast.ModItem]
+    keys: List[str]
+    results: Dict[str, ModuleResult]
+    diags: List[Diagnostic]
+
+    # The module of the document that contains an offset, if any.
+    def module_at(self, offset: int) -> Optional[Tuple[int, ast.ModItem]]:
+        starts = [mod.full_loc.offset for mod in self.modules]
+        index = bisect_right(starts, offset) - 1
+        if index < 0:
+            return None
+        mod = self.modules[index]
+        if offset > mod.full_loc.offset + mod.full_loc.length:
+            return None
+        return index, mod
+
+
+# An open document. Its tokens and syntax tree are updated incrementally as the
+# editor sends changes.
+@dataclass
+class Document:
+    uri: str
+    path: str
+    version: int
+    parsed: ParsedFile
+    analysis: Optional[Analysis] = None
+
+    @property
+    def file(self) -> SourceFile:
+        return self.parsed.file
+
+    # Apply a change sent by the editor, which either replaces a range of the
+    # text or, without a range, the entire text.
+    def apply_change(self, change: Dict[str, Any]):
+        text = change["text"].encode()
+        if "range" not in change:
+            self.parsed = ParsedFile(SourceFile(self.path, text))
+            return
+        start = position_to_offset(self.file, change["range"]["start"])
+        end = position_to_offset(self.file, change["range"]["end"])
+        self.parsed.edit(start, end - start, text)
+
+
+#===------------------------------------------------------------------------===#
+# Server
+#===------------------------------------------------------------------------===#
+
+
+class LanguageServer:
+    output: io.BufferedIOBase
+    documents: Dict[str, Document]
+    shutdown_requested: bool
+
+    def __init__(self, output: io.BufferedIOBase):
+        self.output = output
+        self.documents = {}
+        self.shutdown_requested = False
+
+    # Handle messages until the client exits. Returns the exit code.
+    def run(self, input: io.BufferedIOBase) -> int:
+        while (msg := read_message(input)) is not None:
+            if msg.get("method") == "exit":
+                break
+            self.handle(msg)
+        return 0 if self.shutdown_requested else 1
+
+    def handle(self, msg: Dict[str, Any]):
+        method = msg.get("method")
+        handler = self.HANDLERS.get(method) if method else None
+        params = msg.get("params") or {}
+        try:
+            if handler is None:
+                if "id" in msg and method is not None:
+                    self.respond_error(msg["id"], METHOD_NOT_FOUND,
+                                       f"unsupported method `{method}`")
+                return
+            result = handler(self, params)
+            if "id" in msg:
+                self.respond(msg["id"], result)
+        except Exception as e:
+            self.log(traceback.format_exc())
+            if "id" in msg:
+                self.respond_error(msg["id"], INTERNAL_ERROR, str(e))
+
+    def respond(self, id: Any, result: Any):
+        write_message(self.output, {
+            "jsonrpc": "2.0",
+            "id": id,
+            "result": result
+        })
+
+    def respond_error(self, id: Any, code: int, message: str):
+        write_message(
+            self.output, {
+                "jsonrpc": "2.0",
+                "id": id,
+                "error": {
+                    "code": code,
+                    "message": message
+                }
+            })
+
+    def notify(self, method: str, params: Any):
+        write_message(self.output, {
+            "jsonrpc": "2.0",
+            "method": method,
+            "params": params
+        })
+
+    def log(self, message: str):
+        self.notify("window/logMessage", {"type": 4, "message": message})
+
+    #===--------------------------------------------------------------------===#
+    # Lifecycle
+
+    def initialize(self, params: Dict[str, Any]) -> Any:
+        driver.parse_cache = driver.ParseCache()
+        return {
+            "capabilities": {
+                "textDocumentSync": {
+                    "openClose": True,
+                    "change": 2  # incremental
+                },
+                "hoverProvider": True,
+            },
+            "serverInfo": {
+                "name": "doty"
+            },
+        }
+
+    def initialized(self, params: Dict[str, Any]) -> Any:
+        return None
+
+    def shutdown(self, params: Dict[str, Any]) -> Any:
+        self.shutdown_requested = True
+        return None
+
+    #===--------------------------------------------------------------------===#
+    # Document Synchronization
+
+    def did_open(self, params: Dict[str, Any]) -> Any:
+        item = params["textDocument"]
+        path = uri_to_path(item["uri"])
+        doc = Document(uri=item["uri"],
+                       path=path,
+                       version=item.get("version", 0),
+                       parsed=ParsedFile(
+                           SourceFile(path, item["text"].encode())))
+        self.documents[doc.uri] = doc
+        self.analyze(doc)
+
+    def did_change(self, params: Dict[str, Any]) -> Any:
+        doc = self.documents.get(params["textDocument"]["uri"])
+        if doc is None:
+            return
+        for change in params["contentChanges"]:
+            doc.apply_change(change)
+        doc.version = params["textDocument"].get("version", doc.version)
+        self.analyze(doc)
+
+    def did_close(self, params: Dict[str, Any]) -> Any:
+        doc = self.documents.pop(params["textDocument"]["uri"], None)
+        if doc is None:
+            return
+        driver.source_overlay.pop(os.path.realpath(doc.path), None)
+        self.notify("textDocument/publishDiagnostics", {
+            "uri": doc.uri,
+            "diagnostics": []
+        })
+
+    def did_save(self, params: Dict[str, Any]) -> Any:
+        return None
+
+    #===--------------------------------------------------------------------===#
+    # Analysis
+
+    # Parse the files a document imports, resolve names, and type-check
+    # the modules of the document that changed since the last analysis, or
+    # whose callees did. Open documents take precedence over the files on disk.
+    # Publishes the document's diagnostics.
+    def analyze(self, doc: Document):
+        start = time.perf_counter()
+        driver.source_overlay[os.path.realpath(doc.path)] = bytes(
+            doc.file.contents)
+        diagnostics.capture()
+        try:
+            root = driver.parse_files([], parsed=[doc.parsed.root])
+            assert root is not None
+            resolve_names(root)
+        finally:
+            diags = doc.parsed.diags + diagnostics.end_capture()
+
+        # Find the modules with errors, and those whose ports have errors.
+        # Neither can be checked: the former may have unresolved names, and the
+        # latter have no usable signature for their callers.
+        modules = collect_modules(root)
+        graph = call_graph(modules)
+        keys = module_cache_keys(modules, graph)
+        broken, broken_ports = find_broken_modules(modules, diags)
+
+        # Check the document's modules, reusing the previous results of those
+        # whose key is unchanged.
+        file = root.loc.file
+        previous = doc.analysis.results if doc.analysis else {}
+        results: Dict[str, ModuleResult] = {}
+        signatures: Dict[int, Optional[Signature]] = {}
+        doc_modules: List[ast.ModItem] = []
+        doc_keys: List[str] = []
+        num_checked = 0
+        for index, mod in enumerate(modules):
+            if mod.full_loc.file is not file:
+                continue
+            doc_modules.append(mod)
+            doc_keys.append(keys[index])
+            if index in broken or any(i in broken_ports for i in graph[index]):
+                continue
+            result = previous.get(keys[index]) or results.get(keys[index])
+            if result is None:
+                result = check_module(mod, signatures)
+                num_checked += 1
+            results[keys[index]] = result
+
+        doc.analysis = Analysis(file=file,
+                                modules=doc_modules,
+                                keys=doc_keys,
+                                results=results,
+                                diags=[
+                                    diag for diag in diags
+                                    if diag.loc and diag.loc.file is file
+                                ])
+        self.publish_diagnostics(doc)
+        elapsed = (time.perf_counter() - start) * 1000
+        self.log(f"analyzed {doc.path} in {elapsed:.0f} ms; "
+                 f"checked {num_checked} of {len(doc_modules)} modules")
+
+    def publish_diagnostics(self, doc: Document):
+        analysis = doc.analysis
+        assert analysis is not None
+        diags = list(analysis.diags)
+        for mod, key in zip(analysis.modules, analysis.keys):
+            if result := analysis.results.get(key):
+                diags += import_diagnostics(result.diags, analysis.file,
+                                            mod.full_loc.offset)
+        self.notify(
+            "textDocument/publishDiagnostics", {
+                "uri":
+                doc.uri,
+                "version":
+                doc.version,
+                "diagnostics": [{
+                    "range": loc_to_range(diag.loc),
+                    "severity": SEVERITIES[diag.severity],
+                    "source": "doty",
+                    "message": diag.msg,
+                } for diag in diags if diag.loc is not None],
+            })
+
+    #===--------------------------------------------------------------------===#
+    # Queries
+
+    # Show the type of the port or let binding under the cursor, or of the one
+    # an identifier refers to.
+    def hover(self, params: Dict[str, Any]) -> Any:
+        doc = self.documents.get(params["textDocument"]["uri"])
+        if doc is None or doc.analysis is None:
+            return None
+        analysis = doc.analysis
+        offset = position_to_offset(analysis.file, params["position"])
+        found = analysis.module_at(offset)
+        if found is None:
+            return None
+        index, mod = found
+        result = analysis.results.get(analysis.keys[index])
+        if result is None:
+            return None
+
+        for node in mod.walk(ast.WalkOrder.PreOrder):
+            name = getattr(node, "name", None)
+            if not isinstance(name, Token) or not contains(name.loc, offset):
+                continue
+            target = node.binding.node if isinstance(node,
+                                                     ast.IdentExpr) else node
+            if target is None:
+                return None
+            ty = result.types.get(target.loc.offset - mod.full_loc.offset)
+            if ty is None:
+                return None
+            return {
+                "contents": {
+                    "kind": "markdown",
+                    "value": f"```\n{name.spelling()}: {ty}\n```"
+                },
+                "range": loc_to_range(name.loc),
+            }
+        return None
+
+    HANDLERS: Dict[str, Callable[[LanguageServer, Dict[str, Any]], Any]] = {
+        "initialize": initialize,
+        "initialized": initialized,
+        "shutdown": shutdown,
+        "textDocument/didOpen": did_open,
+        "textDocument/didChange": did_change,
+        "textDocument/didClose": did_close,
+        "textDocument/didSave": did_save,
+        "textDocument/hover": hover,
+    }
+
+
+def contains(loc: Loc, offset: int) -> bool:
+    return loc.offset <= offset <= loc.offset + loc.length
+
+
+# Determine which modules contain errors, and which of those have errors in
+# their name or ports. Returns the sets of their indices.
+def find_broken_modules(modules: List[ast.ModItem],
+                        diags: List[Diagnostic]) -> Tuple[Set[int], Set[int]]:
+    by_file: Dict[int, Tuple[List[int], List[int]]] = {}
+    for index, mod in enumerate(modules):
+        starts, indices = by_file.setdefault(id(mod.full_loc.file), ([], []))
+        starts.append(mod.full_loc.offset)
+        indices.append(index)
+
+    broken: Set[int] = set()
+    broken_ports: Set[int] = set()
+    for diag in diags:
+        if diag.severity != "error" or diag.loc is None:
+            continue
+        starts, indices = by_file.get(id(diag.loc.file), ([], []))
+        position = bisect_right(starts, diag.loc.offset) - 1
+        if position < 0:
+            continue
+        index = indices[position]
+        mod = modules[index]
+        if diag.loc.offset > mod.full_loc.offset + mod.full_loc.length:
+            continue
+        broken.add(index)
+        if diag.loc.offset < ports_end(mod):
+            broken_ports.add(index)
+    return broken, broken_ports
+
+
+# The offset at which the declaration of a module's name and ports ends.
+def ports_end(mod: ast.ModItem) -> int:
+    end = mod.name.loc.offset + mod.name.loc.length
+    ports: List[Union[ast.ModArg, ast.ModResult]] = [*mod.args, *mod.results]
+    for port in ports:
+        end = max(end, port.full_loc.offset + port.full_loc.length)
+    for type_var in mod.type_vars:
+        end = max(end, type_var.loc.offset + type_var.loc.length)
+    return end
+
+
+# Type-check a single module and collect its results. The signatures of the
+# modules it calls are computed on demand and shared through `signatures`.
+def check_module(mod: ast.ModItem,
+                 signatures: Dict[int, Optional[Signature]]) -> ModuleResult:
+    ctx = Context(root=RootContext(signatures=signatures))
+    diagnostics.capture()
+    try:
+        typeck_module(ctx, mod)
+    finally:
+        diags = diagnostics.end_capture()
+    base = mod.full_loc.offset
+    return ModuleResult(diags=export_diagnostics(diags, base),
+                        types={
+                            node.loc.offset - base: str(ty)
+                            for node, ty in final_types(ctx, mod)
+                        })
+
+
+# Run a language server on stdin and stdout until the client exits.
+def serve_lsp() -> int:
+    server = LanguageServer(sys.stdout.buffer)  # type: ignore
+    # Anything else printed to stdout would corrupt the protocol.
+    sys.stdout = sys.stderr
+    return server.run(sys.stdin.buffer)  # type: ignore
+
+
+__all__ = [
+    "LanguageServer",
+    "serve_lsp",
+]
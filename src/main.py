@@ -1,21 +1,19 @@
+# The entry point of the compiler. Only the modules needed by the requested mode
+# are imported, such that e.g. dumping tokens does not load the type checker.
 import argparse
+import os
 import sys
-from src.ast import dump_ast
-from src.diagnostics import *
-from src.lexer import tokenize
-from src.parser import parse
-from src.source import *
-from src.names import resolve_names
-from src.typeck import type_check
+from typing import List, Optional
 
 
-def main():
+def main(argv: Optional[List[str]] = None):
     # Parse command line arguments.
     parser = argparse.ArgumentParser()
 
-    parser.add_argument("input",
+    parser.add_argument("inputs",
                         metavar="INPUT",
-                        help="Source file to compile")
+                        nargs="*",
+                        help="Source files to compile")
 
     parser.add_argument("--dump-tokens",
                         action="store_true",
@@ -29,35 +27,225 @@ def main():
                         action="store_true",
                         help="Dump syntax with resolved names and exit")
 
-    args = parser.parse_args()
+    parser.add_argument("--format",
+                        choices=["text", "ndjson"],
+                        default="text",
+                        help="Format of the dumped tokens and syntax: "
+                        "`text` to be read by humans, or `ndjson` with one "
+                        "JSON object per token or node for other tools")
 
-    # Tokenize the input.
-    file = openSourceFile(args.input)
-    tokens = tokenize(file)
-    if args.dump_tokens:
-        for token in tokens:
-            print(f"- {token.kind.name}: `{token.loc.spelling()}`")
+    parser.add_argument("--mmap",
+                        action="store_true",
+                        help="Memory-map the input instead of reading it")
+
+    parser.add_argument("--error-limit",
+                        metavar="N",
+                        type=int,
+                        default=20,
+                        help="Stop after N errors; 0 for no limit")
+
+    parser.add_argument(
+        "--trace",
+        metavar="SPEC",
+        default=os.environ.get("DOTY_TRACE", ""),
+        help="Enable tracing for comma-separated `category[=level]` entries "
+        "(e.g. `typeck=info,infer`, `all=trace`)")
+
+    parser.add_argument("--trace-file",
+                        metavar="PATH",
+                        default=os.environ.get("DOTY_TRACE_FILE"),
+                        help="Write trace records to PATH as JSON lines")
+
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        metavar="N",
+        type=int,
+        default=1,
+        help="Parse files and type-check modules on N worker processes")
+
+    parser.add_argument("--no-cache",
+                        action="store_true",
+                        help="Do not use the incremental compilation cache")
+
+    parser.add_argument("--cache-dir",
+                        metavar="PATH",
+                        help="Directory of the incremental compilation cache")
+
+    parser.add_argument("--cache-size",
+                        metavar="MB",
+                        type=int,
+                        default=256,
+                        help="Size limit of the incremental compilation cache")
+
+    parser.add_argument(
+        "--server",
+        action="store_true",
+        help=
+        "Serve compilations on a Unix socket, for clients with DOTY_SERVER set"
+    )
+
+    parser.add_argument(
+        "--lsp",
+        action="store_true",
+        help="Run a language server on stdin and stdout, for use by editors")
+
+    parser.add_argument("--socket",
+                        metavar="PATH",
+                        default=os.environ.get("DOTY_SERVER"),
+                        help="Socket of the compile server")
+
+    parser.add_argument(
+        "--startup-profile",
+        action="store_true",
+        help="Run with `-X importtime` and report the slowest imports")
+
+    parser.add_argument(
+        "--time-passes",
+        action="store_true",
+        help="Report the time and memory spent in each pass, and statistics")
+
+    parser.add_argument(
+        "--stats-json",
+        metavar="PATH",
+        help="Write pass timings and statistics to PATH as JSON")
+
+    parser.add_argument(
+        "--track-memory",
+        action="store_true",
+        help="Also report the peak memory allocated in each pass (slow)")
+
+    args = parser.parse_args(argv)
+    if args.startup_profile:
+        from src.startup import profile_startup
+        profile_startup([
+            arg for arg in (argv if argv is not None else sys.argv[1:])
+            if arg != "--startup-profile"
+        ])
+    if args.server:
+        from src.client import default_socket_path
+        from src.server import serve
+        serve(args.socket or default_socket_path())
         return
+    if args.lsp:
+        from src.lsp import serve_lsp
+        sys.exit(serve_lsp())
+    if not args.inputs:
+        parser.error("at least one INPUT is required")
+
+    from src.diagnostics import diagnostics
+    from src.tracing import configure_tracing, tracing_enabled
+    diagnostics.error_limit = args.error_limit
+    if args.trace:
+        import src.typeck  # registers the type checker's trace categories
+    configure_tracing(args.trace, args.trace_file)
+
+    # Collect statistics if requested, and report them however compilation
+    # ends.
+    from src.stats import statistics
+    if args.time_passes or args.stats_json or args.track_memory:
+        statistics.enable(track_memory=args.track_memory)
+    try:
+        compile_inputs(args)
+    except BrokenPipeError:
+        # The consumer of a dump stopped reading. Point stdout at devnull such
+        # that flushing it at exit does not fail again.
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
+    finally:
+        if statistics.enabled:
+            write_statistics(args)
+
 
-    # Parse the tokens into an AST.
-    root = parse(tokens)
+# Run the compiler passes on the inputs. Exits once compilation is complete.
+def compile_inputs(args: argparse.Namespace):
+    from src.diagnostics import diagnostics
+    from src.stats import statistics
+    from src.tracing import tracing_enabled
+
+    # Tokenize the inputs.
+    if args.dump_tokens:
+        from src.driver import open_source_file
+        from src.dump import dump_tokens
+        from src.lexer import tokenize
+        for path in args.inputs:
+            if file := open_source_file(path, use_mmap=args.mmap):
+                with statistics.timed("lex"):
+                    tokens = tokenize(file)
+                statistics.count("tokens", len(tokens))
+                dump_tokens(tokens, sys.stdout, args.format)
+        diagnostics.finish()
+
+    # The cache skips the passes whose results it holds, so it is bypassed
+    # while tracing to produce the full trace.
+    from src.cache import ModuleCache, default_cache_dir
+    cache: Optional[ModuleCache] = None
+    if not args.no_cache and not tracing_enabled():
+        cache = ModuleCache(args.cache_dir or default_cache_dir(),
+                            args.cache_size * 1024 * 1024)
+
+    # Parse the inputs and the files they import into an AST. Syntax errors are
+    # recovered from, such that all of them are reported, but the later passes
+    # only run on valid input.
+    from src.driver import parse_files
+    with statistics.timed("parse"):
+        root = parse_files(args.inputs,
+                           jobs=args.jobs,
+                           use_mmap=args.mmap,
+                           cache=cache)
+    if statistics.enabled and root is not None:
+        count_ast(root)
+    if root is None or diagnostics.num_errors > 0:
+        diagnostics.finish()
     if args.dump_ast:
-        print(dump_ast(root))
-        return
+        from src.dump import dump_tree
+        dump_tree(root, sys.stdout, args.format)
+        diagnostics.finish()
 
     # Resolve names in the AST.
-    resolve_names(root)
+    from src.names import resolve_names
+    with statistics.timed("resolve names"):
+        resolve_names(root)
+    if diagnostics.num_errors > 0:
+        diagnostics.finish()
     if args.dump_resolved:
-        print(dump_ast(root))
-        return
+        from src.dump import dump_tree
+        dump_tree(root, sys.stdout, args.format)
+        diagnostics.finish()
 
     # Type-check the AST.
-    type_check(root)
+    from src.typeck import type_check
+    with statistics.timed("type check"):
+        type_check(root, jobs=args.jobs, cache=cache)
+    diagnostics.finish()
 
 
-def openSourceFile(path: str) -> SourceFile:
-    try:
-        with open(path, "r") as f:
-            return SourceFile(path, f.read())
-    except Exception as e:
-        emit_error(None, f"unable to open file: {e}")
+# Count the files, tokens, nodes, modules, and call sites of an AST.
+def count_ast(root):
+    from src import ast
+    from src.stats import statistics
+    buffers = {}
+    for node in root.walk(ast.WalkOrder.PreOrder):
+        statistics.count("ast nodes")
+        if isinstance(node, (ast.ModItem, ast.UseItem)):
+            buffers[id(node.name.buffer)] = node.name.buffer
+        if isinstance(node, ast.ModItem):
+            statistics.count("modules")
+        elif isinstance(node, ast.CallExpr):
+            statistics.count("call sites")
+    statistics.count("files", len(buffers))
+    statistics.count("tokens", sum(len(buffer) for buffer in buffers.values()))
+
+
+def write_statistics(args: argparse.Namespace):
+    from src.stats import statistics
+    if args.time_passes or args.track_memory:
+        print(statistics.report(), file=sys.stderr)
+    if args.stats_json:
+        import json
+        try:
+            with open(args.stats_json, "w") as f:
+                json.dump(statistics.to_json(), f, indent=2)
+                f.write("\n")
+        except OSError as e:
+            print(f"error: unable to write statistics: {e}", file=sys.stderr)
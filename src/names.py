@@ -1,77 +1,117 @@
 from __future__ import annotations
-from typing import Optional, Dict
-from dataclasses import dataclass, field
+from typing import Optional, Dict, List, Tuple, Union
 from src import ast
+from src.lexer import Token
 from src.source import *
 from src.diagnostics import *
-
-
-def resolve_names(root: ast.AstNode):
-    resolve_node(root, Scope(parent=None))
-
-    for child in root.walk(ast.WalkOrder.PreOrder):
-        for name, value in child.__dict__.items():
-            if isinstance(value, ast.Binding) and value.node is None:
-                emit_error(child.loc,
-                           f"unresolved {name} in {child.__class__.__name__}")
-
-
-def resolve_node(node: ast.AstNode, scope: Scope):
-    if isinstance(node, ast.Root):
-        subscope = Scope(parent=scope)
-        for item in node.items:
-            declare_item(item, subscope)
-        for child in node.children():
-            resolve_node(child, subscope)
-        return
-
-    if isinstance(node, ast.ModItem):
-        subscope = Scope(parent=scope)
-        for child in node.children():
-            resolve_node(child, subscope)
-        return
-
-    for child in node.children():
-        resolve_node(child, scope)
-
-    if isinstance(node, ast.IdentExpr):
-        node.binding.node = resolve(scope, node.name.spelling(), node.name.loc)
-    elif isinstance(node, ast.DomainIdent):
-        node.binding.node = resolve(scope, node.name.spelling(), node.name.loc)
-    elif isinstance(node, ast.LetStmt):
-        declare(scope, node.name.spelling(), node.name.loc, node)
-    elif isinstance(node, ast.TypeVarStmt):
-        declare(scope, node.name.spelling(), node.name.loc, node)
-    elif isinstance(node, ast.ModTypeVar):
-        declare(scope, node.name.spelling(), node.name.loc, node)
-    elif isinstance(node, ast.ModArg):
-        declare(scope, node.name.spelling(), node.name.loc, node)
-
-
-def resolve(scope: Scope, name: str, name_loc: Loc) -> ast.AstNode:
-    current_scope: Optional[Scope] = scope
-    while current_scope:
-        if node := current_scope.names.get(name):
-            return node
-        current_scope = current_scope.parent
-    emit_error(name_loc, f"unknown name `{name}`")
-
-
-@dataclass
-class Scope:
-    parent: Optional[Scope]
-    names: Dict[str, ast.AstNode] = field(default_factory=dict)
-
-
-def declare(scope: Scope, name: str, name_loc: Loc, node: ast.AstNode):
-    if name in scope.names:
-        emit_info(scope.names[name].loc,
-                  f"previous definition of `{name}` was here")
-        emit_error(name_loc, f"name `{name}` already defined")
-
-    scope.names[name] = node
-
-
-def declare_item(item: ast.Item, scope: Scope):
-    if isinstance(item, ast.ModItem):
-        declare(scope, item.name.spelling(), item.name.loc, item)
+from src.symbols import symbols
+
+
+# Resolve all names in a subtree and set the bindings of identifiers to the
+# nodes they refer to. Names that cannot be resolved are reported and their
+# bindings left unset. Returns the number of such names.
+def resolve_names(root: ast.AstNode) -> int:
+    scopes = Scopes()
+    resolve_node(root, scopes)
+    return scopes.num_unresolved
+
+
+# Nodes that declare a name in the enclosing scope, and nodes that refer to a
+# name.
+DECLARING_NODES = (ast.LetStmt, ast.TypeVarStmt, ast.ModTypeVar, ast.ModArg)
+REFERENCING_NODES = (ast.IdentExpr, ast.DomainIdent)
+
+# Actions deferred until the children of a node have been processed.
+DECLARE = 0  # declare the node's name
+LEAVE = 1  # leave the scope opened by the node
+
+
+# Resolve the names in a subtree in a single pass. Uses an explicit stack
+# instead of recursion, such that arbitrarily deep trees can be processed. The
+# stack holds nodes yet to be visited, and deferred actions as `(action, node)`
+# pairs. References are resolved when visited, declarations take effect after
+# all children of the declaring node have been processed, and scopes are left
+# once all of their contents have been processed, which restores the names they
+# shadowed.
+def resolve_node(node: ast.AstNode, scopes: Scopes):
+    stack: List[Union[ast.AstNode, Tuple[int, ast.AstNode]]] = [node]
+    while stack:
+        entry = stack.pop()
+        if isinstance(entry, tuple):
+            action, node = entry
+            if action == DECLARE:
+                scopes.declare(node.name, node)  # type: ignore
+            else:
+                scopes.leave()
+            continue
+
+        node = entry
+        if isinstance(node, REFERENCING_NODES):
+            node.binding.node = scopes.resolve(node.name)
+            continue
+        if isinstance(node, DECLARING_NODES):
+            stack.append((DECLARE, node))
+        elif isinstance(node, ast.Root):
+            scopes.enter()
+            stack.append((LEAVE, node))
+            for item in node.items:
+                if isinstance(item, ast.ModItem):
+                    scopes.declare(item.name, item)
+        elif isinstance(node, ast.ModItem):
+            scopes.enter()
+            stack.append((LEAVE, node))
+        stack.extend(reversed(list(node.children())))
+
+
+# The names visible at the current point of resolution. Rather than a chain of
+# scopes that is searched outwards, all scopes share one table that maps each
+# symbol to its innermost declaration and the depth of the scope declaring it.
+# A lookup is therefore a single dictionary access regardless of nesting.
+# Every declaration is recorded in an undo log, together with the declaration
+# it shadows, such that leaving a scope can restore the outer declarations.
+class Scopes:
+    table: Dict[int, Tuple[ast.AstNode, int]]
+    undo: List[Tuple[int, Optional[Tuple[ast.AstNode, int]]]]
+    marks: List[int]
+    num_unresolved: int
+
+    def __init__(self):
+        self.table = {}
+        self.undo = []
+        self.marks = []
+        self.num_unresolved = 0
+
+    def enter(self):
+        self.marks.append(len(self.undo))
+
+    def leave(self):
+        mark = self.marks.pop()
+        while len(self.undo) > mark:
+            symbol, shadowed = self.undo.pop()
+            if shadowed is None:
+                del self.table[symbol]
+            else:
+                self.table[symbol] = shadowed
+
+    def declare(self, name: Token, node: ast.AstNode):
+        symbol = name.buffer.symbols[name.index]
+        depth = len(self.marks)
+        shadowed = self.table.get(symbol)
+        if shadowed is not None and shadowed[1] == depth:
+            # The note comes first, such that it is printed even if the error
+            # reaches the error limit.
+            spelling = symbols.name(symbol)
+            emit_info(shadowed[0].loc,
+                      f"previous definition of `{spelling}` was here")
+            report_error(name.loc, f"name `{spelling}` already defined")
+            return
+        self.undo.append((symbol, shadowed))
+        self.table[symbol] = (node, depth)
+
+    def resolve(self, name: Token) -> Optional[ast.AstNode]:
+        entry = self.table.get(name.buffer.symbols[name.index])
+        if entry is not None:
+            return entry[0]
+        report_error(name.loc, f"unknown name `{name.spelling()}`")
+        self.num_unresolved += 1
+        return None
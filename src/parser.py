@@ -1,5 +1,5 @@
 from __future__ import annotations
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from src import ast
 from src.diagnostics import *
 from src.source import *
@@ -7,27 +7,64 @@ from src.lexer import Token, TokenKind
 from typing import *
 
 
-def parse(tokens: List[Token]) -> ast.Root:
-    p = Parser(tokens=tokens, last_loc=tokens[0].loc)
+def parse(tokens: Iterable[Token]) -> ast.Root:
+    p = Parser(tokens=iter(tokens))
     return parse_root(p)
 
 
+# Raised after a syntax error has been reported, to unwind the parser to the
+# nearest item or statement boundary where parsing can resume.
+class ParseError(Exception):
+    pass
+
+
+# Maximum number of tokens the parser can look ahead, i.e. `peek(k)` requires
+# `k < LOOKAHEAD`.
+LOOKAHEAD = 4
+
+
+# A cursor into a stream of tokens. Tokens are pulled from the underlying
+# iterator on demand and kept in a ring buffer of `LOOKAHEAD` entries, such
+# that the full token list never has to exist in memory. `pos` is the index
+# of the current token in the stream and `end` the number of tokens pulled
+# from the iterator so far.
 @dataclass
 class Parser:
-    tokens: List[Token]
-    last_loc: Loc
+    tokens: Iterator[Token]
+    pos: int = 0
+    end: int = 0
+    ring: List[Token] = field(default_factory=list)
+    last_loc: Loc = field(init=False)
+
+    def __post_init__(self):
+        self.last_loc = self.loc()
+
+    def peek(self, k: int = 0) -> Token:
+        assert k < LOOKAHEAD, f"lookahead of {k} tokens exceeds {LOOKAHEAD}"
+        while self.end <= self.pos + k:
+            # The token stream ends with an EOF token, which is repeated
+            # indefinitely if the parser looks past the end.
+            token = next(self.tokens, None)
+            if token is None:
+                token = self.ring[(self.end - 1) % LOOKAHEAD]
+            if len(self.ring) < LOOKAHEAD:
+                self.ring.append(token)
+            else:
+                self.ring[self.end % LOOKAHEAD] = token
+            self.end += 1
+        return self.ring[(self.pos + k) % LOOKAHEAD]
 
     def loc(self) -> Loc:
-        return self.tokens[0].loc
+        return self.peek().loc
 
     def consume(self) -> Token:
-        t = self.tokens[0]
-        self.tokens = self.tokens[1:]
+        t = self.peek()
+        self.pos += 1
         self.last_loc = t.loc
         return t
 
     def consume_if(self, kind: TokenKind) -> Optional[Token]:
-        if self.tokens[0].kind == kind:
+        if self.peek().kind == kind:
             return self.consume()
         return None
 
@@ -35,22 +72,41 @@ class Parser:
         if token := self.consume_if(kind):
             return token
         msg = msg or kind.name
-        emit_error(self.loc(),
-                   f"expected {msg}, found {self.tokens[0].kind.name}")
+        self.error(self.loc(),
+                   f"expected {msg}, found {self.peek().kind.name}")
 
-    def isa(self, kind: TokenKind) -> bool:
-        return self.tokens[0].kind == kind
+    def error(self, loc: Loc, msg: str) -> NoReturn:
+        report_error(loc, msg)
+        raise ParseError()
+
+    def isa(self, kind: TokenKind, k: int = 0) -> bool:
+        return self.peek(k).kind == kind
 
     def not_delim(self, *args: TokenKind) -> bool:
-        return self.tokens[0].kind not in (TokenKind.EOF, *args)
+        return self.peek().kind not in (TokenKind.EOF, *args)
 
 
 def parse_root(p: Parser) -> ast.Root:
     loc = p.loc()
+    items = parse_items(p)
+    return ast.Root(loc=loc | p.last_loc, items=items)
+
+
+# Parse items until the end of the input, or until `stop` returns true for the
+# position of the parser between two items.
+def parse_items(
+        p: Parser,
+        stop: Optional[Callable[[int], bool]] = None) -> List[ast.Item]:
     items: List[ast.Item] = []
     while not p.isa(TokenKind.EOF):
-        items.append(parse_item(p))
-    return ast.Root(loc=loc | p.last_loc, items=items)
+        start = p.pos
+        if stop is not None and stop(start):
+            break
+        try:
+            items.append(parse_item(p))
+        except ParseError:
+            skip_item(p, start)
+    return items
 
 
 def parse_item(p: Parser) -> ast.Item:
@@ -105,7 +161,10 @@ def parse_item(p: Parser) -> ast.Item:
         p.require(TokenKind.LCURLY)
         stmts: List[ast.Stmt] = []
         while p.not_delim(TokenKind.RCURLY):
-            stmts.append(parse_stmt(p))
+            try:
+                stmts.append(parse_stmt(p))
+            except ParseError:
+                skip_stmt(p)
         p.require(TokenKind.RCURLY)
 
         return ast.ModItem(
@@ -118,7 +177,57 @@ def parse_item(p: Parser) -> ast.Item:
             stmts=stmts,
         )
 
-    emit_error(p.loc(), f"expected item, found {p.tokens[0].kind.name}")
+    # Parse imports.
+    if kw := p.consume_if(TokenKind.KW_USE):
+        name = p.require(TokenKind.IDENT, "file name")
+        p.require(TokenKind.SEMICOLON)
+        return ast.UseItem(loc=name.loc,
+                           full_loc=kw.loc | p.last_loc,
+                           name=name)
+
+    p.error(p.loc(), f"expected item, found {p.peek().kind.name}")
+
+
+# Skip the remainder of an item after a syntax error. Stops after a `;` or
+# before the keyword that starts the next item, ignoring anything nested in
+# braces. `start` is the position where the item began; at least one token is
+# skipped such that parsing makes progress.
+def skip_item(p: Parser, start: int):
+    if p.pos == start and not p.isa(TokenKind.EOF):
+        p.consume()
+    depth = 0
+    while not p.isa(TokenKind.EOF):
+        if depth == 0 and p.peek().kind in ITEM_KEYWORDS:
+            return
+        token = p.consume()
+        if token.kind == TokenKind.LCURLY:
+            depth += 1
+        elif token.kind == TokenKind.RCURLY:
+            depth = max(depth - 1, 0)
+        elif token.kind == TokenKind.SEMICOLON and depth == 0:
+            return
+
+
+# Keywords that start an item.
+ITEM_KEYWORDS = (TokenKind.KW_MOD, TokenKind.KW_DOMAIN, TokenKind.KW_USE)
+
+
+# Skip the remainder of a statement after a syntax error. Stops after the `;`
+# that terminates the statement, or before the `}` that closes the enclosing
+# module body.
+def skip_stmt(p: Parser):
+    depth = 0
+    while not p.isa(TokenKind.EOF):
+        if p.isa(TokenKind.RCURLY):
+            if depth == 0:
+                return
+            depth -= 1
+        elif p.isa(TokenKind.LCURLY):
+            depth += 1
+        elif p.isa(TokenKind.SEMICOLON) and depth == 0:
+            p.consume()
+            return
+        p.consume()
 
 
 def parse_stmt(p: Parser) -> ast.Stmt:
@@ -179,7 +288,7 @@ def parse_type(p: Parser) -> ast.Type:
 
 def parse_primary_type(p: Parser) -> ast.Type:
     if p.isa(TokenKind.IDENT):
-        token = p.tokens[0]
+        token = p.peek()
         if token.spelling() == "u32":
             p.consume()
             return ast.U32Type(loc=token.loc, domain=None)
@@ -195,29 +304,118 @@ def parse_primary_type(p: Parser) -> ast.Type:
                                  clock_domain=domain,
                                  domain=None)
 
-    emit_error(p.loc(), f"expected type, found {p.tokens[0].kind.name}")
+    p.error(p.loc(), f"expected type, found {p.peek().kind.name}")
+
+
+# The binding power of each binary operator. Operators with a higher binding
+# power bind more tightly; all operators are left-associative.
+BINARY_OPERATORS: Dict[TokenKind, int] = {
+    TokenKind.STAR: 7,
+    TokenKind.PLUS: 6,
+    TokenKind.MINUS: 6,
+    TokenKind.AMP: 5,
+    TokenKind.CARET: 4,
+    TokenKind.PIPE: 3,
+    TokenKind.EQ: 2,
+    TokenKind.NE: 2,
+    TokenKind.LT: 2,
+    TokenKind.GT: 2,
+    TokenKind.LE: 2,
+    TokenKind.GE: 2,
+}
+
+
+# A parenthesized expression or the arguments of a call, still being parsed by
+# `parse_expr`. `ident` is the callee of a call, or None for parentheses.
+@dataclass
+class OpenGroup:
+    ident: Optional[ast.IdentExpr]
+    args: List[ast.Expr] = field(default_factory=list)
+
+
+# Parse an expression. This is a Pratt parser that keeps everything still in
+# progress on an explicit stack instead of recursing: operators whose
+# right-hand side is being parsed, and parentheses and calls whose contents
+# are being parsed. Arbitrarily long operator chains and deeply nested
+# expressions can therefore be parsed. Before an operator is pushed, all
+# operators on the stack up to the innermost open group that bind at least as
+# tightly are applied to their operands.
+def parse_expr(p: Parser) -> ast.Expr:
+    stack: List[Union[Tuple[ast.Expr, Token, int], OpenGroup]] = []
+    while True:
+        expr = parse_primary_expr(p)
+
+        # Open a parenthesis or call and parse the expression within it.
+        if isinstance(expr, OpenGroup):
+            if expr.ident is None or p.not_delim(TokenKind.RPAREN):
+                stack.append(expr)
+                continue
+            expr = close_call(p, expr)
+
+        while True:
+            # Parse field accesses.
+            while p.consume_if(TokenKind.DOT):
+                name = p.require(TokenKind.IDENT, "field name")
+                expr = ast.FieldExpr(loc=expr.loc | name.loc,
+                                     base=expr,
+                                     name=name)
+
+            op = p.peek()
+            power = BINARY_OPERATORS.get(op.kind, 0)
+            while stack and isinstance(top := stack[-1],
+                                       tuple) and top[2] >= power:
+                stack.pop()
+                lhs, lhs_op, _ = top
+                expr = ast.BinaryExpr(loc=lhs.loc | expr.loc,
+                                      op=lhs_op,
+                                      lhs=lhs,
+                                      rhs=expr)
+            if power > 0:
+                p.consume()
+                stack.append((expr, op, power))
+                break
+            if not stack:
+                return expr
+
+            # The expression is complete within the innermost open group.
+            # Close a parenthesis. For a call, parse the next argument, or
+            # close the call.
+            group = stack[-1]
+            assert isinstance(group, OpenGroup)
+            if group.ident is None:
+                p.require(TokenKind.RPAREN)
+                stack.pop()
+                continue
+            group.args.append(expr)
+            if p.consume_if(TokenKind.COMMA) and p.not_delim(TokenKind.RPAREN):
+                break
+            stack.pop()
+            expr = close_call(p, group)
 
 
-def parse_expr(p: Parser) -> ast.Expr:
-    return parse_primary_expr(p)
+# Parse the closing parenthesis of a call.
+def close_call(p: Parser, call: OpenGroup) -> ast.CallExpr:
+    assert call.ident is not None
+    p.require(TokenKind.RPAREN)
+    return ast.CallExpr(loc=call.ident.loc | p.last_loc,
+                        ident=call.ident,
+                        args=call.args)
+
 
+# Parse an identifier, or the opening parenthesis of a parenthesized expression
+# or call. The contents of the parentheses are left to `parse_expr`.
+def parse_primary_expr(p: Parser) -> Union[ast.Expr, OpenGroup]:
+    # Parse parenthesized expressions.
+    if p.consume_if(TokenKind.LPAREN):
+        return OpenGroup(ident=None)
 
-def parse_primary_expr(p: Parser) -> ast.Expr:
     if token := p.consume_if(TokenKind.IDENT):
         ident = ast.IdentExpr(loc=token.loc, name=token, binding=ast.Binding())
 
         # Parse calls.
         if p.consume_if(TokenKind.LPAREN):
-            args: List[ast.Expr] = []
-            while p.not_delim(TokenKind.RPAREN):
-                args.append(parse_expr(p))
-                if not p.consume_if(TokenKind.COMMA):
-                    break
-            p.require(TokenKind.RPAREN)
-            return ast.CallExpr(loc=ident.loc | p.last_loc,
-                                ident=ident,
-                                args=args)
+            return OpenGroup(ident=ident)
 
         return ident
 
-    emit_error(p.loc(), f"expected expression, found {p.tokens[0].kind.name}")
+    p.error(p.loc(), f"expected expression, found {p.peek().kind.name}")
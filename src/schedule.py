@@ -0,0 +1,112 @@
+from __future__ import annotations
+from src import ast
+from typing import *
+
+
+# Collect the modules in a subtree, in source order.
+def collect_modules(root: ast.AstNode) -> List[ast.ModItem]:
+    modules: List[ast.ModItem] = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, ast.ModItem):
+            modules.append(node)
+        else:
+            stack.extend(reversed(list(node.children())))
+    return modules
+
+
+# Build the call graph of a list of modules. Entry `i` lists the indices of the
+# modules called by module `i`, without duplicates. Requires resolved names.
+def call_graph(modules: List[ast.ModItem]) -> List[List[int]]:
+    index_of = {id(mod): i for i, mod in enumerate(modules)}
+    graph: List[List[int]] = []
+    for mod in modules:
+        callees: Dict[int, None] = {}
+        for node in mod.walk(ast.WalkOrder.PreOrder):
+            if isinstance(node, ast.CallExpr):
+                callee = node.ident.binding.node
+                if callee is not None and id(callee) in index_of:
+                    callees[index_of[id(callee)]] = None
+        graph.append(list(callees))
+    return graph
+
+
+# Compute the strongly connected components of a graph using an iterative
+# version of Tarjan's algorithm. The components are returned in reverse
+# topological order, i.e. every component comes after all components it has
+# edges to. In a call graph this lists callees before their callers.
+def strongly_connected_components(graph: List[List[int]]) -> List[List[int]]:
+    index = [-1] * len(graph)
+    lowlink = [0] * len(graph)
+    on_stack = [False] * len(graph)
+    stack: List[int] = []
+    components: List[List[int]] = []
+    counter = 0
+
+    for start in range(len(graph)):
+        if index[start] >= 0:
+            continue
+
+        # Each work entry is a node and the position of the next edge to
+        # visit, which replaces the recursive call of the textbook version.
+        work: List[Tuple[int, int]] = [(start, 0)]
+        while work:
+            node, edge = work.pop()
+            if edge == 0:
+                index[node] = lowlink[node] = counter
+                counter += 1
+                stack.append(node)
+                on_stack[node] = True
+
+            edges = graph[node]
+            while edge < len(edges):
+                succ = edges[edge]
+                edge += 1
+                if index[succ] < 0:
+                    work.append((node, edge))
+                    work.append((succ, 0))
+                    break
+                if on_stack[succ]:
+                    lowlink[node] = min(lowlink[node], index[succ])
+            else:
+                # All edges visited. Pop the component if this node is its
+                # root, and propagate the lowlink to the parent.
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = False
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(sorted(component))
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+
+    return components
+
+
+# Group the components into batches of roughly `batch_size` modules, keeping
+# each component in one batch and the batches in component order.
+def batch_components(components: List[List[int]],
+                     batch_size: int) -> List[List[int]]:
+    batches: List[List[int]] = []
+    current: List[int] = []
+    for component in components:
+        current += component
+        if len(current) >= batch_size:
+            batches.append(current)
+            current = []
+    if current:
+        batches.append(current)
+    return batches
+
+
+__all__ = [
+    "collect_modules",
+    "call_graph",
+    "strongly_connected_components",
+    "batch_components",
+]
@@ -0,0 +1,554 @@
+from __future__ import annotations
+from array import array
+from src import ast
+from src.lexer import Token, TokenBuffer
+from src.source import *
+from src.symbols import symbols
+from typing import *
+import struct
+import sys
+
+# A compact binary encoding of ASTs. A stream consists of records, followed by
+# an index of the records and the offset of that index:
+#
+#     magic version
+#     record*          -- files and items, each file before its items
+#     index            -- offsets of all records, and the root location
+#     u64 index_offset
+#
+# A file record holds the path, optionally the contents, and the token columns
+# of a source file. The root location refers to a file record as well, which
+# has no tokens if the file has no items. An item record holds the nodes of one
+# top-level item in pre-order, each as a tag identifying its class, followed by
+# its locations, tokens, and bindings, the number of nodes in each of its child
+# fields, and then its children. Locations are varint-encoded offsets and
+# lengths into the item's file, and tokens are varint-encoded indices into the
+# file's tokens.
+#
+# Bindings are encoded as node indices rather than pointers: `2 * i + 1` refers
+# to the i-th node of the same item in pre-order, `2 * i + 2` to the i-th item
+# itself, and 0 marks an unset binding. Items can therefore be decoded on
+# their own, which allows loading a single module from a large design.
+
+MAGIC = b"DOTYAST"
+VERSION = 3
+
+# Every node class, identified by its position in this list plus one. Tag 0
+# marks an absent optional child.
+NODE_CLASSES: List[type] = [
+    cls for cls in vars(ast).values() if isinstance(cls, type)
+    and issubclass(cls, ast.AstNode) and cls.field_names
+]
+NODE_TAGS: Dict[type, int] = {cls: i + 1 for i, cls in enumerate(NODE_CLASSES)}
+
+# How the fields of a node are encoded, other than its children.
+FIELD_LOC = 0
+FIELD_TOKEN = 1
+FIELD_BINDING = 2
+
+
+def classify_scalar_fields(cls: type) -> Tuple[Tuple[str, int], ...]:
+    children = {name for name, _ in cls.child_fields}  # type: ignore
+    hints = get_type_hints(cls, vars(ast))
+    result = []
+    for name in cls.field_names:  # type: ignore
+        if name in children:
+            continue
+        hint = hints[name]
+        if hint is Loc:
+            result.append((name, FIELD_LOC))
+        elif hint is Token:
+            result.append((name, FIELD_TOKEN))
+        elif hint is ast.Binding:
+            result.append((name, FIELD_BINDING))
+        else:
+            raise TypeError(f"cannot serialize field {cls.__name__}.{name}")
+    return tuple(result)
+
+
+# The scalar fields of each node class, in declaration order.
+SCALAR_FIELDS: Dict[type, Tuple[Tuple[str, int], ...]] = {
+    cls: classify_scalar_fields(cls)
+    for cls in NODE_CLASSES
+}
+
+RECORD_FILE = 1
+RECORD_ITEM = 2
+
+#===------------------------------------------------------------------------===#
+# Varints
+#===------------------------------------------------------------------------===#
+
+
+def write_varint(out: bytearray, value: int):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    byte = data[pos]
+    if byte < 0x80:
+        return byte, pos + 1
+    value = byte & 0x7F
+    shift = 7
+    pos += 1
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def write_blob(out: bytearray, blob: bytes):
+    write_varint(out, len(blob))
+    out += blob
+
+
+def read_blob(data: bytes, pos: int) -> Tuple[bytes, int]:
+    length, pos = read_varint(data, pos)
+    return bytes(data[pos:pos + length]), pos + length
+
+
+# Token columns are stored in little-endian byte order.
+def array_to_bytes(values: array) -> bytes:
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def array_from_bytes(typecode: str, blob: bytes) -> array:
+    values = array(typecode)
+    values.frombytes(blob)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+#===------------------------------------------------------------------------===#
+# Writing
+#===------------------------------------------------------------------------===#
+
+
+# Writes the records of an AST to a binary stream as they are added. Files are
+# written on first use by an item. `close` writes the index.
+class AstWriter:
+    f: BinaryIO
+    include_source: bool
+    offset: int
+    file_ids: Dict[int, int]
+    source_file_ids: Dict[int, int]
+    file_offsets: List[int]
+    item_ids: Dict[int, int]
+    item_entries: List[Tuple[int, int, int, int]]
+
+    def __init__(self, f: BinaryIO, include_source: bool = True):
+        self.f = f
+        self.include_source = include_source
+        self.offset = 0
+        self.file_ids = {}
+        self.source_file_ids = {}
+        self.file_offsets = []
+        self.item_ids = {}
+        self.item_entries = []
+        self.write(MAGIC + bytes([VERSION]))
+
+    def write(self, data: Union[bytes, bytearray]):
+        self.f.write(data)
+        self.offset += len(data)
+
+    # Declare the items that will be written, in order, such that bindings to
+    # items that have not been written yet can be encoded.
+    def declare_items(self, items: List[ast.Item]):
+        for item in items:
+            self.item_ids.setdefault(id(item), len(self.item_ids))
+
+    def add_file(self, tokens: TokenBuffer) -> int:
+        if (index := self.file_ids.get(id(tokens))) is not None:
+            return index
+        out = bytearray([RECORD_FILE])
+        write_blob(out, tokens.file.path.encode())
+        if self.include_source:
+            out.append(1)
+            write_blob(out, bytes(tokens.file.contents))
+        else:
+            out.append(0)
+
+        # Symbol IDs are specific to this process, so store the names of the
+        # symbols used by the file and number them locally.
+        local: Dict[int, int] = {0: 0}
+        for symbol in tokens.symbols:
+            if symbol not in local:
+                local[symbol] = len(local)
+        write_varint(out, len(local) - 1)
+        for symbol in list(local)[1:]:
+            write_blob(out, symbols.name(symbol).encode())
+        write_varint(out, len(tokens))
+        out += array_to_bytes(tokens.kinds)
+        # Offsets are stored in 32 bits unless the file is larger than 4 GiB.
+        wide = len(tokens.file.contents) >= 1 << 32
+        out.append(ord("Q" if wide else "I"))
+        out += array_to_bytes(array("Q" if wide else "I", tokens.offsets))
+        out += array_to_bytes(tokens.lengths)
+        out += array_to_bytes(
+            array("I", (local[symbol] for symbol in tokens.symbols)))
+
+        index = len(self.file_offsets)
+        self.file_ids[id(tokens)] = index
+        self.source_file_ids.setdefault(id(tokens.file), index)
+        self.file_offsets.append(self.offset)
+        self.write(out)
+        return index
+
+    def write_item(self, item: ast.Item):
+        tokens = item_tokens(item)
+        file_index = self.add_file(tokens)
+        self.item_ids.setdefault(id(item), len(self.item_ids))
+        item_id = self.item_ids[id(item)]
+        assert item_id == len(self.item_entries), "items written out of order"
+
+        # Number the nodes of the item in pre-order, which is the order they
+        # are written in, such that bindings can refer to later nodes.
+        local_ids = {
+            id(node): i
+            for i, node in enumerate(item.walk(ast.WalkOrder.PreOrder))
+        }
+        out = bytearray([RECORD_ITEM])
+        write_varint(out, file_index)
+        stack: List[Optional[ast.AstNode]] = [item]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                out.append(0)
+                continue
+            cls = type(node)
+            out.append(NODE_TAGS[cls])
+            for name, kind in SCALAR_FIELDS[cls]:
+                value = getattr(node, name)
+                if kind == FIELD_LOC:
+                    write_varint(out, value.offset)
+                    write_varint(out, value.length)
+                elif kind == FIELD_TOKEN:
+                    assert value.buffer is tokens, "token from another file"
+                    write_varint(out, value.index)
+                else:
+                    write_varint(out, self.encode_binding(value, local_ids))
+            children: List[Optional[ast.AstNode]] = []
+            for name, is_list in cls.child_fields:  # type: ignore
+                value = getattr(node, name)
+                if is_list:
+                    write_varint(out, len(value))
+                    children += value
+                else:
+                    children.append(value)
+            stack.extend(reversed(children))
+
+        name_token = getattr(item, "name", None)
+        name_index = name_token.index + 1 if isinstance(name_token,
+                                                        Token) else 0
+        self.item_entries.append(
+            (file_index, self.offset, len(out), name_index))
+        self.write(out)
+
+    def encode_binding(self, binding: ast.Binding,
+                       local_ids: Dict[int, int]) -> int:
+        target = binding.node
+        if target is None:
+            return 0
+        if (index := local_ids.get(id(target))) is not None:
+            return 2 * index + 1
+        if (index := self.item_ids.get(id(target))) is not None:
+            return 2 * index + 2
+        raise ValueError(
+            f"binding to {target.__class__.__name__} outside of its item")
+
+    # Write the index. `root_loc` is the location of the root node. Its file is
+    # written without tokens unless an item has written it already.
+    def close(self, root_loc: Loc):
+        root_file = self.source_file_ids.get(id(root_loc.file))
+        if root_file is None:
+            root_file = self.add_file(TokenBuffer(root_loc.file))
+        out = bytearray()
+        write_varint(out, len(self.file_offsets))
+        for offset in self.file_offsets:
+            write_varint(out, offset)
+        write_varint(out, len(self.item_entries))
+        for file_index, offset, length, name in self.item_entries:
+            write_varint(out, file_index)
+            write_varint(out, offset)
+            write_varint(out, length)
+            write_varint(out, name)
+        write_varint(out, root_file)
+        write_varint(out, root_loc.offset)
+        write_varint(out, root_loc.length)
+        index_offset = self.offset
+        self.write(out)
+        self.write(struct.pack("<Q", index_offset))
+
+
+# The token buffer that the tokens of an item refer to.
+def item_tokens(item: ast.Item) -> TokenBuffer:
+    name = getattr(item, "name", None)
+    if not isinstance(name, Token):
+        raise ValueError(f"cannot serialize {item.__class__.__name__}")
+    return name.buffer
+
+
+# Serialize an AST to a binary stream.
+def write_ast(root: ast.Root, f: BinaryIO, include_source: bool = True):
+    writer = AstWriter(f, include_source)
+    writer.declare_items(root.items)
+    for item in root.items:
+        writer.write_item(item)
+    writer.close(root.loc)
+
+
+def serialize_ast(root: ast.Root, include_source: bool = True) -> bytes:
+    import io
+    f = io.BytesIO()
+    write_ast(root, f, include_source)
+    return f.getvalue()
+
+
+#===------------------------------------------------------------------------===#
+# Reading
+#===------------------------------------------------------------------------===#
+
+
+# Error raised for malformed input.
+class SerializeError(Exception):
+    pass
+
+
+# Reads an AST from its binary encoding. Only the index is read up front;
+# files and items are decoded on first use. Files whose contents were not
+# stored are looked up in `files` by path, or read from disk.
+class AstReader:
+    data: bytes
+    files: Dict[str, SourceFile]
+    file_offsets: List[int]
+    item_entries: List[Tuple[int, int, int, int]]
+    root_loc: Tuple[int, int, int]
+    token_buffers: Dict[int, TokenBuffer]
+    items: Dict[int, ast.Item]
+
+    def __init__(self,
+                 data: bytes,
+                 files: Optional[Dict[str, SourceFile]] = None):
+        if data[:len(MAGIC)] != MAGIC:
+            raise SerializeError("not a serialized AST")
+        if data[len(MAGIC)] != VERSION:
+            raise SerializeError(
+                f"unsupported serialized AST version {data[len(MAGIC)]}")
+        self.data = data
+        self.files = dict(files or {})
+        self.token_buffers = {}
+        self.items = {}
+
+        pos = struct.unpack_from("<Q", data, len(data) - 8)[0]
+        num_files, pos = read_varint(data, pos)
+        self.file_offsets = []
+        for _ in range(num_files):
+            offset, pos = read_varint(data, pos)
+            self.file_offsets.append(offset)
+        num_items, pos = read_varint(data, pos)
+        self.item_entries = []
+        for _ in range(num_items):
+            file_index, pos = read_varint(data, pos)
+            offset, pos = read_varint(data, pos)
+            length, pos = read_varint(data, pos)
+            name, pos = read_varint(data, pos)
+            self.item_entries.append((file_index, offset, length, name))
+        root_file, pos = read_varint(data, pos)
+        offset, pos = read_varint(data, pos)
+        length, pos = read_varint(data, pos)
+        self.root_loc = (root_file, offset, length)
+
+    def __len__(self) -> int:
+        return len(self.item_entries)
+
+    def tokens(self, file_index: int) -> TokenBuffer:
+        if (tokens := self.token_buffers.get(file_index)) is not None:
+            return tokens
+        data = self.data
+        pos = self.file_offsets[file_index]
+        if data[pos] != RECORD_FILE:
+            raise SerializeError("expected file record")
+        path_bytes, pos = read_blob(data, pos + 1)
+        path = path_bytes.decode()
+        if data[pos]:
+            contents, pos = read_blob(data, pos + 1)
+            file = SourceFile(path, contents)
+        else:
+            pos += 1
+            if (cached := self.files.get(path)) is not None:
+                file = cached
+            else:
+                with open(path, "rb") as f:
+                    file = SourceFile(path, f.read())
+        self.files[path] = file
+
+        num_symbols, pos = read_varint(data, pos)
+        remap = array("I", [0])
+        for _ in range(num_symbols):
+            name, pos = read_blob(data, pos)
+            remap.append(symbols.intern(name))
+        count, pos = read_varint(data, pos)
+        tokens = TokenBuffer(file)
+        columns: List[array] = []
+        for typecode in ("B", "O", "I", "I"):
+            if typecode == "O":
+                typecode = chr(data[pos])
+                pos += 1
+            size = count * array(typecode).itemsize
+            columns.append(array_from_bytes(typecode, data[pos:pos + size]))
+            pos += size
+        tokens.kinds, offsets, tokens.lengths, tokens.symbols = columns
+        tokens.offsets = array("Q", offsets)
+        tokens.symbols = array("I", map(remap.__getitem__, tokens.symbols))
+        self.token_buffers[file_index] = tokens
+        return tokens
+
+    # Decode the item at an index. Items referred to by bindings are decoded
+    # as well, on demand. They are decoded one after another from a worklist
+    # instead of recursively, such that arbitrarily long chains of items that
+    # refer to each other can be decoded. Bindings to other items are set once
+    # all of them have been decoded.
+    def item(self, index: int) -> ast.Item:
+        if (item := self.items.get(index)) is not None:
+            return item
+        pending = [index]
+        links: List[Tuple[ast.Binding, int]] = []
+        while pending:
+            next_index = pending.pop()
+            if next_index not in self.items:
+                self.decode_item(next_index, pending, links)
+        for binding, target in links:
+            binding.node = self.items[target]
+        return self.items[index]
+
+    # Decode the item at an index. Bindings to other items are added to `links`
+    # along with the index of the target item, and items that have not been
+    # decoded yet are added to `pending`.
+    def decode_item(self, index: int, pending: List[int],
+                    links: List[Tuple[ast.Binding, int]]):
+        data = self.data
+        file_index, pos, _, _ = self.item_entries[index]
+        if data[pos] != RECORD_ITEM:
+            raise SerializeError("expected item record")
+        _, pos = read_varint(data, pos + 1)
+        tokens = self.tokens(file_index)
+        file = tokens.file
+
+        nodes: List[ast.AstNode] = []
+        fixups: List[Tuple[ast.Binding, int]] = []
+        result: List[ast.AstNode] = []
+        # Each slot is the node and field the next decoded node is stored in,
+        # and whether the field is a list. The first slot receives the item.
+        slots: List[Tuple[Any, str, bool]] = [(result, "", True)]
+        while slots:
+            parent, field_name, is_list = slots.pop()
+            tag = data[pos]
+            pos += 1
+            if tag == 0:
+                setattr(parent, field_name, None)
+                continue
+            cls = NODE_CLASSES[tag - 1]
+            node: ast.AstNode = object.__new__(cls)
+            nodes.append(node)
+            for name, kind in SCALAR_FIELDS[cls]:
+                if kind == FIELD_LOC:
+                    offset, pos = read_varint(data, pos)
+                    length = data[pos]
+                    if length < 0x80:
+                        pos += 1
+                    else:
+                        length, pos = read_varint(data, pos)
+                    setattr(node, name, Loc(file, offset, length))
+                elif kind == FIELD_TOKEN:
+                    token_index, pos = read_varint(data, pos)
+                    setattr(node, name, Token(tokens, token_index))
+                else:
+                    value, pos = read_varint(data, pos)
+                    binding = ast.Binding()
+                    setattr(node, name, binding)
+                    if value:
+                        fixups.append((binding, value))
+            if child_fields := cls.child_fields:  # type: ignore
+                child_slots: List[Tuple[Any, str, bool]] = []
+                for name, holds_list in child_fields:
+                    if holds_list:
+                        count = data[pos]
+                        if count < 0x80:
+                            pos += 1
+                        else:
+                            count, pos = read_varint(data, pos)
+                        setattr(node, name, [])
+                        child_slots += [(node, name, True)] * count
+                    else:
+                        child_slots.append((node, name, False))
+                child_slots.reverse()
+                slots += child_slots
+
+            if parent is result:
+                result.append(node)
+            elif is_list:
+                getattr(parent, field_name).append(node)
+            else:
+                setattr(parent, field_name, node)
+
+        decoded = result[0]
+        assert isinstance(decoded, ast.Item)
+        self.items[index] = decoded
+        for binding, value in fixups:
+            if value & 1:
+                binding.node = nodes[value >> 1]
+            else:
+                target = (value >> 1) - 1
+                links.append((binding, target))
+                if target not in self.items:
+                    pending.append(target)
+
+    # The name of the item at an index, without decoding the item.
+    def item_name(self, index: int) -> Optional[str]:
+        file_index, _, _, name = self.item_entries[index]
+        if not name:
+            return None
+        return self.tokens(file_index).spelling(name - 1)
+
+    # Decode the module with the given name, or return None if there is none.
+    # Only the module and the modules it refers to are decoded.
+    def module(self, name: str) -> Optional[ast.ModItem]:
+        for index in range(len(self)):
+            if self.item_name(index) != name:
+                continue
+            item = self.item(index)
+            if isinstance(item, ast.ModItem):
+                return item
+        return None
+
+    # Decode all items into a root node.
+    def root(self) -> ast.Root:
+        items = [self.item(index) for index in range(len(self))]
+        file_index, offset, length = self.root_loc
+        loc = Loc(self.tokens(file_index).file, offset, length)
+        return ast.Root(loc=loc, items=items)
+
+
+def deserialize_ast(data: bytes,
+                    files: Optional[Dict[str, SourceFile]] = None) -> ast.Root:
+    return AstReader(data, files).root()
+
+
+__all__ = [
+    "AstWriter",
+    "AstReader",
+    "SerializeError",
+    "write_ast",
+    "serialize_ast",
+    "deserialize_ast",
+]
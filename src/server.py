@@ -0,0 +1,135 @@
+from __future__ import annotations
+from src import driver
+from src.client import *
+from src.diagnostics import *
+from src.stats import statistics
+from src.tracing import reset_tracing
+from typing import *
+import base64
+import io
+import json
+import os
+import socket
+import struct
+import sys
+import traceback
+
+
+# A text stream that forwards everything written to it to the client as frames
+# of the given kind.
+class FrameWriter(io.TextIOBase):
+    f: io.BufferedIOBase
+    kind: int
+    tty: bool
+
+    def __init__(self, f: io.BufferedIOBase, kind: int, tty: bool):
+        self.f = f
+        self.kind = kind
+        self.tty = tty
+
+    def write(self, text: str) -> int:
+        if text:
+            write_frame(self.f, self.kind, text.encode())
+        return len(text)
+
+    def flush(self):
+        self.f.flush()
+
+    def isatty(self) -> bool:
+        return self.tty
+
+
+# Serve compilation requests on a Unix socket until interrupted. Requests are
+# handled one after the other in this process, such that the interpreter and
+# all modules stay loaded, and files are only parsed again once they change.
+# A socket left behind by a server that is gone is replaced, but the socket of a
+# running server is not.
+def serve(path: str):
+    driver.parse_cache = driver.ParseCache()
+    if os.path.exists(path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except ConnectionRefusedError:
+            os.unlink(path)
+        except OSError:
+            pass  # not a socket; binding reports the error
+        else:
+            print(f"error: a compile server is already serving on {path}",
+                  file=sys.stderr)
+            sys.exit(1)
+        finally:
+            probe.close()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    sock.listen()
+    print(f"doty: serving on {path}", file=sys.stderr)
+    try:
+        while True:
+            conn, _ = sock.accept()
+            with conn, conn.makefile("rwb") as f:
+                try:
+                    handle_request(f)
+                except OSError:
+                    pass  # client went away
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sock.close()
+        os.unlink(path)
+
+
+# Run one compilation with the client's command line, working directory,
+# environment, and files, and send back its output and exit code.
+def handle_request(f: io.BufferedIOBase):
+    frame = read_frame(f)
+    if frame is None:
+        return
+    request = json.loads(frame[1])
+
+    from src.main import main
+    saved_cwd = os.getcwd()
+    saved_env = dict(os.environ)
+    saved_stdout, saved_stderr = sys.stdout, sys.stderr
+    color = request["color"]
+    sys.stdout = FrameWriter(f, FRAME_STDOUT, color)
+    sys.stderr = FrameWriter(f, FRAME_STDERR, color)
+    # The client's environment replaces the server's own DOTY_* variables,
+    # such that e.g. the server's DOTY_TRACE does not apply to every client.
+    for key in [key for key in os.environ if key.startswith("DOTY_")]:
+        del os.environ[key]
+    os.environ.update(request["env"])
+    driver.source_overlay = {
+        path: base64.b64decode(contents)
+        for path, contents in request["files"].items()
+    }
+    diagnostics.reset()
+    statistics.reset()
+    diagnostics.color = color
+    reset_tracing()
+
+    code = 0
+    try:
+        os.chdir(request["cwd"])
+        main(request["argv"])
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else int(e.code is not None)
+    except Exception:
+        traceback.print_exc()
+        code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        reset_tracing()
+        sys.stdout, sys.stderr = saved_stdout, saved_stderr
+        os.environ.clear()
+        os.environ.update(saved_env)
+        os.chdir(saved_cwd)
+        driver.source_overlay = {}
+    write_frame(f, FRAME_EXIT, struct.pack("!i", code))
+    f.flush()
+
+
+__all__ = [
+    "serve",
+]
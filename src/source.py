@@ -1,16 +1,86 @@
 from __future__ import annotations
-from dataclasses import dataclass
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from mmap import mmap
+from typing import List, Optional, Tuple, Union
 
+# The raw bytes of a source file, either read into memory or memory-mapped.
+SourceBuffer = Union[bytes, mmap]
 
-# A source file and its contents.
+
+# A source file and its contents. The contents are kept as UTF-8 encoded bytes
+# and only the parts that are actually looked at are decoded.
 @dataclass
 class SourceFile:
     path: str
-    contents: str
+    contents: SourceBuffer
+    _line_starts: Optional[List[int]] = field(default=None,
+                                              init=False,
+                                              repr=False,
+                                              compare=False)
 
     def __repr__(self) -> str:
         return f"SourceFile(\"{self.path}\")"
 
+    # Pickle memory-mapped contents as bytes, such that files and the ASTs that
+    # refer to them can be sent to other processes.
+    def __reduce__(self):
+        return (SourceFile, (self.path, bytes(self.contents)))
+
+    # The offset of the first character of each line. Computed on first use.
+    def line_starts(self) -> List[int]:
+        if self._line_starts is None:
+            starts = [0]
+            find = self.contents.find
+            offset = find(b"\n")
+            while offset >= 0:
+                starts.append(offset + 1)
+                offset = find(b"\n", offset + 1)
+            self._line_starts = starts
+        return self._line_starts
+
+    # Replace `length` bytes at `offset` with `text`. The file is modified in
+    # place, such that locations before the edit remain valid. Line starts that
+    # have already been computed are updated rather than recomputed.
+    def edit(self, offset: int, length: int, text: bytes):
+        end = offset + length
+        self.contents = self.contents[:offset] + text + self.contents[end:]
+        starts = self._line_starts
+        if starts is None:
+            return
+        delta = len(text) - length
+        first = bisect_right(starts, offset)
+        last = bisect_right(starts, end, lo=first)
+        inserted = []
+        find = text.find
+        index = find(b"\n")
+        while index >= 0:
+            inserted.append(offset + index + 1)
+            index = find(b"\n", index + 1)
+        starts[first:] = inserted + [start + delta for start in starts[last:]]
+
+    # Decode the text between two byte offsets.
+    def text(self, start: int, end: int) -> str:
+        return self.contents[start:end].decode("utf-8", errors="replace")
+
+    # The 0-based index of the line that contains an offset.
+    def line_index(self, offset: int) -> int:
+        return bisect_right(self.line_starts(), offset) - 1
+
+    # The 1-based line and column numbers of an offset.
+    def line_and_column(self, offset: int) -> Tuple[int, int]:
+        index = self.line_index(offset)
+        return index + 1, offset - self.line_starts()[index] + 1
+
+    # The start and end offset of the line that contains an offset, excluding
+    # the trailing newline.
+    def line_range(self, offset: int) -> Tuple[int, int]:
+        starts = self.line_starts()
+        index = self.line_index(offset)
+        if index + 1 < len(starts):
+            return starts[index], starts[index + 1] - 1
+        return starts[index], len(self.contents)
+
 
 # A location within a source file, given as a span of bytes.
 @dataclass
@@ -23,13 +93,11 @@ class Loc:
         return f"\"{self.file.path}\"[{self.offset};{self.length}]"
 
     def __str__(self) -> str:
-        lines = self.file.contents[:self.offset].split("\n")
-        line_num = len(lines)
-        col_num = len(lines[-1]) + 1
+        line_num, col_num = self.file.line_and_column(self.offset)
         return f"{self.file.path}:{line_num}:{col_num}"
 
     def spelling(self) -> str:
-        return self.file.contents[self.offset:self.offset + self.length]
+        return self.file.text(self.offset, self.offset + self.length)
 
     def __or__(self, other: Loc) -> Loc:
         assert self.file == other.file, f"union of locations with different files ({self.file.path} and {other.file.path})"
@@ -39,6 +107,7 @@ class Loc:
 
 
 __all__ = [
+    "SourceBuffer",
     "SourceFile",
     "Loc",
 ]
@@ -0,0 +1,56 @@
+# Profiling of the compiler's startup time, for `--startup-profile`.
+import os
+import subprocess
+import sys
+from typing import List, NoReturn, Tuple
+
+# The number of imports listed in the report.
+STARTUP_PROFILE_ENTRIES = 25
+
+
+# Run the compiler again with `-X importtime` and the given arguments, pass its
+# output through, and report the imports that took longest, as measured by
+# their cumulative time including nested imports. Exits with the exit code of
+# the profiled run.
+def profile_startup(argv: List[str]) -> NoReturn:
+    script = os.path.abspath(sys.argv[0])
+    env = dict(os.environ)
+    env.pop("DOTY_SERVER", None)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", script, *argv],
+        stderr=subprocess.PIPE,
+        env=env,
+        text=True)
+
+    imports: List[Tuple[int, int, str]] = []
+    for line in result.stderr.splitlines(keepends=True):
+        if not line.startswith("import time:"):
+            sys.stderr.write(line)
+            continue
+        fields = line[len("import time:"):].split("|")
+        if not fields[0].strip().isdigit():
+            continue  # column headers
+        self_us, cumulative_us = int(fields[0]), int(fields[1])
+        imports.append((cumulative_us, self_us, fields[2].rstrip()))
+
+    # Top-level imports are not indented; their cumulative times add up to the
+    # total import time.
+    total_us = sum(cumulative for cumulative, _, name in imports
+                   if not name.startswith("  "))
+    report = sys.stderr
+    print(
+        f"startup: {len(imports)} modules imported in {total_us / 1000:.1f} ms",
+        file=report)
+    print(f"{'cumulative':>12} {'self':>10}  module", file=report)
+    for cumulative, self_us, name in sorted(
+            imports, reverse=True)[:STARTUP_PROFILE_ENTRIES]:
+        print(
+            f"{cumulative / 1000:>9.1f} ms {self_us / 1000:>7.1f} ms  "
+            f"{name.strip()}",
+            file=report)
+    sys.exit(result.returncode)
+
+
+__all__ = [
+    "profile_startup",
+]
@@ -0,0 +1,180 @@
+from __future__ import annotations
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from typing import *
+import os
+import sys
+import time
+
+
+# The cost of one compiler pass. The CPU time includes worker processes.
+# `max_rss` is the process's peak resident set size at the end of the pass in
+# bytes. `peak_traced` is the peak memory allocated by Python during the pass,
+# which is only tracked on request since tracing allocations slows compilation
+# down considerably.
+@dataclass
+class PassStats:
+    name: str
+    wall_time: float = 0.0
+    cpu_time: float = 0.0
+    max_rss: int = 0
+    peak_traced: Optional[int] = None
+
+
+# Collects the cost of each pass and counts of the things the compiler
+# processed, such as tokens or modules. Passes call `timed` and `count`
+# unconditionally; counts that need extra work to compute should be guarded
+# by `enabled`. Passes may be nested, e.g. lexing within parsing; the time of
+# the inner pass is then not counted towards the outer one.
+class Statistics:
+    enabled: bool
+    track_memory: bool
+    passes: List[PassStats]
+    counters: Dict[str, int]
+    # The wall and CPU time spent in the nested passes of each active pass.
+    nested: List[List[float]]
+
+    def __init__(self):
+        self.track_memory = False
+        self.reset()
+
+    # Stop collecting statistics and forget the ones collected so far, e.g.
+    # before the compile server starts the next compilation. Tracing
+    # allocations is stopped as well, since it would slow down every later
+    # compilation.
+    def reset(self):
+        if self.track_memory:
+            import tracemalloc
+            tracemalloc.stop()
+        self.enabled = False
+        self.track_memory = False
+        self.passes = []
+        self.counters = {}
+        self.nested = []
+
+    def enable(self, track_memory: bool = False):
+        self.enabled = True
+        self.track_memory = track_memory
+        if track_memory:
+            import tracemalloc
+            tracemalloc.start()
+
+    # Measure the time and memory spent in the body of a `with` statement.
+    # Repeated passes with the same name are accumulated.
+    @contextmanager
+    def timed(self, name: str) -> Iterator[None]:
+        if not self.enabled:
+            yield
+            return
+        if self.track_memory:
+            import tracemalloc
+            tracemalloc.reset_peak()
+        wall = time.perf_counter()
+        cpu = cpu_time()
+        self.nested.append([0.0, 0.0])
+        try:
+            yield
+        finally:
+            nested_wall, nested_cpu = self.nested.pop()
+            wall = time.perf_counter() - wall
+            cpu = cpu_time() - cpu
+            stats = self.get_pass(name)
+            stats.wall_time += wall - nested_wall
+            stats.cpu_time += cpu - nested_cpu
+            if self.nested:
+                self.nested[-1][0] += wall
+                self.nested[-1][1] += cpu
+            stats.max_rss = max_rss()
+            if self.track_memory:
+                import tracemalloc
+                peak = tracemalloc.get_traced_memory()[1]
+                stats.peak_traced = max(stats.peak_traced or 0, peak)
+
+    def get_pass(self, name: str) -> PassStats:
+        for stats in self.passes:
+            if stats.name == name:
+                return stats
+        stats = PassStats(name)
+        self.passes.append(stats)
+        return stats
+
+    def count(self, name: str, n: int = 1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    # Add the counters collected elsewhere, e.g. in a worker process.
+    def merge(self, counters: Dict[str, int]):
+        for name, n in counters.items():
+            self.count(name, n)
+
+    # Add the CPU time of passes run in a worker process. The worker's CPU time
+    # is already part of the active pass, once the worker has exited, so it is
+    # moved from that pass to the worker's passes. Their wall time overlaps
+    # with the active pass and is not counted.
+    def merge_passes(self, passes: List[PassStats]):
+        for worker_stats in passes:
+            self.get_pass(worker_stats.name).cpu_time += worker_stats.cpu_time
+            if self.nested:
+                self.nested[-1][1] += worker_stats.cpu_time
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "passes": [asdict(stats) for stats in self.passes],
+            "counters": dict(sorted(self.counters.items())),
+        }
+
+    # Format the statistics as a table, similar to LLVM's `-time-passes`.
+    def report(self) -> str:
+        lines = ["===--- pass execution timing report ---==="]
+        header = f"{'wall':>10} {'cpu':>10} {'max rss':>10}"
+        if self.track_memory:
+            header += f" {'peak mem':>10}"
+        lines.append(header + "  pass")
+        total_wall = sum(s.wall_time for s in self.passes)
+        total_cpu = sum(s.cpu_time for s in self.passes)
+        for s in self.passes:
+            line = (f"{s.wall_time:>9.4f}s {s.cpu_time:>9.4f}s "
+                    f"{format_bytes(s.max_rss):>10}")
+            if self.track_memory:
+                line += f" {format_bytes(s.peak_traced or 0):>10}"
+            lines.append(line + f"  {s.name}")
+        lines.append(f"{total_wall:>9.4f}s {total_cpu:>9.4f}s {'':>10}" +
+                     (f" {'':>10}" if self.track_memory else "") + "  total")
+        if self.counters:
+            lines.append("")
+            lines.append("===--- statistics ---===")
+            for name, n in sorted(self.counters.items()):
+                lines.append(f"{n:>12}  {name}")
+        return "\n".join(lines)
+
+
+# The CPU time used by the process and its finished worker processes.
+def cpu_time() -> float:
+    times = os.times()
+    return (times.user + times.system + times.children_user +
+            times.children_system)
+
+
+# The peak resident set size of the process in bytes.
+def max_rss() -> int:
+    try:
+        import resource
+    except ImportError:
+        return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in kilobytes elsewhere.
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def format_bytes(n: int) -> str:
+    return f"{n / (1024 * 1024):.1f} MB"
+
+
+# The statistics collected throughout the compiler.
+statistics = Statistics()
+
+__all__ = [
+    "PassStats",
+    "Statistics",
+    "statistics",
+]
@@ -0,0 +1,38 @@
+from __future__ import annotations
+from typing import Dict, List
+
+
+# Interned identifiers. Every distinct identifier is assigned a small integer ID
+# when it is lexed, such that later passes can compare and look up names by ID
+# instead of slicing and decoding the source text again. ID 0 is reserved for
+# tokens that are not identifiers.
+class SymbolTable:
+    ids: Dict[bytes, int]
+    names: List[str]
+
+    def __init__(self):
+        self.ids = {}
+        self.names = [""]
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def intern(self, spelling: bytes) -> int:
+        symbol = self.ids.get(spelling)
+        if symbol is None:
+            symbol = len(self.names)
+            self.ids[spelling] = symbol
+            self.names.append(spelling.decode("utf-8", errors="replace"))
+        return symbol
+
+    def name(self, symbol: int) -> str:
+        return self.names[symbol]
+
+
+# The symbol table shared by all source files.
+symbols = SymbolTable()
+
+__all__ = [
+    "SymbolTable",
+    "symbols",
+]
@@ -0,0 +1,156 @@
+from __future__ import annotations
+from enum import IntEnum
+from io import StringIO
+from src.diagnostics import *
+from typing import *
+import atexit
+import json
+import sys
+
+
+# The verbosity of a trace record. A category traces all records at or below
+# its configured level.
+class TraceLevel(IntEnum):
+    OFF = 0
+    INFO = 1
+    DEBUG = 2
+    TRACE = 3
+
+
+# A named group of trace records that can be enabled separately. Call sites
+# check `level` before formatting a record, such that disabled tracing costs a
+# single comparison:
+#
+#     if TYPECK.level >= TraceLevel.DEBUG:
+#         TYPECK.emit(TraceLevel.DEBUG, f"expensive {thing}")
+class TraceCategory:
+    __slots__ = ("name", "level")
+
+    name: str
+    level: TraceLevel
+
+    def __init__(self, name: str):
+        self.name = name
+        self.level = TraceLevel.OFF
+
+    def enabled(self, level: TraceLevel) -> bool:
+        return self.level >= level
+
+    def emit(self, level: TraceLevel, msg: str, **fields: Any):
+        tracer.write(self, level, msg, fields)
+
+
+# All trace categories, keyed by name.
+CATEGORIES: Dict[str, TraceCategory] = {}
+
+
+# Get or create the trace category with the given name.
+def trace_category(name: str) -> TraceCategory:
+    if category := CATEGORIES.get(name):
+        return category
+    category = TraceCategory(name)
+    CATEGORIES[name] = category
+    return category
+
+
+# Whether any trace category is enabled.
+def tracing_enabled() -> bool:
+    return any(category.level > TraceLevel.OFF
+               for category in CATEGORIES.values())
+
+
+# Writes trace records either as text to stderr, or as JSON lines to a file.
+class Tracer:
+    output: TextIO
+    json: bool
+
+    def __init__(self):
+        self.output = sys.stderr
+        self.json = False
+
+    def write(self, category: TraceCategory, level: TraceLevel, msg: str,
+              fields: Dict[str, Any]):
+        if self.json:
+            record = {
+                "cat": category.name,
+                "level": level.name.lower(),
+                "msg": msg,
+                **fields
+            }
+            self.output.write(json.dumps(record, default=str) + "\n")
+        else:
+            self.output.write(f"[{category.name}] {msg}\n")
+
+    # Redirect records into a buffer, e.g. in a worker process. Returns the
+    # records written so far and starts a new buffer.
+    def capture(self) -> str:
+        text = ""
+        if isinstance(self.output, StringIO):
+            text = self.output.getvalue()
+        self.output = StringIO()
+        return text
+
+    def close(self):
+        self.output.flush()
+        if self.output is not sys.stderr:
+            self.output.close()
+            self.output = sys.stderr
+            self.json = False
+
+
+# The tracer used throughout the compiler.
+tracer = Tracer()
+
+
+# Enable tracing according to a comma-separated list of `category[=level]`
+# entries, where `all` selects every category and the level defaults to
+# `debug`. If a path is given, records are written to that file as JSON lines
+# instead of as text to stderr.
+def configure_tracing(spec: str, path: Optional[str] = None):
+    for entry in spec.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, _, level_name = entry.partition("=")
+        level_name = level_name or "debug"
+        try:
+            level = TraceLevel[level_name.upper()]
+        except KeyError:
+            emit_error(None, f"unknown trace level `{level_name}`")
+        if name == "all":
+            categories = list(CATEGORIES.values())
+        elif category := CATEGORIES.get(name):
+            categories = [category]
+        else:
+            emit_error(None, f"unknown trace category `{name}`")
+        for category in categories:
+            category.level = level
+
+    if path is not None:
+        try:
+            tracer.output = open(path, "w", buffering=1 << 20)
+        except Exception as e:
+            emit_error(None, f"unable to open trace file: {e}")
+        tracer.json = True
+        atexit.register(tracer.close)
+
+
+# Disable all trace categories and restore writing to stderr, e.g. before the
+# compile server starts the next compilation.
+def reset_tracing():
+    if tracer.json:
+        tracer.close()
+    tracer.output = sys.stderr
+    for category in CATEGORIES.values():
+        category.level = TraceLevel.OFF
+
+
+__all__ = [
+    "TraceLevel",
+    "TraceCategory",
+    "trace_category",
+    "configure_tracing",
+    "tracing_enabled",
+    "reset_tracing",
+    "tracer",
+]
@@ -1,32 +1,218 @@
 from __future__ import annotations
+from array import array
 from dataclasses import dataclass, field
 from src import ast
+from src.cache import ModuleCache, module_cache_keys
 from src.diagnostics import *
+from src.schedule import *
 from src.source import *
-from typing import Dict, Optional
+from src.stats import statistics
+from src.tracing import *
+from typing import Dict, Generator, List, NoReturn, Optional, Set, Tuple, Union
+
+# Progress of the type checker through modules and statements.
+TYPECK = trace_category("typeck")
+# Creation and inference of domain variables.
+INFER = trace_category("infer")
+
+
+# Type-check all modules in a subtree. With `jobs > 1` the modules are checked
+# concurrently on a pool of worker processes. If a cache is given, modules whose
+# results are cached are not checked again.
+def type_check(node: ast.AstNode,
+               jobs: int = 1,
+               cache: Optional[ModuleCache] = None):
+    modules = collect_modules(node)
+    if cache is None and (jobs <= 1 or len(modules) < PARALLEL_MIN_MODULES):
+        signatures: Dict[int, Optional[Signature]] = {}
+        for mod in modules:
+            typeck_module(Context(root=RootContext(signatures=signatures)),
+                          mod)
+        return
+
+    # Look up cached results, and check the remaining modules.
+    graph = call_graph(modules)
+    results: List[List[PortableDiagnostic]] = [[] for _ in modules]
+    traces = [""] * len(modules)
+    keys = module_cache_keys(modules, graph) if cache else []
+    pending: List[int] = []
+    for index in range(len(modules)):
+        if cache and (cached := cache.get(keys[index])) is not None:
+            results[index] = cached
+        else:
+            pending.append(index)
+
+    checked: Optional[List[Tuple[int, List[PortableDiagnostic], str]]] = None
+    if jobs > 1 and len(pending) >= PARALLEL_MIN_MODULES:
+        checked = type_check_parallel(modules, graph, pending, jobs)
+    if checked is None:
+        # Captured errors do not count towards the error limit, so stop once
+        # the errors of the modules checked so far and of the modules before
+        # them would reach it when replayed.
+        checked = []
+        limit = diagnostics.error_limit
+        num_errors = diagnostics.num_errors
+        counted = 0
+        for index, diags in check_modules(modules, pending, {}):
+            checked.append((index, diags, ""))
+            results[index] = diags
+            if limit > 0:
+                for earlier in results[counted:index + 1]:
+                    num_errors += sum(1 for diag in earlier
+                                      if diag[0] == "error")
+                counted = index + 1
+                if num_errors >= limit:
+                    break
+    for index, diags, trace_text in checked:
+        results[index] = diags
+        traces[index] = trace_text
+        if cache:
+            cache.put(keys[index], diags)
+    if cache:
+        cache.evict()
+
+    # Emit the diagnostics and trace records in source order, such that the
+    # output does not depend on caching or scheduling.
+    for mod, diags, trace_text in zip(modules, results, traces):
+        tracer.output.write(trace_text)
+        diagnostics.replay(
+            import_diagnostics(diags, mod.full_loc.file, mod.full_loc.offset))
+
+
+# Check modules one after another and capture the diagnostics emitted for each.
+# The locations are relative to the start of the module. The signatures of the
+# modules called are computed on demand and kept in `signatures`.
+def check_modules(
+    modules: List[ast.ModItem], indices: List[int],
+    signatures: Dict[int, Optional[Signature]]
+) -> Generator[Tuple[int, List[PortableDiagnostic]], None, None]:
+    for index in indices:
+        mod = modules[index]
+        diagnostics.capture()
+        try:
+            typeck_module(Context(root=RootContext(signatures=signatures)),
+                          mod)
+        finally:
+            diags = diagnostics.end_capture()
+        yield index, export_diagnostics(diags, mod.full_loc.offset)
+
+
+# Minimum number of modules for which checking in parallel pays off.
+PARALLEL_MIN_MODULES = 64
+
+# The modules being checked, inherited by forked worker processes, and the
+# signatures of modules computed by a worker process so far.
+worker_modules: List[ast.ModItem] = []
+worker_signatures: Dict[int, Optional[Signature]] = {}
+
+
+# Check modules on a process pool. Modules only depend on the declared ports of
+# the modules they call, so every module can be checked independently. The
+# modules are scheduled by strongly connected component of the call graph,
+# callees first, such that a batch tends to contain the callees of its modules.
+# Each worker computes the signatures of the callees it encounters itself, from
+# the inherited syntax tree, and reuses them for the rest of its batches.
+# Returns the diagnostics and trace records of each module, or None if worker
+# processes are unavailable.
+def type_check_parallel(
+        modules: List[ast.ModItem], graph: List[List[int]], indices: List[int],
+        jobs: int
+) -> Optional[List[Tuple[int, List[PortableDiagnostic], str]]]:
+    import multiprocessing
+    try:
+        mp = multiprocessing.get_context("fork")
+    except ValueError:
+        return None
+
+    global worker_modules, worker_signatures
+    worker_modules = modules
+    worker_signatures = {}
+    selected = set(indices)
+    components = [[index for index in component if index in selected]
+                  for component in strongly_connected_components(graph)]
+    batches = batch_components([c for c in components if c],
+                               max(1,
+                                   len(indices) // (jobs * 4)))
+    try:
+        with mp.Pool(jobs) as pool:
+            checked = []
+            for results, counters in pool.imap_unordered(check_batch, batches):
+                checked += results
+                statistics.merge(counters)
+            return checked
+    finally:
+        worker_modules = []
+        worker_signatures = {}
+
+
+# Check a batch of modules in a worker process. Returns the module index along
+# with the diagnostics and trace records emitted for each module, and the
+# statistics counted while checking the batch.
+def check_batch(
+    batch: List[int]
+) -> Tuple[List[Tuple[int, List[PortableDiagnostic], str]], Dict[str, int]]:
+    tracer.capture()
+    statistics.counters = {}
+    results = []
+    for index, diags in check_modules(worker_modules, batch,
+                                      worker_signatures):
+        results.append((index, diags, tracer.capture()))
+    return results, statistics.counters
+
+
+# Raised after a type error has been reported, to abandon checking the current
+# statement. Nodes whose type or domain could not be determined are remembered
+# in the context, such that the error is not reported again for every use.
+class TypeckError(Exception):
+    pass
 
 
-def type_check(node: ast.AstNode):
-    if isinstance(node, ast.ModItem):
-        typeck_module(Context(root=RootContext()), node)
-    else:
-        for child in node.children():
-            type_check(child)
+def typeck_error(loc: Loc, msg: str) -> NoReturn:
+    report_error(loc, msg)
+    raise TypeckError()
 
 
 @dataclass
 class RootContext:
+    # The signatures of modules, shared across all modules being checked. A
+    # None entry marks a module whose signature could not be computed.
+    signatures: Dict[int, Optional[Signature]]
     free_var_id: int = 0
     inferrable_var_id: int = 0
+    # All domain variables created in this context. Each variable's `index`
+    # is its position in this list.
+    domain_vars: List[Domain] = field(default_factory=list)
+    # The domain equalities recorded while walking the module, as pairs of
+    # variable indices, together with the location that gave rise to each.
+    # They are solved in one go by `solve_domains`.
+    constraints_lhs: array = field(default_factory=lambda: array("l"))
+    constraints_rhs: array = field(default_factory=lambda: array("l"))
+    constraints_loc: List[Loc] = field(default_factory=list)
+    # A union-find over the domain variables, into which `merge_domains` has
+    # merged the first `num_merged` constraints. Each class leader records the
+    # class's free variable, if any, and its lowest variable index. Conflicts
+    # between free variables are kept until the module's domains are solved.
+    domain_parent: array = field(default_factory=lambda: array("l"))
+    domain_rank: array = field(default_factory=lambda: array("B"))
+    domain_free: List[Optional[FreeDomainVar]] = field(default_factory=list)
+    domain_first: array = field(default_factory=lambda: array("l"))
+    num_merged: int = 0
+    domain_conflicts: List[Tuple[int, FreeDomainVar, FreeDomainVar,
+                                 Loc]] = field(default_factory=list)
 
     def get_free_variable(self, name: Optional[str]) -> FreeDomainVar:
-        var = FreeDomainVar(num=self.free_var_id, name=name)
+        var = FreeDomainVar(num=self.free_var_id,
+                            name=name,
+                            index=len(self.domain_vars))
         self.free_var_id += 1
+        self.domain_vars.append(var)
         return var
 
     def get_inferrable_variable(self) -> InferrableDomainVar:
-        var = InferrableDomainVar(num=self.inferrable_var_id)
+        var = InferrableDomainVar(num=self.inferrable_var_id,
+                                  index=len(self.domain_vars))
         self.inferrable_var_id += 1
+        self.domain_vars.append(var)
         return var
 
 
@@ -35,32 +221,86 @@ class Context:
     root: RootContext
     types: Dict[int, Type] = field(default_factory=dict)
     domains: Dict[int, Domain] = field(default_factory=dict)
+    failed: Set[int] = field(default_factory=set)
+    # If set, the inferrable variables created for implicit domains are
+    # collected here instead of being reported, such that a module signature
+    # can quantify over them.
+    quantified: Optional[List[Tuple[InferrableDomainVar, str]]] = None
+
+
+# The signature of a module, computed once and instantiated at every call site.
+# The domain variables in `params` are placeholders for the module's type
+# variables and implicit domains, each with a description of its origin. A call
+# replaces them with fresh inferrable variables.
+@dataclass
+class Signature:
+    params: List[Tuple[InferrableDomainVar, str]]
+    args: List[Type]
+    results: List[Type]
 
 
 def typeck_module(ctx: Context, mod: ast.ModItem):
-    print(f"typeck module {mod.name.spelling()}")
+    if TYPECK.level >= TraceLevel.INFO:
+        TYPECK.emit(TraceLevel.INFO,
+                    f"typeck module {mod.name.spelling()}",
+                    loc=mod.loc)
 
     # Predefine type variables.
     for type_var in mod.type_vars:
         ctx.domains[id(type_var)] = ctx.root.get_free_variable(
             type_var.name.spelling())
 
-    for arg in mod.args:
-        type_of(ctx, arg)
-    for result in mod.results:
-        type_of(ctx, result)
-
-    for stmt in mod.stmts:
-        typeck_stmt(ctx, stmt)
+    for port in [*mod.args, *mod.results]:
+        try:
+            type_of(ctx, port)
+        except TypeckError:
+            pass
 
-    # Print final types.
     for stmt in mod.stmts:
-        if isinstance(stmt, ast.LetStmt):
-            print(f"- final {stmt.name.spelling()} = {type_of(ctx, stmt)}")
+        try:
+            typeck_stmt(ctx, stmt)
+        except TypeckError:
+            pass
+
+    solve_domains(ctx.root)
+    if statistics.enabled:
+        statistics.count("modules checked")
+        statistics.count("inferrable variables", ctx.root.inferrable_var_id)
+        # Signatures are computed wherever a module is called, which may be
+        # once per worker process, so their variables are counted per module
+        # checked instead.
+        try:
+            statistics.count("signature variables",
+                             len(signature_of(ctx, mod).params))
+        except TypeckError:
+            pass
+        statistics.count("domain constraints", len(ctx.root.constraints_lhs))
+
+    # Trace final types.
+    if TYPECK.level >= TraceLevel.INFO:
+        for node, ty in final_types(ctx, mod):
+            if isinstance(node, ast.LetStmt):
+                TYPECK.emit(TraceLevel.INFO,
+                            f"- final {node.name.spelling()} = {ty}",
+                            loc=node.loc)
+
+
+# The types of a module's ports and let bindings, in source order. Only
+# meaningful once the module has been checked and its domains solved. Values
+# whose type could not be determined are omitted.
+def final_types(ctx: Context,
+                mod: ast.ModItem) -> List[Tuple[ast.AstNode, Type]]:
+    nodes: List[ast.AstNode] = [*mod.args, *mod.results, *mod.stmts]
+    return [(node, ctx.types[id(node)]) for node in nodes
+            if isinstance(node, (ast.ModArg, ast.ModResult,
+                                 ast.LetStmt)) and id(node) in ctx.types]
 
 
 def typeck_stmt(ctx: Context, stmt: ast.Stmt):
-    print(f"typeck statement {stmt.__class__.__name__}")
+    if TYPECK.level >= TraceLevel.DEBUG:
+        TYPECK.emit(TraceLevel.DEBUG,
+                    f"typeck statement {stmt.__class__.__name__}",
+                    loc=stmt.loc)
 
     if isinstance(stmt, ast.AssignStmt):
         ty_lhs = type_of(ctx, stmt.lhs)
@@ -77,25 +317,67 @@ def typeck_stmt(ctx: Context, stmt: ast.Stmt):
             unify_types(ctx, ty, init_ty, stmt.loc)
 
 
+# Compute the type of a node, or return the cached one. The types of nested
+# nodes are computed by `type_of_inner`, which yields each node whose type it
+# needs and receives the type in return. The nodes in progress are kept on an
+# explicit stack instead of recursing, such that arbitrarily deep expressions
+# can be checked. A type error in a nested node is raised in the node that
+# asked for its type, just like an exception propagating up a call stack.
 def type_of(ctx: Context, node: ast.AstNode) -> Type:
     if ty := ctx.types.get(id(node)):
         return ty
-
-    ty = type_of_inner(ctx, node)
-    # emit_info(node.loc, f"{node.__class__.__name__} has type `{ty}`")
-    ctx.types[id(node)] = ty
+    if id(node) in ctx.failed:
+        raise TypeckError()
+
+    stack: List[Tuple[ast.AstNode,
+                      TypeSteps]] = [(node, type_of_inner(ctx, node))]
+    ty = None
+    error: Optional[TypeckError] = None
+    while stack:
+        current, steps = stack[-1]
+        try:
+            if error is None:
+                request = steps.send(ty)  # type: ignore
+            else:
+                request = steps.throw(error)
+                error = None
+        except StopIteration as stop:
+            stack.pop()
+            ty = stop.value
+            # emit_info(current.loc, f"{current.__class__.__name__} has type `{ty}`")
+            ctx.types[id(current)] = ty
+            continue
+        except TypeckError as e:
+            stack.pop()
+            ctx.failed.add(id(current))
+            error = e
+            continue
+
+        ty = ctx.types.get(id(request))
+        if ty is None:
+            if id(request) in ctx.failed:
+                error = TypeckError()
+            else:
+                stack.append((request, type_of_inner(ctx, request)))
+    if error is not None:
+        raise error
+    assert ty is not None
     return ty
 
 
-def type_of_inner(ctx: Context, node: ast.AstNode) -> Type:
+# The computation of a node's type, which yields the nodes whose types it needs.
+TypeSteps = Generator[ast.AstNode, "Type", "Type"]
+
+
+def type_of_inner(ctx: Context, node: ast.AstNode) -> TypeSteps:
     # print(f"computing type of {node.__class__.__name__}")
 
     if isinstance(node, ast.LetStmt):
         if node.ty is not None:
             return declare_ast_type(ctx, node.ty)
         if node.init is not None:
-            return type_of(ctx, node.init)
-        emit_error(
+            return (yield node.init)
+        typeck_error(
             node.loc,
             f"unknown type: let `{node.name.spelling()}` needs either a type or an initial value"
         )
@@ -107,67 +389,161 @@ def type_of_inner(ctx: Context, node: ast.AstNode) -> Type:
     if isinstance(node, ast.IdentExpr):
         target = node.binding.get()
         if isinstance(target, ast.LetStmt):
-            return type_of(ctx, target)
+            return (yield target)
         if isinstance(target, ast.ModArg):
-            return type_of(ctx, target)
-        emit_error(
+            return (yield target)
+        typeck_error(
             node.loc,
             f"`{node.name.spelling()}` cannot be used in an expression")
 
     if isinstance(node, ast.CallExpr):
         callee = node.ident.binding.get()
         if isinstance(callee, ast.ModItem):
-            return type_of_call(ctx, node, callee)
-        emit_error(node.loc, f"`{node.ident.loc.spelling()}` cannot be called")
-
-    emit_error(node.loc, "node has no type")
+            return (yield from type_of_call(ctx, node, callee))
+        typeck_error(node.loc,
+                     f"`{node.ident.loc.spelling()}` cannot be called")
+
+    if isinstance(node, ast.BinaryExpr):
+        return (yield from type_of_binary(ctx, node))
+
+    if isinstance(node, ast.FieldExpr):
+        base = yield node.base
+        name = node.name.spelling()
+        if isinstance(base.primary, NamedTupleType):
+            if ty := base.primary.fields.get(name):
+                return ty
+        resolve_domains(ctx.root, base)
+        typeck_error(node.name.loc, f"no field `{name}` in `{base}`")
+
+    typeck_error(node.loc, "node has no type")
+
+
+# Operators apply to `u32` operands in the same domain. Unlike calls, they need
+# no signature to be instantiated: the operand types are unified directly, and
+# the result is a `u32` in the operands' domain. Comparisons produce a `u32`
+# that is either 0 or 1.
+def type_of_binary(ctx: Context, node: ast.BinaryExpr) -> TypeSteps:
+    lhs = yield node.lhs
+    rhs = yield node.rhs
+    for operand, ty in ((node.lhs, lhs), (node.rhs, rhs)):
+        if not isinstance(ty.primary, U32Type):
+            resolve_domains(ctx.root, ty)
+            typeck_error(
+                operand.loc,
+                f"operator `{node.op.spelling()}` requires `u32` operands, found `{ty}`"
+            )
+    unify_domains(ctx, lhs.domain, rhs.domain, node.op.loc)
+    return Type(primary=U32Type(), domain=lhs.domain)
 
 
 def type_of_call(ctx: Context, call: ast.CallExpr,
-                 callee: ast.ModItem) -> Type:
+                 callee: ast.ModItem) -> TypeSteps:
     if len(call.args) != len(callee.args):
-        emit_error(
+        typeck_error(
             call.loc,
             f"invalid number of call arguments; `{callee.name.spelling()}` expects {len(callee.args)}, but call provides {len(call.args)}"
         )
 
-    # Create a local context for the called module. Map each of the
-    # module's type variables to an inferrable domain variable. Then
-    # populate the context with the argument types.
-    call_ctx = Context(root=ctx.root)
-
-    for type_var in callee.type_vars:
-        var = call_ctx.root.get_inferrable_variable()
-        print(
-            f"add {var} for type variable `{type_var.name.spelling()}` of call `{call.loc.spelling()}`"
-        )
-        call_ctx.domains[id(type_var)] = var
-
-    for call_arg, mod_arg in zip(call.args, callee.args):
-        call_ty = type_of(ctx, call_arg)
-        mod_ty = type_of(call_ctx, mod_arg)
-        unify_types(ctx, call_ty, mod_ty, call_arg.loc)
+    # Instantiate the module's signature with fresh inferrable variables. Then
+    # unify it with the argument types.
+    sig = signature_of(ctx, callee)
+    mapping: Dict[int, Domain] = {}
+    for param, origin in sig.params:
+        var = ctx.root.get_inferrable_variable()
+        if INFER.level >= TraceLevel.DEBUG:
+            INFER.emit(
+                TraceLevel.DEBUG,
+                f"add {var} for {origin} of call `{call.loc.spelling()}`",
+                loc=call.loc)
+        mapping[id(param)] = var
+
+    for call_arg, mod_ty in zip(call.args, sig.args):
+        call_ty = yield call_arg
+        unify_types(ctx, call_ty, substitute_type(mod_ty, mapping),
+                    call_arg.loc)
 
     if len(callee.results) == 0:
         return Type(primary=UnitType(),
                     domain=ctx.root.get_free_variable(None))
 
     if len(callee.results) == 1:
-        return type_of(call_ctx, callee.results[0])
+        return substitute_type(sig.results[0], mapping)
 
     fields: Dict[str, Type] = {}
-    for mod_result in callee.results:
-        mod_ty = type_of(call_ctx, mod_result)
-        fields[mod_result.name.spelling()] = mod_ty
+    for mod_result, mod_ty in zip(callee.results, sig.results):
+        fields[mod_result.name.spelling()] = substitute_type(mod_ty, mapping)
     return Type(primary=NamedTupleType(fields=fields),
                 domain=ctx.root.get_free_variable(None))
 
 
+# Compute the signature of a module, or return the cached one.
+def signature_of(ctx: Context, mod: ast.ModItem) -> Signature:
+    signatures = ctx.root.signatures
+    if id(mod) in signatures:
+        if sig := signatures[id(mod)]:
+            return sig
+        raise TypeckError()
+
+    # Map each of the module's type variables to a placeholder variable, and
+    # collect the placeholders created for implicit domains in the port types.
+    signatures[id(mod)] = None
+    params: List[Tuple[InferrableDomainVar, str]] = []
+    sig_ctx = Context(root=RootContext(signatures=signatures),
+                      quantified=params)
+    for type_var in mod.type_vars:
+        var = sig_ctx.root.get_inferrable_variable()
+        params.append((var, f"type variable `{type_var.name.spelling()}`"))
+        sig_ctx.domains[id(type_var)] = var
+
+    # Errors in the port types are discarded here, since they are reported
+    # when the module itself is checked.
+    diagnostics.capture()
+    try:
+        sig = Signature(params=params,
+                        args=[type_of(sig_ctx, arg) for arg in mod.args],
+                        results=[type_of(sig_ctx, res) for res in mod.results])
+    finally:
+        diagnostics.end_capture()
+    signatures[id(mod)] = sig
+    return sig
+
+
+# Replace the domain variables in a type according to a mapping.
+def substitute_type(ty: Type, mapping: Dict[int, Domain]) -> Type:
+    return Type(primary=substitute_primary_type(ty.primary, mapping),
+                domain=substitute_domain(ty.domain, mapping))
+
+
+def substitute_primary_type(ty: PrimaryType,
+                            mapping: Dict[int, Domain]) -> PrimaryType:
+    if isinstance(ty, ClockType):
+        return ClockType(
+            clock_domain=substitute_domain(ty.clock_domain, mapping))
+    if isinstance(ty, NamedTupleType):
+        return NamedTupleType(
+            fields={
+                name: substitute_type(field_ty, mapping)
+                for name, field_ty in ty.fields.items()
+            })
+    return ty
+
+
+def substitute_domain(domain: Domain, mapping: Dict[int, Domain]) -> Domain:
+    domain = simplify_domain(domain)
+    return mapping.get(id(domain), domain)
+
+
 def domain_of(ctx: Context, node: ast.AstNode) -> Domain:
     if dom := ctx.domains.get(id(node)):
         return dom
-
-    dom = domain_of_inner(ctx, node)
+    if id(node) in ctx.failed:
+        raise TypeckError()
+
+    try:
+        dom = domain_of_inner(ctx, node)
+    except TypeckError:
+        ctx.failed.add(id(node))
+        raise
     # emit_info(node.loc, f"{node.__class__.__name__} has domain `{dom}`")
     ctx.domains[id(node)] = dom
     return dom
@@ -185,17 +561,25 @@ def domain_of_inner(ctx: Context, node: ast.AstNode) -> Domain:
             return domain_of(ctx, target)
         if isinstance(target, ast.ModTypeVar):
             return domain_of(ctx, target)
-        emit_error(node.loc,
-                   f"`{node.name.spelling()}` cannot be used as domain")
+        typeck_error(node.loc,
+                     f"`{node.name.spelling()}` cannot be used as domain")
 
-    emit_error(node.loc, "node has no domain")
+    typeck_error(node.loc, "node has no domain")
 
 
 def declare_ast_type(ctx: Context, aty: ast.Type) -> Type:
     domain: Domain
     if aty.domain is None:
-        domain = ctx.root.get_inferrable_variable()
-        print(f"add {domain} for implicit domain in `{aty.loc.spelling()}`")
+        var = ctx.root.get_inferrable_variable()
+        if ctx.quantified is not None:
+            ctx.quantified.append(
+                (var, f"implicit domain in `{aty.loc.spelling()}`"))
+        elif INFER.level >= TraceLevel.DEBUG:
+            INFER.emit(
+                TraceLevel.DEBUG,
+                f"add {var} for implicit domain in `{aty.loc.spelling()}`",
+                loc=aty.loc)
+        domain = var
     else:
         domain = domain_of(ctx, aty.domain)
 
@@ -207,7 +591,7 @@ def declare_ast_type(ctx: Context, aty: ast.Type) -> Type:
             primary=ClockType(clock_domain=domain_of(ctx, aty.clock_domain)),
             domain=domain)
 
-    emit_error(aty.loc, f"invalid type")
+    typeck_error(aty.loc, f"invalid type")
 
 
 def unify_types(ctx: Context, lhs: Type, rhs: Type, loc: Loc):
@@ -227,49 +611,133 @@ def unify_primary_types(ctx: Context, lhs: PrimaryType, rhs: PrimaryType,
         unify_domains(ctx, lhs.clock_domain, rhs.clock_domain, loc=loc)
         return
 
-    emit_error(loc, f"incompatible types: `{lhs}` and `{rhs}`")
+    resolve_domains(ctx.root, lhs, rhs)
+    typeck_error(loc, f"incompatible types: `{lhs}` and `{rhs}`")
 
 
+# Record that two domains must be equal. The constraint is resolved later by
+# `solve_domains`.
 def unify_domains(ctx: Context, lhs: Domain, rhs: Domain, loc: Loc):
-    lhs = simplify_domain(lhs)
-    rhs = simplify_domain(rhs)
-
-    if lhs == rhs:
-        return
-
-    # If both sides are inferrable variables, pick the variable with the lower
-    # numeric ID and assign it as the replacement value of the other variable.
-    if isinstance(lhs, InferrableDomainVar) and isinstance(
-            rhs, InferrableDomainVar):
-        assert lhs.assignment is None  # simplify_domain does this
-        assert rhs.assignment is None  # simplify_domain does this
-        if lhs.num > rhs.num:
-            lhs, rhs = rhs, lhs
-        print(f"marking inferrable vars equivalent: {rhs} = {lhs}")
-        rhs.assignment = lhs
-        return
-
-    # If one of the sides is an inferrable variable, assign it the value of the
-    # other side.
-    if isinstance(lhs, InferrableDomainVar):
-        assert lhs.assignment is None  # simplify_domain does this
-        print(f"inferring {lhs} = {rhs}")
-        lhs.assignment = rhs
-        return
-    if isinstance(rhs, InferrableDomainVar):
-        assert rhs.assignment is None  # simplify_domain does this
-        print(f"inferring {rhs} = {lhs}")
-        rhs.assignment = lhs
+    if lhs is rhs:
         return
-
-    emit_error(loc, f"incompatible domains: `{lhs}` and `{rhs}`")
+    root = ctx.root
+    assert root.domain_vars[lhs.index] is lhs, "domain from other context"
+    assert root.domain_vars[rhs.index] is rhs, "domain from other context"
+    root.constraints_lhs.append(lhs.index)
+    root.constraints_rhs.append(rhs.index)
+    root.constraints_loc.append(loc)
+
+
+# Solve the domain equalities recorded in a context. The domain variables are
+# partitioned into equivalence classes using a union-find with union by rank
+# and path compression. A class may contain at most one free variable; classes
+# with multiple free variables are reported as an error, once per class. Each
+# inferrable variable is then assigned the free variable of its class, or the
+# lowest-numbered inferrable variable if the class has no free variable.
+def solve_domains(root: RootContext):
+    merge_domains(root)
+    reported: Set[int] = set()
+    for leader, free_a, free_b, loc in root.domain_conflicts:
+        leader = find_domain(root.domain_parent, leader)
+        if leader not in reported:
+            reported.add(leader)
+            report_error(loc,
+                         f"incompatible domains: `{free_a}` and `{free_b}`")
+
+    # Assign each inferrable variable the representative of its class.
+    for var in root.domain_vars:
+        rep = domain_representative(root, var.index)
+        if isinstance(var, InferrableDomainVar) and rep is not var:
+            if INFER.level >= TraceLevel.DEBUG:
+                INFER.emit(TraceLevel.DEBUG, f"inferring {var} = {rep}")
+            var.assignment = rep
+
+
+# Merge the classes of each pair of constrained variables recorded since the
+# last call, and remember the constraint that first brought two free variables
+# together.
+def merge_domains(root: RootContext):
+    parent = root.domain_parent
+    rank = root.domain_rank
+    free = root.domain_free
+    first = root.domain_first
+    for var in root.domain_vars[len(parent):]:
+        parent.append(var.index)
+        rank.append(0)
+        free.append(var if isinstance(var, FreeDomainVar) else None)
+        first.append(var.index)
+
+    for lhs, rhs, loc in zip(root.constraints_lhs[root.num_merged:],
+                             root.constraints_rhs[root.num_merged:],
+                             root.constraints_loc[root.num_merged:]):
+        a = find_domain(parent, lhs)
+        b = find_domain(parent, rhs)
+        if a == b:
+            continue
+        free_a = free[a]
+        free_b = free[b]
+        if free_a is not None and free_b is not None:
+            root.domain_conflicts.append((a, free_a, free_b, loc))
+        if rank[a] < rank[b]:
+            a, b = b, a
+            free_a, free_b = free_b, free_a
+        parent[b] = a
+        if rank[a] == rank[b]:
+            rank[a] += 1
+        if free_a is None:
+            free[a] = free_b
+        first[a] = min(first[a], first[b])
+    root.num_merged = len(root.constraints_lhs)
+
+
+def find_domain(parent: array, index: int) -> int:
+    leader = index
+    while parent[leader] != leader:
+        leader = parent[leader]
+    while parent[index] != leader:
+        parent[index], index = leader, parent[index]
+    return leader
+
+
+# The variable that stands for the class of a merged variable: the class's free
+# variable, or else its first variable. Since variables are numbered in
+# creation order, the first variable has the lowest number.
+def domain_representative(root: RootContext, index: int) -> Domain:
+    leader = find_domain(root.domain_parent, index)
+    return root.domain_free[leader] or root.domain_vars[
+        root.domain_first[leader]]
+
+
+# Assign the inferrable variables in some types the representative of their
+# class, as far as the constraints recorded so far determine it, such that a
+# diagnostic reported before the module's domains are solved prints the
+# inferred domains.
+def resolve_domains(root: RootContext, *types: Union[Type, PrimaryType]):
+    merge_domains(root)
+    pending = list(types)
+    while pending:
+        ty = pending.pop()
+        if isinstance(ty, Type):
+            pending.append(ty.primary)
+            domains = [ty.domain]
+        elif isinstance(ty, ClockType):
+            domains = [ty.clock_domain]
+        elif isinstance(ty, NamedTupleType):
+            pending += ty.fields.values()
+            continue
+        else:
+            continue
+        for var in domains:
+            if (isinstance(var, InferrableDomainVar)
+                    and root.domain_vars[var.index] is var):
+                rep = domain_representative(root, var.index)
+                var.assignment = rep if rep is not var else None
 
 
 # Look through assignments to inferrable variables.
 def simplify_domain(domain: Domain) -> Domain:
-    if isinstance(domain, InferrableDomainVar) and domain.assignment:
-        domain.assignment = simplify_domain(domain.assignment)
-        return domain.assignment
+    while isinstance(domain, InferrableDomainVar) and domain.assignment:
+        domain = domain.assignment
     return domain
 
 
@@ -320,7 +788,8 @@ class NamedTupleType(PrimaryType):
 
 @dataclass
 class Domain:
-    pass
+    # The position of the variable in its context's `domain_vars`.
+    index: int = field(default=-1, kw_only=True, compare=False)
 
 
 @dataclass
@@ -0,0 +1,104 @@
+# RUN: %python %s
+
+# Compile a file with an error through the incremental compilation cache, and
+# check that warm runs report the same diagnostics as cold ones, that editing a
+# module only checks it and its callers again, and that a full cache is
+# evicted.
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from typing import *
+
+DOTY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "doty")
+
+env = dict(os.environ)
+env.pop("DOTY_SERVER", None)
+
+# `top` calls `mid`, which calls `leaf`. `top` and `other` have type errors.
+SOURCE = """\
+mod add<U>(a: u32 @U, b: u32 @U) -> (z: u32 @U) {}
+mod leaf<C>(clock: Clock<C>, x: u32 @C) -> (y: u32 @C) {
+    let a = add(x, x);
+}
+mod mid<C>(clock: Clock<C>, x: u32 @C) -> (y: u32 @C) {
+    let a = leaf(clock, x);
+}
+mod top<C>(clock: Clock<C>, x: u32 @C) -> (y: u32 @C) {
+    let a = mid(clock, x);
+    let b = add(a, clock);
+}
+mod other<C>(clock: Clock<C>, x: u32 @C) -> (y: u32 @C) {
+    let a = add(clock, x);
+}
+"""
+
+
+# Compile a file and return its exit code, output, and statistics.
+def run(path: str, *args: str) -> Tuple[Tuple[int, str, str], Dict[str, Any]]:
+    stats_file = path + ".stats.json"
+    result = subprocess.run(
+        [sys.executable, DOTY, path, "--stats-json", stats_file, *args],
+        capture_output=True,
+        text=True,
+        env=env)
+    with open(stats_file) as f:
+        stats = json.load(f)
+    return (result.returncode, result.stdout, result.stderr), stats
+
+
+def modules_checked(stats: Dict[str, Any]) -> int:
+    return stats["counters"].get("modules checked", 0)
+
+
+def passes(stats: Dict[str, Any]) -> List[str]:
+    return [p["name"] for p in stats["passes"]]
+
+
+# The files in the cache, other than the one recording its size.
+def cache_entries(cache_dir: str) -> List[str]:
+    return [
+        name for _, _, names in os.walk(cache_dir) for name in names
+        if name != "size"
+    ]
+
+
+with tempfile.TemporaryDirectory() as directory:
+    path = os.path.join(directory, "design.doty")
+    cache_dir = os.path.join(directory, "cache")
+    with open(path, "w") as f:
+        f.write(SOURCE)
+    expected, _ = run(path, "--no-cache")
+    assert expected[0] == 1, expected
+    assert expected[2].count("error:") == 2, expected
+
+    # A cold run checks every module, a warm one none, and both report the
+    # same errors. The warm run loads the syntax tree instead of lexing.
+    cold, stats = run(path, "--cache-dir", cache_dir)
+    assert cold == expected, cold
+    assert modules_checked(stats) == 5, stats
+    assert "lex" in passes(stats), stats
+    warm, stats = run(path, "--cache-dir", cache_dir)
+    assert warm == expected, warm
+    assert modules_checked(stats) == 0, stats
+    assert "lex" not in passes(stats), stats
+
+    # Editing `leaf` checks `leaf` and its caller `mid` again, but not `top`,
+    # which only calls `mid`.
+    with open(path, "w") as f:
+        f.write(SOURCE.replace("add(x, x)", "add(x, add(x, x))"))
+    expected, _ = run(path, "--no-cache")
+    edited, stats = run(path, "--cache-dir", cache_dir)
+    assert edited == expected, edited
+    assert modules_checked(stats) == 2, stats
+    assert "lex" not in passes(stats), stats
+
+    # A cache without space keeps no entries, such that the next run checks
+    # every module again.
+    assert cache_entries(cache_dir)
+    evicted, stats = run(path, "--cache-dir", cache_dir, "--cache-size", "0")
+    assert evicted == expected, evicted
+    assert not cache_entries(cache_dir), cache_entries(cache_dir)
+    _, stats = run(path, "--cache-dir", cache_dir)
+    assert modules_checked(stats) == 5, stats
@@ -0,0 +1,83 @@
+# RUN: %python %s
+
+# Apply random edits to the test inputs with incremental relexing and
+# reparsing, and check that the tokens, syntax tree, and syntax errors after
+# each edit are the same as those of a full parse of the edited text.
+import os
+import random
+from src.ast import dump_ast
+from src.incremental import ParsedFile
+from src.source import SourceFile
+from typing import *
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+INPUTS = ["parser.doty", "scratch.doty", "scratch2.doty"]
+
+# The number of random edit sequences applied to each input, and a seed such
+# that failures can be reproduced.
+TRIALS = 300
+SEED = 1
+
+# Snippets of text that are inserted, chosen to form and break tokens, items,
+# comments, and multi-byte characters.
+FRAGMENTS = [
+    b"mod ", b"let ", b"use ", b"typevar ", b"x", b"foo", b"u32", b"12", b"(",
+    b")", b"{", b"}", b";", b",", b":", b".", b"@", b"<", b">", b"=", b"->",
+    b"==", b"+", b"*", b"|", b" ", b"\n", b"/*", b"*/", b"//", b"#",
+    "é".encode()
+]
+
+
+# The state of a parsed file that must not depend on how it was parsed.
+def state(parsed: ParsedFile) -> Tuple[Any, ...]:
+    tokens = parsed.tokens
+    return (
+        list(tokens.kinds),
+        list(tokens.offsets),
+        list(tokens.lengths),
+        list(tokens.symbols),
+        dump_ast(parsed.root),
+        (parsed.root.loc.offset, parsed.root.loc.length),
+        [(d.severity, d.loc.offset if d.loc else None,
+          d.loc.length if d.loc else None, d.msg) for d in parsed.diags],
+    )
+
+
+def random_edit(rng: random.Random, text: bytes) -> Tuple[int, int, bytes]:
+    offset = rng.randint(0, len(text))
+    length = min(rng.choice([0, 0, 1, 2, rng.randint(0, 30)]),
+                 len(text) - offset)
+    insert = b"".join(
+        rng.choice(FRAGMENTS) for _ in range(rng.choice([0, 1, 1, 2, 3])))
+    return offset, length, insert
+
+
+def check_input(name: str, rng: random.Random) -> int:
+    with open(os.path.join(TEST_DIR, name), "rb") as f:
+        original = f.read()
+    num_edits = 0
+    for trial in range(TRIALS):
+        text = original
+        parsed = ParsedFile(SourceFile(name, text))
+        # Line starts are updated by edits only once they have been computed.
+        if trial % 2 == 0:
+            parsed.file.line_starts()
+        for _ in range(rng.randint(1, 4)):
+            offset, length, insert = random_edit(rng, text)
+            parsed.edit(offset, length, insert)
+            text = text[:offset] + insert + text[offset + length:]
+            num_edits += 1
+
+            full = ParsedFile(SourceFile(name, text))
+            context = f"{name}, trial {trial}, edit {(offset, length, insert)}"
+            assert parsed.file.contents == text, context
+            if parsed.file._line_starts is not None:
+                assert parsed.file._line_starts == full.file.line_starts(
+                ), context
+            assert state(parsed) == state(full), context
+    return num_edits
+
+
+rng = random.Random(SEED)
+num_edits = sum(check_input(name, rng) for name in INPUTS)
+print(f"{num_edits} edits parsed incrementally")
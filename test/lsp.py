@@ -0,0 +1,146 @@
+# RUN: %python %s
+
+# Drive `doty --lsp` over stdio with a scripted client: open a document, hover
+# over a let binding, introduce an error and fix it again, and shut down.
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from typing import *
+
+DOTY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "doty")
+
+TEXT = """\
+mod add<U>(a: u32 @U, b: u32 @U) -> (z: u32 @U) {}
+mod top<C>(x: u32 @C, y: u32 @C) {
+    let s = add(x, y);
+}
+"""
+
+env = dict(os.environ)
+env.pop("DOTY_SERVER", None)
+server = subprocess.Popen([sys.executable, DOTY, "--lsp"],
+                          stdin=subprocess.PIPE,
+                          stdout=subprocess.PIPE,
+                          env=env)
+assert server.stdin is not None and server.stdout is not None
+
+
+def send(message: Dict[str, Any]):
+    body = json.dumps({"jsonrpc": "2.0", **message}).encode()
+    server.stdin.write(b"Content-Length: %d\r\n\r\n" % len(body) + body)
+    server.stdin.flush()
+
+
+def receive() -> Dict[str, Any]:
+    length = 0
+    while line := server.stdout.readline().strip():
+        name, value = line.split(b":", 1)
+        if name.lower() == b"content-length":
+            length = int(value)
+    assert length > 0, "server closed the connection"
+    return json.loads(server.stdout.read(length))
+
+
+# Receive messages until one matches, skipping log messages.
+def receive_until(matches: Callable[[Dict[str, Any]], bool]) -> Dict[str, Any]:
+    while True:
+        message = receive()
+        if matches(message):
+            return message
+
+
+next_id = 0
+
+
+def request(method: str, params: Any) -> Any:
+    global next_id
+    next_id += 1
+    send({"id": next_id, "method": method, "params": params})
+    response = receive_until(lambda m: m.get("id") == next_id)
+    assert "error" not in response, response
+    return response["result"]
+
+
+def notify(method: str, params: Any):
+    send({"method": method, "params": params})
+
+
+def diagnostics() -> List[Dict[str, Any]]:
+    message = receive_until(
+        lambda m: m.get("method") == "textDocument/publishDiagnostics")
+    return message["params"]["diagnostics"]
+
+
+def position(text: str, needle: str, delta: int = 0) -> Dict[str, int]:
+    offset = text.index(needle) + delta
+    line = text.count("\n", 0, offset)
+    return {
+        "line": line,
+        "character": offset - text.rfind("\n", 0, offset) - 1
+    }
+
+
+with tempfile.TemporaryDirectory() as directory:
+    uri = "file://" + os.path.join(directory, "top.doty")
+    result = request("initialize", {"processId": None, "capabilities": {}})
+    assert result["capabilities"]["hoverProvider"], result
+    notify("initialized", {})
+
+    notify(
+        "textDocument/didOpen", {
+            "textDocument": {
+                "uri": uri,
+                "languageId": "doty",
+                "version": 1,
+                "text": TEXT
+            }
+        })
+    assert diagnostics() == []
+
+    hover = request("textDocument/hover", {
+        "textDocument": {
+            "uri": uri
+        },
+        "position": position(TEXT, "let s", 4)
+    })
+    assert "s: u32 @C" in hover["contents"]["value"], hover
+
+    # Introduce an unknown name with an incremental edit.
+    at = position(TEXT, "\n}\n", 1)
+    notify(
+        "textDocument/didChange", {
+            "textDocument": {
+                "uri": uri,
+                "version": 2
+            },
+            "contentChanges": [{
+                "range": {
+                    "start": at,
+                    "end": at
+                },
+                "text": "    let t = nope;\n"
+            }]
+        })
+    errors = diagnostics()
+    assert len(errors) == 1, errors
+    assert errors[0]["message"] == "unknown name `nope`", errors
+    assert errors[0]["range"]["start"] == {"line": 3, "character": 12}, errors
+
+    # Replace the whole text to fix the error again.
+    notify(
+        "textDocument/didChange", {
+            "textDocument": {
+                "uri": uri,
+                "version": 3
+            },
+            "contentChanges": [{
+                "text": TEXT
+            }]
+        })
+    assert diagnostics() == []
+
+    assert request("shutdown", None) is None
+    notify("exit", None)
+    assert server.wait(timeout=30) == 0
@@ -0,0 +1,52 @@
+# RUN: %python %s
+
+# Serialize the resolved syntax trees of the test inputs, deserialize them
+# again, and check that the dumps of the trees and their bindings are the same
+# as before, with and without the source text stored in the encoding.
+import io
+import os
+import tempfile
+from src.driver import parse_files
+from src.dump import dump_tree
+from src.names import resolve_names
+from src.serialize import AstReader, serialize_ast
+from typing import *
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+INPUTS = [
+    "operators.doty", "parser.doty", "scratch.doty", "imports/imports.doty"
+]
+
+
+def dumps(root) -> Tuple[str, str]:
+    text = io.StringIO()
+    ndjson = io.StringIO()
+    dump_tree(root, text)
+    dump_tree(root, ndjson, "ndjson")
+    return text.getvalue(), ndjson.getvalue()
+
+
+for name in INPUTS:
+    root = parse_files([os.path.join(TEST_DIR, name)])
+    assert root is not None, name
+    resolve_names(root)
+    expected = dumps(root)
+    for include_source in [True, False]:
+        reader = AstReader(serialize_ast(root, include_source))
+        copy = reader.root()
+        assert dumps(copy) == expected, (name, include_source)
+        assert copy.loc.file.path == root.loc.file.path, name
+        assert bytes(copy.loc.file.contents) == bytes(
+            root.loc.file.contents), name
+
+# A file without items keeps its contents as well.
+with tempfile.TemporaryDirectory() as directory:
+    path = os.path.join(directory, "empty.doty")
+    with open(path, "w") as f:
+        f.write("// no items\n")
+    root = parse_files([path])
+    assert root is not None and not root.items
+    copy = AstReader(serialize_ast(root)).root()
+    assert bytes(copy.loc.file.contents) == b"// no items\n"
+    assert (copy.loc.offset, copy.loc.length) == (root.loc.offset,
+                                                  root.loc.length)
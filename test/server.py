@@ -0,0 +1,78 @@
+# RUN: %python %s %t.sock
+
+# Start `doty --server` and compile through it by setting DOTY_SERVER. Check
+# that each request produces the same output and exit code as a direct run:
+# once with a type error, again with the file unchanged such that the parsed
+# file is reused, and once more after fixing the error, such that the file is
+# parsed again. Then shut the server down.
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+from typing import *
+
+DOTY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "doty")
+SOCKET = sys.argv[1]
+
+BROKEN = """\
+mod add<U>(a: u32 @U, b: u32 @U) -> (z: u32 @U) {}
+mod top<C, D>(x: u32 @C, y: u32 @D) {
+    let s = add(x, y);
+}
+"""
+FIXED = BROKEN.replace("y: u32 @D", "y: u32 @C")
+
+env = dict(os.environ)
+env.pop("DOTY_SERVER", None)
+# The server stops on SIGINT, which the test runner may have set to be ignored.
+server = subprocess.Popen(
+    [sys.executable, DOTY, "--server", "--socket", SOCKET],
+    stderr=subprocess.PIPE,
+    text=True,
+    env=env,
+    preexec_fn=lambda: signal.signal(signal.SIGINT, signal.SIG_DFL))
+assert server.stderr is not None
+assert server.stderr.readline() == f"doty: serving on {SOCKET}\n"
+
+
+# Compile a file directly or through the server. Returns the exit code, the
+# output, and the passes that were timed.
+def run(path: str, stats_path: str,
+        use_server: bool) -> Tuple[int, str, str, List[str]]:
+    run_env = dict(env, DOTY_SERVER=SOCKET) if use_server else env
+    result = subprocess.run(
+        [sys.executable, DOTY, path, "--no-cache", "--stats-json", stats_path],
+        capture_output=True,
+        text=True,
+        env=run_env)
+    with open(stats_path) as f:
+        passes = [stats["name"] for stats in json.load(f)["passes"]]
+    return result.returncode, result.stdout, result.stderr, passes
+
+
+try:
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "design.doty")
+        stats_path = os.path.join(directory, "stats.json")
+        for text, code, parsed in [(BROKEN, 1, True), (BROKEN, 1, False),
+                                   (FIXED, 0, True)]:
+            with open(path, "w") as f:
+                f.write(text)
+            direct = run(path, stats_path, False)
+            served = run(path, stats_path, True)
+            assert direct[0] == code, direct
+            assert served[:3] == direct[:3], (served, direct)
+            # Files are only lexed again if they changed.
+            assert ("lex" in served[3]) == parsed, served
+            assert "lex" in direct[3], direct
+finally:
+    server.send_signal(signal.SIGINT)
+    try:
+        code = server.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        raise
+assert code == 0, code
+assert not os.path.exists(SOCKET)
@@ -0,0 +1,41 @@
+# RUN: %python %s
+
+# Type-check a generated design on one and on several worker processes, and
+# check that the trace records and diagnostics are the same.
+import os
+import subprocess
+import sys
+import tempfile
+from bench.generate import DesignParams, write_design
+from typing import *
+
+DOTY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "doty")
+
+# Enough modules to be checked in parallel, calling each other such that the
+# modules of a batch are interleaved with those of other batches.
+PARAMS = DesignParams(modules=100, stmts=6, fanout=3, depth=3, domains=2)
+
+env = dict(os.environ)
+env.pop("DOTY_SERVER", None)
+
+
+def run(path: str, directory: str, jobs: int) -> Tuple[str, str]:
+    trace_file = os.path.join(directory, f"trace-j{jobs}.json")
+    result = subprocess.run([
+        sys.executable, DOTY, path, "--no-cache", "--trace", "typeck,infer",
+        "--trace-file", trace_file, f"-j{jobs}"
+    ],
+                            capture_output=True,
+                            text=True,
+                            env=env)
+    assert result.returncode == 0, result.stderr
+    with open(trace_file) as f:
+        return f.read(), result.stderr
+
+
+with tempfile.TemporaryDirectory() as directory:
+    path = write_design(PARAMS, directory)
+    trace, stderr = run(path, directory, 1)
+    assert trace.count("\n") > PARAMS.modules, trace
+    for jobs in [2, 4]:
+        assert run(path, directory, jobs) == (trace, stderr), jobs